@@ -15,4 +15,119 @@ def get_database_url() -> str:
             f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}"
             f"@{os.getenv('POSTGRES_HOST')}:{os.getenv('POSTGRES_PORT')}/{os.getenv('POSTGRES_DB')}"
         )
-    
\ No newline at end of file
+
+def get_async_database_url() -> str:
+    """獲取 async (asyncpg) 資料庫連接字串"""
+    return get_database_url().replace("postgresql://", "postgresql+asyncpg://", 1)
+
+def get_replica_database_urls() -> list:
+    """唯讀 replica 的連接字串 (帳號、密碼與資料庫名稱同 primary)"""
+    urls = []
+    for host in filter(None, (h.strip() for h in os.getenv('POSTGRES_REPLICA_HOSTS', '').split(','))):
+        host, _, port = host.partition(':')
+        urls.append(
+            f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}"
+            f"@{host}:{port or os.getenv('POSTGRES_PORT')}/{os.getenv('POSTGRES_DB')}"
+        )
+    return urls
+
+# 讀取路由改走 replica 的條件：延遲 (秒) 不超過 REPLICA_MAX_LAG，每 REPLICA_LAG_POLL 秒量測一次；
+# client 寫入後 READ_YOUR_WRITES_SECONDS 秒內的讀取仍走 primary (需大於 REPLICA_MAX_LAG + REPLICA_LAG_POLL)
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 1))
+REPLICA_LAG_POLL = float(os.getenv('REPLICA_LAG_POLL', 1))
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+
+# 路由是否改用 async engine (asyncpg)，需另外安裝 asyncpg
+DB_ASYNC = os.getenv('DB_ASYNC', 'false').lower() == 'true'
+
+# in-process catalog 索引 (營業時間等) 的保底失效秒數，0 表示只依寫入事件失效
+CATALOG_INDEX_TTL = float(os.getenv('CATALOG_INDEX_TTL', 60))
+# /search/suggest 的索引在寫入後延遲幾秒才於背景重建，期間的連續寫入合併成一次
+SUGGEST_REFRESH_DELAY = float(os.getenv('SUGGEST_REFRESH_DELAY', 0.1))
+# catalog 快取 (藥局與其口罩) 最多保留幾間藥局，超過時淘汰最久未使用的
+CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', 10000))
+# 以 LISTEN 接收 etl.py 建立的 trigger 送出的 NOTIFY，讓其他 process 的寫入立即失效
+# 經由 transaction pooling 模式的 pgbouncer 連線時 LISTEN 無效，可關閉並只依 TTL
+CATALOG_LISTEN = os.getenv('CATALOG_LISTEN', 'true').lower() == 'true'
+
+# 資料版本 (ETag) 的輪詢間隔秒數；版本需連續兩次讀到相同的值才會使用
+CATALOG_VERSION_POLL = float(os.getenv('CATALOG_VERSION_POLL', 1))
+# 帶 ETag 的 response 的 Cache-Control max-age，0 表示每次都需向 server 確認 (no-cache)
+CATALOG_CACHE_MAX_AGE = float(os.getenv('CATALOG_CACHE_MAX_AGE', 0))
+
+# /search 的實作: memory (in-process n-gram 索引) 或 pg_trgm (需先建立 pg_trgm GIN 索引)
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'memory')
+# /pharmacies/filter 的實作: memory (in-process 價格排序陣列) 或 sql (GROUP BY，走 (price, pharmacy_id) 索引)
+FILTER_BACKEND = os.getenv('FILTER_BACKEND', 'memory')
+# 消費統計 (top_spenders、transactions/*) 的實作: sql 或 columnar (in-process NumPy 欄式快照，需安裝 numpy)
+ANALYTICS_BACKEND = os.getenv('ANALYTICS_BACKEND', 'sql')
+# columnar 快照的增量更新間隔與完整重建間隔 (秒)
+ANALYTICS_REFRESH_INTERVAL = float(os.getenv('ANALYTICS_REFRESH_INTERVAL', 1))
+ANALYTICS_FULL_REFRESH = float(os.getenv('ANALYTICS_FULL_REFRESH', 3600))
+# 快照的 Parquet 檔 (需安裝 pyarrow)，重新啟動時先讀檔再補上新的交易；空字串表示不使用
+ANALYTICS_PARQUET = os.getenv('ANALYTICS_PARQUET', '')
+
+# 餘額寫入方式: direct (直接更新 cash_balance) 或 ledger (append 到 balance_ledger，背景 rollup)
+BALANCE_MODE = os.getenv('BALANCE_MODE', 'direct')
+# ledger rollup 的執行間隔 (秒) 與每批處理筆數
+LEDGER_ROLLUP_INTERVAL = float(os.getenv('LEDGER_ROLLUP_INTERVAL', 5))
+LEDGER_ROLLUP_BATCH = int(os.getenv('LEDGER_ROLLUP_BATCH', 10000))
+
+# POST /purchases/batch 單次最多幾筆購買
+PURCHASE_BATCH_MAX = int(os.getenv('PURCHASE_BATCH_MAX', 5000))
+
+# daily_spend 每天拆成幾列 (依 user_id 分散)，降低同一天購買的寫入競爭
+DAILY_SPEND_SHARDS = int(os.getenv('DAILY_SPEND_SHARDS', 16))
+
+# 列表路由略過 response_model 驗證，以 orjson (未安裝時為標準 json) 直接編碼
+FAST_RESPONSES = os.getenv('FAST_RESPONSES', 'false').lower() == 'true'
+# client 接受 gzip 時，超過此大小 (bytes) 的 response 會壓縮；負數表示不壓縮
+GZIP_MIN_SIZE = int(os.getenv('GZIP_MIN_SIZE', 1024))
+
+# purchase_histories 每月分區的維護：預設由 cron 執行 `migrate.py partitions`；
+# PARTITION_MAINTENANCE_INTERVAL > 0 時改由 API 的背景 thread 定期執行 (只在一個 instance 上設定即可)
+# 預先建立未來幾個月的分區；保留最近幾個月，更早的分區卸離為獨立的表，0 表示全部保留
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv('PARTITION_MAINTENANCE_INTERVAL', 0))
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 3))
+PARTITION_RETENTION_MONTHS = int(os.getenv('PARTITION_RETENTION_MONTHS', 0))
+
+# 單一請求執行超過此數量的 SQL 時記錄警告 (找出 N+1)，0 表示不警告
+QUERY_COUNT_WARN = int(os.getenv('QUERY_COUNT_WARN', 20))
+
+# /internal/* (連線池、快取、replica 與 statement profiler 的狀態) 需帶的 X-Internal-Token；
+# 未設定時不掛載這些路由 (會洩漏 SQL 與其參數)
+INTERNAL_TOKEN = os.getenv('INTERNAL_TOKEN', '')
+
+# statement profiler (GET /internal/queries)：依正規化後的 SQL 統計次數與耗時，預設關閉
+QUERY_PROFILE = os.getenv('QUERY_PROFILE', 'false').lower() == 'true'
+# 超過此毫秒數視為慢查詢，依 EXPLAIN_SAMPLE_RATE 抽樣在另一條連線以 EXPLAIN (ANALYZE, BUFFERS) 重跑
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))
+EXPLAIN_SAMPLE_RATE = float(os.getenv('EXPLAIN_SAMPLE_RATE', 0.1))
+# 每個 statement 保留最近幾份執行計畫
+QUERY_PROFILE_PLANS = int(os.getenv('QUERY_PROFILE_PLANS', 3))
+# POST /internal/queries/dump 與關閉時寫出的檔案
+QUERY_PROFILE_DUMP = os.getenv('QUERY_PROFILE_DUMP', './query_profile.json')
+
+# 連線池設定 (每個 worker 各自一個 pool)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', -1))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'false').lower() == 'true'
+
+# 啟動時 (背景，完成前 /readyz 回 503)：是否檢查 migration、預先建立連線池的連線、預先載入 catalog
+SCHEMA_CHECK = os.getenv('SCHEMA_CHECK', 'true').lower() == 'true'
+WARM_POOL = os.getenv('WARM_POOL', 'true').lower() == 'true'
+CATALOG_PRELOAD = os.getenv('CATALOG_PRELOAD', 'false').lower() == 'true'
+# 啟動 (import 到 ready) 的預期秒數，超過時記錄警告
+STARTUP_BUDGET = float(os.getenv('STARTUP_BUDGET', 10))
+
+def get_pool_options() -> dict:
+    """create_engine / create_async_engine 共用的連線池參數"""
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
@@ -1,12 +1,83 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Callable, TypeVar
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from .config import get_database_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.util import await_only
+from .config import (
+    DB_ASYNC,
+    QUERY_PROFILE,
+    get_async_database_url,
+    get_database_url,
+    get_pool_options,
+    get_replica_database_urls
+)
+from .utils.pool_metrics import instrument_engine, instrumented_pool_class
+from .utils.replica_router import replica_router
+from .utils.request_metrics import track_request_queries
 
-engine = create_engine(get_database_url(), echo=False)
+engine = create_engine(
+    get_database_url(),
+    echo=False,
+    poolclass=instrumented_pool_class("primary"),
+    **get_pool_options()
+)
+instrument_engine("primary", engine)
+track_request_queries(engine)
+if QUERY_PROFILE:
+    from .utils.query_profiler import profile_engine
+    profile_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+T = TypeVar("T")
+
+# 唯讀 replica (POSTGRES_REPLICA_HOSTS)，每個各自一個連線池；讀取路由經由 get_read_db 分配
+replica_sessions = []
+for index, url in enumerate(get_replica_database_urls()):
+    name = f"replica{index}"
+    replica_engine = create_engine(url, echo=False, poolclass=instrumented_pool_class(name), **get_pool_options())
+    instrument_engine(name, replica_engine)
+    track_request_queries(replica_engine)
+    if QUERY_PROFILE:
+        profile_engine(replica_engine)
+    replica_router.register(name, replica_engine)
+    replica_sessions.append(sessionmaker(autocommit=False, autoflush=False, bind=replica_engine,
+                                         info={"replica": True}))
+
+# DB_ASYNC=true 時才建立 async engine，未使用時不需要安裝 asyncpg
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        get_async_database_url(),
+        echo=False,
+        poolclass=instrumented_pool_class("primary_async", is_async=True),
+        **get_pool_options()
+    )
+    instrument_engine("primary_async", async_engine.sync_engine)
+    track_request_queries(async_engine.sync_engine)
+    if QUERY_PROFILE:
+        profile_engine(async_engine.sync_engine)
+    # commit 後物件仍要在 greenlet 外序列化成 response，不能 expire
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async_replica_sessions = []
+    for index, url in enumerate(get_replica_database_urls()):
+        name = f"replica{index}_async"
+        replica_engine = create_async_engine(url.replace("postgresql://", "postgresql+asyncpg://", 1), echo=False,
+                                             poolclass=instrumented_pool_class(name, is_async=True),
+                                             **get_pool_options())
+        instrument_engine(name, replica_engine.sync_engine)
+        track_request_queries(replica_engine.sync_engine)
+        if QUERY_PROFILE:
+            profile_engine(replica_engine.sync_engine)
+        async_replica_sessions.append(async_sessionmaker(replica_engine, autoflush=False, expire_on_commit=False,
+                                                         info={"replica": True}))
+
 def get_db():
     """
     FastAPI 在路由裡取得 DB session
@@ -15,4 +86,63 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """
+    FastAPI 在 async 路由裡取得 AsyncSession
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_read_db():
+    """
+    唯讀路由的 DB session：有可用的 replica 時走 replica，否則 (延遲過大、寫入後的 read-your-writes 期限內) 走 primary
+    """
+    index = replica_router.choose()
+    db = (SessionLocal if index is None else replica_sessions[index])()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db():
+    """
+    get_read_db 的 AsyncSession 版本
+    """
+    index = replica_router.choose()
+    async with (AsyncSessionLocal if index is None else async_replica_sessions[index])() as db:
+        yield db
+
+@contextmanager
+def primary_session(db):
+    """
+    in-process 索引、快取與 snapshot 的重建一律讀 primary：db 為 replica 的 session 時另開一個 primary 的 session
+    (replica 可能尚未重播觸發失效的寫入，用它重建會把舊資料快取到下次失效或 TTL 到期)
+    """
+    if not db.info.get("replica"):
+        yield db
+        return
+    with SessionLocal() as primary:
+        yield primary
+
+def run_on_primary(db, func: Callable[[Session], T]) -> T:
+    """
+    以 primary 的 session 執行 func (重建 in-process 索引、載入快取與 snapshot)
+    - 同步路由：在目前的 thread 執行，session 的選擇見 primary_session
+    - DB_ASYNC=true 時在 event loop thread 上 (AsyncSession.run_sync 的 greenlet 內)：改在 executor 的 thread
+      以同步 engine 的 primary session 執行，await_only 交還 event loop；
+      排序、建 n-gram 等 CPU 密集的重建不會卡住同一個 worker 上其他進行中的請求
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is None:
+        with primary_session(db) as primary:
+            return func(primary)
+
+    def run() -> T:
+        with SessionLocal() as primary:
+            return func(primary)
+    return await_only(loop.run_in_executor(None, run))
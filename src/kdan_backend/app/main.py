@@ -1,16 +1,65 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .database import Base, engine
-from .routers import pharmacies, users, search
+from fastapi.middleware.gzip import GZipMiddleware
+from .config import (
+    CATALOG_LISTEN,
+    GZIP_MIN_SIZE,
+    INTERNAL_TOKEN,
+    PARTITION_MAINTENANCE_INTERVAL,
+    QUERY_PROFILE,
+    QUERY_PROFILE_DUMP
+)
+from .database import engine
+from .utils.startup import start_warm_up
+from .utils.catalog_listener import start_catalog_listener
+from .utils.catalog_version import start_version_poller
+from .utils.ledger_helper import is_ledger_mode, start_rollup_worker
+from .utils.partition_helper import start_partition_maintenance
+from .utils.query_profiler import query_profiler, start_explain_worker
+from .utils.replica_router import PIN_HEADER, ReadYourWritesMiddleware, replica_router, start_replica_monitor
+from .utils.request_metrics import RequestMetricsMiddleware
+from .routers import health, internal, metrics, pharmacies, purchases, users, search
 from fastapi.middleware.cors import CORSMiddleware
+from .utils.pagination import NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER
 
-# 若想在首次啟動時自動建表 (僅開發環境建議)
-# 不建議生產環境自動執行，避免破壞既有資料
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    啟動時只開背景 thread，不在這裡連線 DB：
+    - 預熱 (連線池、migration 檢查、catalog 預載) 完成前 /readyz 回 503，DB 暫時無法連線時會重試
+    - ledger 模式：定期把餘額異動併回 cash_balance
+    - 輪詢資料版本，產生 catalog 路由的 ETag
+    - LISTEN 其他 process 的 catalog 寫入，讓本 worker 的快取與索引失效
+    - 定期建立未來月份的 purchase_histories 分區 (以及卸離超過保留期限的分區)
+    - 有設定 replica 時，定期量測各 replica 的延遲 (超過 REPLICA_MAX_LAG 的不分配讀取)
+    - QUERY_PROFILE：在旁路連線 EXPLAIN 抽樣到的慢查詢，關閉時把統計寫到 QUERY_PROFILE_DUMP
+    """
+    stops = [start_warm_up(asyncio.get_running_loop())]
+    if is_ledger_mode():
+        stops.append(start_rollup_worker())
+    stops.append(start_version_poller())
+    if CATALOG_LISTEN:
+        stops.append(start_catalog_listener())
+    if PARTITION_MAINTENANCE_INTERVAL > 0:
+        stops.append(start_partition_maintenance())
+    if replica_router.replicas:
+        stops.append(start_replica_monitor(engine))
+    if QUERY_PROFILE:
+        stops.append(start_explain_worker(engine))
+    try:
+        yield
+    finally:
+        for stop in stops:
+            stop.set()
+        if QUERY_PROFILE and QUERY_PROFILE_DUMP:
+            query_profiler.dump(QUERY_PROFILE_DUMP)
 
 app = FastAPI(
     title="Pharmacy Platform API",
     description="Pharmacy Platform API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 origins = [
@@ -24,9 +73,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER, "ETag", PIN_HEADER],
 )
 
+# client 帶 Accept-Encoding: gzip 時壓縮較大的 response (串流的 response 也會逐段壓縮)
+if GZIP_MIN_SIZE >= 0:
+    app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE)
+
+# 寫入後的請求帶回 read-your-writes 期限，期限內的讀取走 primary
+if replica_router.replicas:
+    app.add_middleware(ReadYourWritesMiddleware)
+
+# 最外層：每個路由的延遲、送出的 bytes 與 SQL 數 (GET /metrics)
+app.add_middleware(RequestMetricsMiddleware)
+
 # 將路由掛進主 app
+app.include_router(health.router)
 app.include_router(pharmacies.router)
 app.include_router(users.router)
-app.include_router(search.router)
\ No newline at end of file
+app.include_router(purchases.router)
+app.include_router(search.router)
+# 內部狀態會洩漏 SQL 與參數，只在設定 INTERNAL_TOKEN 時掛載
+if INTERNAL_TOKEN:
+    app.include_router(internal.router)
+app.include_router(metrics.router)
\ No newline at end of file
@@ -1,6 +1,7 @@
 # app/models.py
+# ORM 對應；資料表、索引與外鍵由 migrations/ 建立，這裡的 Index 只是對照
 from sqlalchemy import (
-    Column, Integer, Float, DateTime, ForeignKey, Time, String, Enum
+    BigInteger, Column, Date, Integer, Float, DateTime, ForeignKey, Index, SmallInteger, Time, String, Enum, func
 )
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -22,12 +23,17 @@ class Pharmacy(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
     cash_balance = Column(Float, default=0)
+    content_hash = Column(String(32))  # etl.py 增量匯入比對來源資料是否變更
 
     # 一間藥局對多個開店時段
     opening_hours = relationship("PharmacyOpeningHours", back_populates="pharmacy", cascade="all, delete-orphan")
     # 一間藥局對多個口罩商品
     masks = relationship("Mask", back_populates="pharmacy", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ux_pharmacies_name", "name", unique=True),
+    )
+
 class PharmacyOpeningHours(Base):
     __tablename__ = "pharmacy_opening_hours"
 
@@ -39,6 +45,10 @@ class PharmacyOpeningHours(Base):
 
     pharmacy = relationship("Pharmacy", back_populates="opening_hours")
 
+    __table_args__ = (
+        Index("ix_opening_hours_day_pharmacy", "day_of_week", "pharmacy_id"),
+    )
+
 class Mask(Base):
     __tablename__ = "masks"
 
@@ -46,29 +56,94 @@ class Mask(Base):
     pharmacy_id = Column(Integer, ForeignKey("pharmacies.id"), nullable=False)
     name = Column(String(255), nullable=False)
     price = Column(Float, default=0)
+    content_hash = Column(String(32))
 
     pharmacy = relationship("Pharmacy", back_populates="masks")
 
+    __table_args__ = (
+        Index("ux_masks_pharmacy_name", "pharmacy_id", "name", unique=True),
+        # 列表分頁的排序鍵
+        Index("ix_masks_pharmacy_id", "pharmacy_id", "id"),
+        Index("ix_masks_pharmacy_price", "pharmacy_id", "price", "id"),
+        # /pharmacies/filter (FILTER_BACKEND=sql) 的價格區間
+        Index("ix_masks_price_pharmacy", "price", "pharmacy_id"),
+    )
+
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
     cash_balance = Column(Float, default=0)
+    content_hash = Column(String(32))
 
     purchase_histories = relationship("PurchaseHistory", back_populates="user", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ux_users_name", "name", unique=True),
+    )
+
 class PurchaseHistory(Base):
     __tablename__ = "purchase_histories"
 
-    id = Column(Integer, primary_key=True, index=True)
+    # 依 transaction_date 每月分區 (migrations/m0004)，主鍵需包含分區欄位
+    id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     pharmacy_id = Column(Integer, ForeignKey("pharmacies.id"), nullable=False)
     mask_id = Column(Integer, ForeignKey("masks.id"), nullable=True)
     mask_name = Column(String(255))
     quantity = Column(Integer, default=1)
     transaction_amount = Column(Float, default=0)
-    transaction_date = Column(DateTime)
+    transaction_date = Column(DateTime, primary_key=True)
+    # 由 etl.py 匯入的紀錄才有：使用者名稱 + 交易時間，API 新增的購買為 NULL
+    etl_key = Column(String)
+    content_hash = Column(String(32))
 
     user = relationship("User", back_populates="purchase_histories")
     # 可選: relationship 到 mask / pharmacy，如需再加
+
+    __table_args__ = (
+        Index("ux_purchase_histories_etl_key", "etl_key", "transaction_date", unique=True),
+        Index("ix_purchase_histories_user_id", "user_id", "id"),
+        Index("ix_purchase_histories_transaction_date", "transaction_date"),
+        {"postgresql_partition_by": "RANGE (transaction_date)"},
+    )
+
+class BalanceLedger(Base):
+    """
+    BALANCE_MODE=ledger 時，交易只 append 餘額異動，由背景 rollup 併回
+    users / pharmacies 的 cash_balance
+    """
+    __tablename__ = "balance_ledger"
+
+    id = Column(BigInteger, primary_key=True)
+    account_type = Column(String(16), nullable=False)  # 'user' or 'pharmacy'
+    account_id = Column(Integer, nullable=False)
+    delta = Column(Float, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_balance_ledger_account", "account_type", "account_id"),
+    )
+
+class UserDailySpend(Base):
+    """
+    每位使用者每天的消費彙總，於購買的 transaction 內一併更新，可由 etl.py 重建
+    """
+    __tablename__ = "user_daily_spend"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    total_quantity = Column(BigInteger, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0)
+
+class DailySpend(Base):
+    """
+    全站每天的消費彙總；依 user_id 分成多個 shard，避免同一天的購買都更新同一列
+    """
+    __tablename__ = "daily_spend"
+
+    day = Column(Date, primary_key=True)
+    shard = Column(SmallInteger, primary_key=True)
+    total_quantity = Column(BigInteger, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0)
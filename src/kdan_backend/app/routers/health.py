@@ -0,0 +1,22 @@
+# app/routers/health.py
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.utils.startup import startup_state
+
+router = APIRouter(tags=["Health"])
+
+@router.get("/healthz")
+def healthz():
+    """
+    Liveness: the process is up. Does not touch the database.
+    """
+    return {"status": "ok"}
+
+@router.get("/readyz")
+def readyz():
+    """
+    Readiness: 200 once the startup warm-up (pool, schema check, catalog preload) has finished, 503 before.
+    The body carries the time spent in each startup phase and whether it stayed within STARTUP_BUDGET.
+    """
+    snapshot = startup_state.snapshot()
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
@@ -0,0 +1,82 @@
+# app/routers/internal.py
+import hmac
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from typing import Optional
+from app.config import INTERNAL_TOKEN, QUERY_PROFILE, QUERY_PROFILE_DUMP
+from app.utils.catalog_index import cache_stats
+from app.utils.pool_metrics import pool_snapshots
+from app.utils.purchase_analytics import purchase_snapshot
+from app.utils.query_profiler import query_profiler
+from app.utils.replica_router import replica_router
+
+TOKEN_HEADER = "X-Internal-Token"
+
+def require_internal_token(token: Optional[str] = Header(None, alias=TOKEN_HEADER)):
+    """
+    /internal/* 只接受帶有正確 X-Internal-Token 的請求 (INTERNAL_TOKEN 未設定時路由不會掛載)
+    """
+    if not INTERNAL_TOKEN or token is None or not hmac.compare_digest(token.encode(), INTERNAL_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+router = APIRouter(prefix="/internal", tags=["Internal"], dependencies=[Depends(require_internal_token)])
+
+@router.get("/pool")
+def pool_status():
+    """
+    Connection pool usage of this worker: current in-use / overflow counts,
+    plus checkout-wait and checkout-duration histograms (seconds, cumulative buckets).
+    """
+    return pool_snapshots()
+
+
+@router.get("/catalog_cache")
+def catalog_cache_status():
+    """
+    Catalog cache of this worker: entry count and hit / miss / eviction / invalidation counters.
+    """
+    return cache_stats()
+
+@router.get("/replicas")
+def replica_status():
+    """
+    Read replicas of this worker: measured lag, whether reads are routed to each,
+    and how many reads fell back to the primary because no replica was within REPLICA_MAX_LAG.
+    """
+    return replica_router.snapshot()
+
+@router.get("/analytics")
+def analytics_status():
+    """
+    Columnar purchase snapshot of this worker (ANALYTICS_BACKEND=columnar): rows, segments, max id and memory.
+    """
+    return purchase_snapshot.stats()
+
+def _require_profiler() -> None:
+    if not QUERY_PROFILE:
+        raise HTTPException(status_code=404, detail="Query profiling is disabled (set QUERY_PROFILE=true)")
+
+@router.get("/queries")
+def query_profile(limit: int = Query(50, ge=1, le=1000, description="Max number of statements, by total time.")):
+    """
+    SQL statements of this worker grouped by normalized fingerprint: calls, total / mean / max time,
+    and the EXPLAIN (ANALYZE, BUFFERS) plans sampled from slow calls.
+    """
+    _require_profiler()
+    return query_profiler.snapshot(limit)
+
+@router.post("/queries/dump")
+def dump_query_profile():
+    """
+    Write the full statement profile of this worker to QUERY_PROFILE_DUMP as JSON.
+    """
+    _require_profiler()
+    return {"path": query_profiler.dump(QUERY_PROFILE_DUMP)}
+
+@router.delete("/queries")
+def reset_query_profile():
+    """
+    Clear the statement profile of this worker.
+    """
+    _require_profiler()
+    query_profiler.reset()
+    return {"message": "Query profile cleared"}
@@ -0,0 +1,17 @@
+# app/routers/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.utils.request_metrics import render_prometheus
+
+router = APIRouter(tags=["Internal"])
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Per-route latency, response size, SQL statements and SQL time per request of this worker,
+    plus connection pool usage, in Prometheus text format.
+    """
+    return PlainTextResponse(render_prometheus(), media_type=CONTENT_TYPE)
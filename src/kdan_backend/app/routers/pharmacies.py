@@ -1,108 +1,198 @@
 # app/routers/pharmacies.py
-from fastapi import APIRouter, Depends, Path, Query
-from sqlalchemy import asc, desc, func, select
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from typing import Dict, List, Literal, Optional
-from datetime import time
-from app.database import get_db
+from app.config import FILTER_BACKEND
+from app.database import get_db, get_read_db
 from app.models import Pharmacy, Mask, DayOfWeekEnum
 from app.schemas import MaskBase, Pharmacy as PharmacySchema, Mask as MaskSchema
-from app.utils.time_helper import is_open_now
+from app.utils.async_helper import db_route
+from app.utils.catalog_version import balance_version, catalog_version, conditional_get
+from app.utils.fast_response import grouped_response, list_response
+from app.utils.ledger_helper import with_pending_balances
+from app.utils.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NUMBER,
+    TOTAL_COUNT_HEADER,
+    decode_cursor,
+    finish_page,
+    keyset_query,
+    keyset_slice,
+    set_total_count
+)
+from app.utils.pharmacy_cache import pharmacy_cache
+from app.utils.price_index import count_filter_query, price_index
+from app.utils.schedule_index import schedule_index
+from app.utils.time_helper import MINUTES_PER_DAY, minute_of_week, parse_time_str
 
 
 router = APIRouter(prefix="/pharmacies", tags=["Pharmacies"])
 
 @router.get("/all_pharmacies", response_model=List[PharmacySchema])
-def list_all_pharmacies(db: Session = Depends(get_db)):
+@db_route
+def list_all_pharmacies(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Max number of pharmacies in this page."),
+    after: Optional[str] = Query(None, description="Value of the X-Next-Cursor header from the previous page."),
+    include_total: bool = Query(False, description="Also return the total count in the X-Total-Count header."),
+    db: Session = Depends(get_db)
+):
     """
-    撈全部藥局 (即 pharmacies 表內所有資料)
+    撈全部藥局 (即 pharmacies 表內所有資料)，依 id 分頁
+    e.g. GET /pharmacies/all_pharmacies?limit=100, then pass the X-Next-Cursor header as ?after= for the next page.
+    Responses carry an ETag; send it back as If-None-Match to get a 304 while nothing changed.
     """
-    return db.query(Pharmacy).all()
+    # 版本未變時直接回 304，不查詢 DB
+    not_modified = conditional_get(request, response, [catalog_version, balance_version])
+    if not_modified is not None:
+        return not_modified
+
+    query = select(Pharmacy)
+    if include_total:
+        set_total_count(response, db, query)
+    pharmacies = db.execute(keyset_query(query, [Pharmacy.id], decode_cursor(after, [int]), limit)).scalars().all()
+    pharmacies = with_pending_balances(db, finish_page(pharmacies, limit, lambda ph: [ph.id], response))
+    return list_response(request, response, pharmacies, PharmacySchema)
 
 @router.get("/open", response_model=List[PharmacySchema])
-def get_open_pharmacies(day_of_week: DayOfWeekEnum, time_str: Optional[str], db: Session = Depends(get_db)):
+@db_route
+def get_open_pharmacies(
+    request: Request,
+    response: Response,
+    day_of_week: DayOfWeekEnum,
+    time_str: Optional[str],
+    end_time_str: Optional[str] = Query(None, description="If given, only pharmacies open for the whole window time_str ~ end_time_str."),
+    db: Session = Depends(get_read_db)
+):
     """
     List all pharmacies open at a specific time and on a day of week if requested.
     e.g. GET /pharmacies/open?day_of_week=Thur&time_str=14:00
+    e.g. GET /pharmacies/open?day_of_week=Thur&time_str=13:00&end_time_str=15:00
+    An end_time_str earlier than time_str means the window runs past midnight.
     """
-    query = db.query(Pharmacy)
-    pharmacies = query.all()
-
-    # 轉換 time_str -> time
-    hour_min = time_str.split(":")
-    check_time = time(int(hour_min[0]), int(hour_min[1]) if len(hour_min) > 1 else 0)
-
-    result = []
-    for ph in pharmacies:
-        ohs = ph.opening_hours
-        is_open = False
-        for oh in ohs:
-            if oh.day_of_week.value == day_of_week:
-                if is_open_now(oh.open_time, oh.close_time, check_time):
-                    is_open = True
-                    break
-        if is_open:
-            result.append(ph)
-    return result
+    # 轉換 time_str -> minute-of-week
+    try:
+        start_minute = minute_of_week(day_of_week.value, parse_time_str(time_str))
+        end_minute = None
+        if end_time_str is not None:
+            # 結束時間早於開始時間 => 跨午夜到隔天
+            end_of_day = minute_of_week(day_of_week.value, parse_time_str(end_time_str))
+            end_minute = start_minute + (end_of_day - start_minute) % MINUTES_PER_DAY
+    except (AttributeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid time format, expected HH:MM")
+
+    # 由營業時段索引找出藥局 id，不需逐間藥局查詢營業時間
+    index = schedule_index.get(db)
+    if end_minute is None:
+        pharmacy_ids = index.open_at(start_minute)
+    else:
+        pharmacy_ids = index.open_during(start_minute, end_minute)
+    if not pharmacy_ids:
+        return list_response(request, response, [], PharmacySchema)
+
+    pharmacies = (db.query(Pharmacy)
+                  .filter(Pharmacy.id.in_(pharmacy_ids))
+                  .order_by(Pharmacy.id)
+                  .all())
+    return list_response(request, response, with_pending_balances(db, pharmacies), PharmacySchema)
 
 @router.get("/{pharmacy_id}/masks", response_model=List[MaskSchema])
+@db_route
 def list_masks_of_pharmacy(
+    request: Request,
+    response: Response,
     pharmacy_id: int = Path(..., description="The ID of the pharmacy"),
     sort_by: Literal["name", "price"] = Query("name", description="Sort masks by 'name' or 'price'."),
     sort_order: Literal["asc", "desc"] = Query("asc", description="Sort order: 'asc' for ascending, 'desc' for descending."),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Max number of masks in this page."),
+    after: Optional[str] = Query(None, description="Value of the X-Next-Cursor header from the previous page."),
+    include_total: bool = Query(False, description="Also return the total count in the X-Total-Count header."),
     db: Session = Depends(get_db)
 ):
     """
     List all masks sold by a given pharmacy, sorted by mask name or price.
     e.g. GET /pharmacies/5/masks?sort_by=price&sort_order=desc
+    Responses carry an ETag; send it back as If-None-Match to get a 304 while nothing changed.
     """
-    q = db.query(Mask).filter(Mask.pharmacy_id == pharmacy_id)
-    
-    # 根據 sort_by 來決定排序欄位
-    sort_column = Mask.name if sort_by == "name" else Mask.price
-    
+    not_modified = conditional_get(request, response, [catalog_version])
+    if not_modified is not None:
+        return not_modified
+
+    # 藥局的口罩由 catalog 快取提供，排序與分頁在記憶體中完成
+    entry = pharmacy_cache.get(db, pharmacy_id)
+    masks = list(entry.masks) if entry is not None else []
+    if include_total:
+        response.headers[TOTAL_COUNT_HEADER] = str(len(masks))
+
+    # 根據 sort_by 來決定排序鍵：名稱在同一間藥局內唯一，價格相同時再依 id
+    sort_keys = ["name"] if sort_by == "name" else ["price", "id"]
+    key_types = [str] if sort_by == "name" else [NUMBER, int]
+    key_of = lambda m: [getattr(m, key) for key in sort_keys]
+
     # 根據 sort_order 決定升序 (asc) 或 降序 (desc)
-    q = q.order_by(asc(sort_column) if sort_order == "asc" else desc(sort_column))
-    
-    return q.all()
+    masks = keyset_slice(masks, key_of, decode_cursor(after, key_types), limit,
+                         descending=sort_order == "desc")
+    masks = finish_page(masks, limit, key_of, response)
+    return list_response(request, response, masks, MaskSchema)
 
 @router.get("/filter", response_model=List[PharmacySchema])
+@db_route
 def filter_pharmacies_mask_count(
-    count_op: Literal["gt", "lt"],
+    request: Request,
+    response: Response,
+    count_op: Literal["gt", "gte", "lt", "lte", "eq", "between"],
     count_value: int,
     price_min: float,
     price_max: float,
-    db: Session = Depends(get_db)
+    count_max: Optional[int] = Query(None, description="Upper bound (inclusive) of the mask count, required for count_op=between."),
+    db: Session = Depends(get_read_db)
 ):
     """
     List all pharmacies with more or less than x mask products within a price range.
-    e.g. GET /pharmacies/filter?count_op=gt&count_val=3&price_min=10&price_max=50
+    Pharmacies with no mask in the range count as 0, so count_op=lt / lte / eq can return them.
+    e.g. GET /pharmacies/filter?count_op=gt&count_value=3&price_min=10&price_max=50
+    e.g. GET /pharmacies/filter?count_op=between&count_value=2&count_max=5&price_min=10&price_max=50
     """
-    # 先找出在 price_min~price_max 之間的 masks
-    subq = db.query(Mask.pharmacy_id).filter(Mask.price.between(price_min, price_max))
-
-    # group by pharmacy_id, 並計算符合該區間的口罩數量
-    subq_count = (db.query(Mask.pharmacy_id, func.count(Mask.id).label("cnt"))
-                  .filter(Mask.price.between(price_min, price_max))
-                  .group_by(Mask.pharmacy_id)
-                  ).subquery()
+    if count_op == "between" and count_max is None:
+        raise HTTPException(status_code=400, detail="count_max is required for count_op=between")
 
-    # 再與 pharmacies join
-    query = db.query(Pharmacy).join(subq_count, subq_count.c.pharmacy_id == Pharmacy.id)
-
-    # 篩選 count_op
-    if count_op == "gt":
-        query = query.filter(subq_count.c.cnt > count_value)
+    if FILTER_BACKEND == "sql":
+        query = count_filter_query(count_op, count_value, price_min, price_max, count_max)
+        pharmacy_ids = list(db.execute(query).scalars())
     else:
-        query = query.filter(subq_count.c.cnt < count_value)
+        # 各藥局的口罩價格已排序，區間內的數量為兩次二分搜尋
+        pharmacy_ids = price_index.get(db).filter(count_op, count_value, price_min, price_max, count_max)
+    if not pharmacy_ids:
+        return list_response(request, response, [], PharmacySchema)
 
-    return query.all()
+    pharmacies = (db.query(Pharmacy)
+                  .filter(Pharmacy.id.in_(pharmacy_ids))
+                  .order_by(Pharmacy.id)
+                  .all())
+    return list_response(request, response, with_pending_balances(db, pharmacies), PharmacySchema)
 
 @router.get("/all_masks", response_model=Dict[str, List[MaskBase]])
-def list_all_masks(db: Session = Depends(get_db)):
+@db_route
+def list_all_masks(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Max number of masks in this page."),
+    after: Optional[str] = Query(None, description="Value of the X-Next-Cursor header from the previous page."),
+    include_total: bool = Query(False, description="Also return the total count of masks in the X-Total-Count header."),
+    db: Session = Depends(get_db)
+):
     """
-    撈全部藥局的口罩 (即 masks 表內所有資料)
+    撈全部藥局的口罩 (即 masks 表內所有資料)，依 (pharmacy_id, id) 分頁
+    同一間藥局的口罩可能分在相鄰的兩頁，合併時以藥局名稱為 key 串接即可
+    帶 If-None-Match 且口罩資料未變更時回傳 304
     """
+    not_modified = conditional_get(request, response, [catalog_version])
+    if not_modified is not None:
+        return not_modified
+
     query = (
         select(
             Mask.id,
@@ -113,7 +203,15 @@ def list_all_masks(db: Session = Depends(get_db)):
         )
         .join(Pharmacy)
     )
-    result = db.execute(query).all()
+    if include_total:
+        set_total_count(response, db, select(Mask))
+    query = keyset_query(query, [Mask.pharmacy_id, Mask.id], decode_cursor(after, [int, int]), limit)
+    result = finish_page(db.execute(query).all(), limit, lambda row: [row.pharmacy_id, row.id], response)
+
+    # 依 (pharmacy_id, id) 排序，同一間藥局的列相鄰，快速模式可邊讀邊分組編碼
+    fast = grouped_response(request, response, result, "pharmacy_name", MaskBase)
+    if fast is not None:
+        return fast
     
     # 將結果整理成以藥局為 key 的字典
     grouped_masks = {}
@@ -0,0 +1,112 @@
+# app/routers/purchases.py
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List
+from app.config import PURCHASE_BATCH_MAX
+from app.database import get_db
+from app.models import User
+from app.schemas import PurchaseBatchItem, PurchaseBatchResponse, PurchaseBatchResult
+from app.utils.async_helper import db_route
+from app.utils.ledger_helper import append_balance_deltas, is_ledger_mode, pending_deltas
+from app.utils.purchase_helper import (
+    apply_balance_deltas,
+    apply_pharmacy_deltas,
+    cached_mask_pharmacies,
+    insert_purchase_histories,
+    lock_pharmacies,
+    lock_users,
+    sum_by_pharmacy
+)
+from app.utils.pharmacy_cache import pharmacy_cache
+from app.utils.rollup_helper import add_batch_to_spend_rollups
+
+router = APIRouter(prefix="/purchases", tags=["Purchases"])
+
+@router.post("/batch", response_model=PurchaseBatchResponse)
+@db_route
+def purchase_batch(items: List[PurchaseBatchItem], db: Session = Depends(get_db)):
+    """
+    多個使用者的購買一次匯入 (POS 離線交易補傳)：
+    [
+      {
+        "user_id": 1,
+        "pharmacy_id": 3,
+        "mask_id": 10,
+        "mask_name": "MaskT (green) (10 per pack)",
+        "quantity": 2,
+        "transaction_amount": 80.0,
+        "transaction_date": "2023-01-01T10:00:00"
+      },
+      ...
+    ]
+    - 每筆各自檢查，不合格的 (使用者 / 藥局 / 口罩不存在、餘額不足) 回報於 results，其餘照常寫入
+    - 同一使用者的購買依送出順序扣款，餘額不足的那幾筆才被拒絕
+    - 查詢數固定，不隨筆數增加：使用者與藥局各一次鎖定，餘額以彙總後的異動一次更新
+    """
+    if len(items) > PURCHASE_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {PURCHASE_BATCH_MAX} purchases per batch")
+
+    try:
+        # 與單筆購買相同的上鎖順序：先 user 再藥局，各自依 id 排序
+        balances = lock_users(db, (item.user_id for item in items))
+        if is_ledger_mode():
+            for user_id, delta in pending_deltas(db, "user", balances).items():
+                balances[user_id] += delta
+            pharmacy_ids = set(pharmacy_cache.get_many(db, (item.pharmacy_id for item in items)))
+        else:
+            pharmacy_ids = lock_pharmacies(db, (item.pharmacy_id for item in items))
+        mask_pharmacies = cached_mask_pharmacies(db, items)
+
+        results = []
+        accepted = []
+        for index, item in enumerate(items):
+            if item.user_id not in balances:
+                error = f"User id={item.user_id} not found"
+            elif item.pharmacy_id not in pharmacy_ids:
+                error = f"Pharmacy id={item.pharmacy_id} not found"
+            elif item.mask_id and mask_pharmacies.get(item.mask_id) != item.pharmacy_id:
+                error = f"Mask id={item.mask_id} not found in pharmacy {item.pharmacy_id}"
+            elif balances[item.user_id] < item.transaction_amount:
+                error = "User balance not enough"
+            else:
+                error = None
+                balances[item.user_id] -= item.transaction_amount
+                accepted.append(item)
+            results.append(PurchaseBatchResult(index=index, accepted=error is None, error=error))
+
+        # 核銷餘額：使用者與藥局各自依 id 彙總，一個 statement 更新
+        user_deltas = {}
+        for item in accepted:
+            user_deltas[item.user_id] = user_deltas.get(item.user_id, 0) - item.transaction_amount
+        pharmacy_deltas = sum_by_pharmacy(accepted)
+        if is_ledger_mode():
+            deltas = {("pharmacy", pid): amount for pid, amount in pharmacy_deltas.items()}
+            deltas.update({("user", uid): amount for uid, amount in user_deltas.items()})
+            append_balance_deltas(db, deltas)
+        else:
+            apply_balance_deltas(db, User, user_deltas)
+            apply_pharmacy_deltas(db, pharmacy_deltas)
+
+        # multi-row INSERT (每個 statement 最多約 1000 列)
+        insert_purchase_histories(db, [
+            {
+                "user_id": item.user_id,
+                "pharmacy_id": item.pharmacy_id,
+                "mask_id": item.mask_id,
+                "mask_name": item.mask_name,
+                "quantity": item.quantity,
+                "transaction_amount": item.transaction_amount,
+                "transaction_date": item.transaction_date,
+            }
+            for item in accepted
+        ])
+        add_batch_to_spend_rollups(db, ((item.user_id, item) for item in accepted))
+
+        db.commit()
+
+    except Exception as e:
+        # DB 錯誤時整批 rollback，client 可整批重送
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
+
+    return PurchaseBatchResponse(accepted=len(accepted), rejected=len(items) - len(accepted), results=results)
@@ -1,59 +1,130 @@
 # app/routers/search.py
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy import Float, and_, func, literal, or_, select, tuple_, union_all
 from sqlalchemy.orm import Session
-from typing import Any, Dict, List
-from app.database import get_db
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from app.config import SEARCH_BACKEND
+from app.database import get_read_db
 from app.models import Pharmacy, Mask
+from app.utils.async_helper import db_route
+from app.utils.ledger_helper import is_ledger_mode, pending_deltas
+from app.utils.ngram_index import KIND_ORDER, SearchDoc, SortKey, search_index
+from app.utils.pagination import decode_cursor, encode_cursor, set_next_cursor
+from app.utils.suggest_index import TOP_K, suggest_index
 
 router = APIRouter(prefix="/search", tags=["Search"])
 
+def _search_pg_trgm(db: Session, q: str, limit: int,
+                    after: Optional[Sequence[int]]) -> Tuple[List[Tuple[SortKey, SearchDoc]], bool]:
+    """
+    交給 PostgreSQL 處理：ILIKE 走 pg_trgm GIN 索引，rank 在 SQL 內計算並只取前 limit + 1 筆
+    """
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    pattern = f"%{escaped}%"
+
+    def ranked(model, kind: str, pharmacy_id, price):
+        position = func.strpos(func.lower(model.name), q.lower()) - 1
+        return (select(
+                    literal(KIND_ORDER[kind]).label("kind_order"),
+                    model.id.label("id"),
+                    pharmacy_id.label("pharmacy_id"),
+                    model.name.label("name"),
+                    price.label("price"),
+                    (100 - position).label("rank"),
+                )
+                .where(model.name.ilike(pattern, escape="\\")))
+
+    combined = union_all(
+        ranked(Pharmacy, "pharmacy", Pharmacy.id, literal(None, Float)),
+        ranked(Mask, "mask", Mask.pharmacy_id, Mask.price),
+    ).subquery()
+    c = combined.c
+
+    query = select(combined).order_by(c.rank.desc(), c.kind_order, c.id).limit(limit + 1)
+    if after is not None:
+        after_rank, after_kind, after_id = -after[0], after[1], after[2]
+        query = query.where(or_(
+            c.rank < after_rank,
+            and_(c.rank == after_rank, tuple_(c.kind_order, c.id) > tuple_(after_kind, after_id)),
+        ))
+
+    kinds = {order: kind for kind, order in KIND_ORDER.items()}
+    rows = db.execute(query).all()
+    hits = [((-row.rank, row.kind_order, row.id),
+             SearchDoc(kinds[row.kind_order], row.id, row.pharmacy_id, row.name, row.price))
+            for row in rows[:limit]]
+    return hits, len(rows) > limit
+
 @router.get("")
-def search_pharmacies_and_masks(q: str, db: Session = Depends(get_db)):
+@db_route
+def search_pharmacies_and_masks(
+    q: str,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100, description="Max number of results in this page."),
+    cursor: Optional[str] = Query(None, description="Value of the X-Next-Cursor header from the previous page."),
+    db: Session = Depends(get_read_db)
+):
     """
     Search for pharmacies or masks by name, ranked by 'relevance'.
+    rank = 100 - position of the first match; ties list pharmacies first, then by id.
+    e.g. GET /search?q=mask&limit=20, then pass the X-Next-Cursor header as ?cursor= for the next page.
+    """
+    after = decode_cursor(cursor, [int, int, int])
+
+    if SEARCH_BACKEND == "pg_trgm":
+        hits, has_more = _search_pg_trgm(db, q, limit, after)
+    else:
+        hits, has_more = search_index.get(db).search(q, limit, after)
+
+    # cash_balance 會隨交易變動，不放進索引，只查本頁出現的藥局
+    pharmacy_ids = [doc.id for _, doc in hits if doc.kind == "pharmacy"]
+    balances = {}
+    if pharmacy_ids:
+        balances = dict(db.query(Pharmacy.id, Pharmacy.cash_balance).filter(Pharmacy.id.in_(pharmacy_ids)))
+        if is_ledger_mode():
+            for pid, delta in pending_deltas(db, "pharmacy", pharmacy_ids).items():
+                balances[pid] = (balances.get(pid) or 0) + delta
+
+    results: List[Dict[str, Any]] = []
+    for key, doc in hits:
+        rank_score = -key[0]
+        if doc.kind == "pharmacy":
+            results.append({
+                "type": "pharmacy",
+                "pharmacy_id": doc.id,
+                "name": doc.name,
+                "cash_balance": balances.get(doc.id),
+                "rank": rank_score
+            })
+        else:
+            results.append({
+                "type": "mask",
+                "mask_id": doc.id,
+                "pharmacy_id": doc.pharmacy_id,
+                "name": doc.name,
+                "price": doc.price,
+                "rank": rank_score
+            })
+
+    if has_more:
+        set_next_cursor(response, encode_cursor(hits[-1][0]))
+    return results
+
+@router.get("/suggest")
+@db_route
+def suggest(
+    q: str,
+    limit: int = Query(10, ge=1, le=TOP_K, description="Max number of suggestions."),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Autocomplete pharmacy and mask names: the name or any word in it starts with q.
+    Identical names are merged; count is the number of pharmacies (selling that mask).
+    Names that start with q come first, then the most common names.
+    e.g. GET /search/suggest?q=true b&limit=5
     """
-    # 1) 查 pharmacies
-    phar_results = db.query(Pharmacy).filter(Pharmacy.name.ilike(f"%{q}%")).all()
-
-    # 2) 查 masks
-    mask_results = db.query(Mask).filter(Mask.name.ilike(f"%{q}%")).all()
-
-    # 建立一個合併清單
-    combined: List[Dict[str, Any]] = []
-
-    for p in phar_results:
-        rank_score = 0
-        try:
-            # 字串中出現 q 的位置
-            idx = p.name.lower().index(q.lower())
-            rank_score = 100 - idx  # idx 越小 => rank_score 越高
-        except ValueError:
-            pass
-        combined.append({
-            "type": "pharmacy",
-            "pharmacy_id": p.id,
-            "name": p.name,
-            "cash_balance": p.cash_balance,
-            "rank": rank_score
-        })
-
-    for m in mask_results:
-        rank_score = 0
-        try:
-            idx = m.name.lower().index(q.lower())
-            rank_score = 100 - idx
-        except ValueError:
-            pass
-        combined.append({
-            "type": "mask",
-            "mask_id": m.id,
-            "pharmacy_id": m.pharmacy_id,
-            "name": m.name,
-            "price": m.price,
-            "rank": rank_score
-        })
-
-    # 依 rank_score desc 排序
-    combined.sort(key=lambda x: x["rank"], reverse=True)
-
-    return combined
+    # 由 in-process 索引回答，只有索引失效後的第一個請求需要查 DB
+    return [
+        {"type": s.kind, "name": s.name, "count": s.count, "id": s.id}
+        for s in suggest_index.get(db).suggest(q, limit)
+    ]
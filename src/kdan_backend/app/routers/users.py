@@ -1,32 +1,87 @@
 # app/routers/users.py
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
-from app.database import get_db
-from app.models import User, Pharmacy, Mask, PurchaseHistory
+from app.config import ANALYTICS_BACKEND
+from app.database import get_db, get_read_db
+from app.models import PurchaseHistory, User
 from app.schemas import (
     User as UserSchema,
     PurchaseHistory as PurchaseHistorySchema,
     PurchaseHistoryBase,
+    MaskRevenue,
+    PharmacyRevenue,
     TopSpendersResponse,
     TransactionSummary
 )
+from app.utils import purchase_analytics
+from app.utils.async_helper import db_route
+from app.utils.fast_response import list_response
+from app.utils.ledger_helper import append_balance_deltas, is_ledger_mode, pending_deltas
+from app.utils.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    decode_cursor,
+    finish_page,
+    keyset_query,
+    set_total_count
+)
+from app.utils.purchase_helper import (
+    apply_pharmacy_deltas,
+    cached_mask_pharmacies,
+    insert_purchase_histories,
+    lock_pharmacies,
+    sum_by_pharmacy
+)
+from app.utils.pharmacy_cache import pharmacy_cache
+from app.utils.rollup_helper import add_to_spend_rollups, top_spenders_query, transaction_summary_query
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
 @router.get("", response_model=List[UserSchema])
-def list_users(db: Session = Depends(get_db)):
-    return db.query(User).all()
+@db_route
+def list_users(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Max number of users in this page."),
+    after: Optional[str] = Query(None, description="Value of the X-Next-Cursor header from the previous page."),
+    include_total: bool = Query(False, description="Also return the total count in the X-Total-Count header."),
+    db: Session = Depends(get_read_db)
+):
+    query = select(User)
+    if include_total:
+        set_total_count(response, db, query)
+    users = db.execute(keyset_query(query, [User.id], decode_cursor(after, [int]), limit)).scalars().all()
+    users = finish_page(users, limit, lambda u: [u.id], response)
+    return list_response(request, response, users, UserSchema)
 
 @router.get("/{user_id}/purchases", response_model=List[PurchaseHistorySchema])
-def get_user_purchases(user_id: int, db: Session = Depends(get_db)):
-    u = db.query(User).filter(User.id == user_id).first()
-    if not u:
+@db_route
+def get_user_purchases(
+    user_id: int,
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Max number of purchases in this page."),
+    after: Optional[str] = Query(None, description="Value of the X-Next-Cursor header from the previous page."),
+    include_total: bool = Query(False, description="Also return the total count in the X-Total-Count header."),
+    db: Session = Depends(get_read_db)
+):
+    """
+    依 id 分頁，走 (user_id, id) 索引
+    """
+    if db.get(User, user_id) is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return u.purchase_histories
+    query = select(PurchaseHistory).where(PurchaseHistory.user_id == user_id)
+    if include_total:
+        set_total_count(response, db, query)
+    purchases = db.execute(keyset_query(query, [PurchaseHistory.id], decode_cursor(after, [int]), limit)).scalars().all()
+    purchases = finish_page(purchases, limit, lambda ph: [ph.id], response)
+    return list_response(request, response, purchases, PurchaseHistorySchema)
 
 @router.post("/{user_id}/purchase")
+@db_route
 def purchase_masks(
     user_id: int,
     items: List[PurchaseHistoryBase],
@@ -59,49 +114,65 @@ def purchase_masks(
     3. 新增 purchase_histories
     4. 如果任何一筆購買失敗，全部回滾(atomic)
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    # 鎖定 user，避免並行的購買同時通過餘額檢查
+    user = db.query(User).filter(User.id == user_id).with_for_update().first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    # ledger 模式下可用餘額 = 已併入的 cash_balance + 尚未 rollup 的異動
+    available = user.cash_balance
+    if is_ledger_mode():
+        available += pending_deltas(db, "user", [user.id]).get(user.id, 0)
+
     # 計算「所有購買」所需總金額
     total_amount_needed = sum(item.transaction_amount for item in items)
-    if user.cash_balance < total_amount_needed:
+    if available < total_amount_needed:
         raise HTTPException(status_code=400, detail="User balance not enough for total purchase")
 
-    # 開始交易
+    # 開始交易：查詢次數固定，不隨購物籃大小增加
     try:
-        # 逐筆檢查 & 寫入
+        # 藥局與口罩的對應由 catalog 快取確認；direct 模式仍需一次鎖定所有藥局
+        if is_ledger_mode():
+            # ledger 模式不更新藥局，不需要鎖，是否存在直接看快取
+            pharmacy_ids = set(pharmacy_cache.get_many(db, (item.pharmacy_id for item in items)))
+        else:
+            pharmacy_ids = lock_pharmacies(db, (item.pharmacy_id for item in items))
+        mask_pharmacies = cached_mask_pharmacies(db, items)
+
         for item in items:
-            # 找該筆的藥局
-            pharmacy = db.query(Pharmacy).filter(Pharmacy.id == item.pharmacy_id).first()
-            if not pharmacy:
+            if item.pharmacy_id not in pharmacy_ids:
                 raise HTTPException(status_code=404, detail=f"Pharmacy id={item.pharmacy_id} not found")
+            # 若有 mask_id，檢查是否存在於該藥局
+            if item.mask_id and mask_pharmacies.get(item.mask_id) != item.pharmacy_id:
+                raise HTTPException(status_code=404, detail=f"Mask id={item.mask_id} not found in pharmacy {item.pharmacy_id}")
 
-            # 若有 mask_id，檢查是否存在
-            if item.mask_id:
-                m = db.query(Mask).filter(Mask.id == item.mask_id, Mask.pharmacy_id == pharmacy.id).first()
-                if not m:
-                    raise HTTPException(status_code=404, detail=f"Mask id={item.mask_id} not found in pharmacy {item.pharmacy_id}")
-
-            # 核銷餘額
-            user.cash_balance -= item.transaction_amount
-            pharmacy.cash_balance += item.transaction_amount
-
-            # 建立 purchase_histories
-            new_record = PurchaseHistory(
-                user_id=user.id,
-                pharmacy_id=pharmacy.id,
-                mask_id=item.mask_id,
-                mask_name=item.mask_name,
-                quantity=item.quantity,
-                transaction_amount=item.transaction_amount,
-                transaction_date=item.transaction_date
-            )
-            db.add(new_record)
+        # 核銷餘額：user 一次扣款，藥局依 id 彙總後一次入帳
+        pharmacy_deltas = sum_by_pharmacy(items)
+        if is_ledger_mode():
+            # 只 append 異動，不更新熱門藥局那一列，並行交易不會互相等待
+            deltas = {("pharmacy", pid): amount for pid, amount in pharmacy_deltas.items()}
+            deltas[("user", user.id)] = -total_amount_needed
+            append_balance_deltas(db, deltas)
+        else:
+            user.cash_balance -= total_amount_needed
+            apply_pharmacy_deltas(db, pharmacy_deltas)
+
+        # 建立 purchase_histories (multi-row INSERT)
+        insert_purchase_histories(db, [
+            {
+                "user_id": user.id,
+                "pharmacy_id": item.pharmacy_id,
+                "mask_id": item.mask_id,
+                "mask_name": item.mask_name,
+                "quantity": item.quantity,
+                "transaction_amount": item.transaction_amount,
+                "transaction_date": item.transaction_date,
+            }
+            for item in items
+        ])
+        add_to_spend_rollups(db, user.id, items)
 
         db.commit()
-        db.refresh(user)
-        # 也可 refresh 所有 pharmacy, new_record ...
 
     except HTTPException:
         # 如果是 HTTPException => 仍要 rollback
@@ -114,53 +185,99 @@ def purchase_masks(
     return {"message": "Purchases processed successfully"}
 
 @router.get("/top_spenders", response_model=List[TopSpendersResponse])
-def top_spenders(start_date: datetime, end_date: datetime, top_x: int, db: Session = Depends(get_db)):
+@db_route
+def top_spenders(
+    start_date: datetime,
+    end_date: datetime,
+    top_x: int,
+    db: Session = Depends(get_read_db)
+):
     """
     The top x users by total transaction amount of masks within a date range.
     e.g. GET /users/top_spenders?start_date=2021-01-01T00:00:00&end_date=2021-01-31T23:59:59&top_x=5
     """
-    from sqlalchemy import func
-    res = (db.query(
-                PurchaseHistory.user_id,
-                func.sum(PurchaseHistory.transaction_amount).label("total_spent")
-            )
-            .filter(PurchaseHistory.transaction_date >= start_date,
-                    PurchaseHistory.transaction_date <= end_date)
-            .group_by(PurchaseHistory.user_id)
-            .order_by(func.sum(PurchaseHistory.transaction_amount).desc())
-            .limit(top_x)
-            .all()
-          )
-    # 取得 user name
-    results = []
-    for row in res:
-        user_obj = db.query(User).filter(User.id == row.user_id).first()
-        results.append(TopSpendersResponse(
-            user_id=row.user_id,
-            user_name=user_obj.name if user_obj else "",
-            total_spent=row.total_spent
-        ))
-    return results
+    if ANALYTICS_BACKEND == "columnar":
+        rows = purchase_analytics.top_spenders(db, start_date, end_date, top_x)
+    else:
+        # 完整日子讀每日彙總，只有頭尾不滿一天的部分掃原始交易，user name 在同一個查詢 join
+        rows = db.execute(top_spenders_query(start_date, end_date, top_x)).all()
+    return [
+        TopSpendersResponse(
+            user_id=user_id,
+            user_name=user_name,
+            total_spent=total_spent
+        )
+        for user_id, user_name, total_spent in rows
+    ]
 
 @router.get("/transactions/summary", response_model=TransactionSummary)
-def transaction_summary(start_date: datetime, end_date: datetime, db: Session = Depends(get_db)):
+@db_route
+def transaction_summary(start_date: datetime, end_date: datetime, db: Session = Depends(get_read_db)):
     """
     The total amount of masks and dollar value of transactions within a date range.
     - total_masks = sum of quantity
     - total_dollar = sum of transaction_amount
     """
-    from sqlalchemy import func
-    row = (db.query(
-               func.sum(PurchaseHistory.quantity).label("total_masks"),
-               func.sum(PurchaseHistory.transaction_amount).label("total_dollar")
-           )
-           .filter(PurchaseHistory.transaction_date >= start_date,
-                   PurchaseHistory.transaction_date <= end_date)
-           .first()
-          )
+    if ANALYTICS_BACKEND == "columnar":
+        row = purchase_analytics.transaction_summary(db, start_date, end_date)
+    else:
+        row = db.execute(transaction_summary_query(start_date, end_date)).first()
     total_masks = row[0] if row[0] else 0
     total_dollar = row[1] if row[1] else 0
     return TransactionSummary(
         total_masks=int(total_masks),
         total_dollar=float(total_dollar)
-    )
\ No newline at end of file
+    )
+
+@router.get("/transactions/by_pharmacy", response_model=List[PharmacyRevenue])
+@db_route
+def revenue_by_pharmacy(
+    start_date: datetime,
+    end_date: datetime,
+    limit: int = Query(50, ge=1, le=1000, description="Max number of pharmacies, by total_dollar."),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Masks sold and dollar value of transactions per pharmacy within a date range, highest total_dollar first.
+    """
+    if ANALYTICS_BACKEND == "columnar":
+        rows = purchase_analytics.revenue_by_pharmacy(db, start_date, end_date, limit)
+    else:
+        rows = db.execute(purchase_analytics.revenue_by_pharmacy_query(start_date, end_date, limit)).all()
+    return [
+        PharmacyRevenue(
+            pharmacy_id=pharmacy_id,
+            pharmacy_name=pharmacy_name,
+            total_masks=int(total_masks),
+            total_dollar=float(total_dollar),
+            transactions=transactions
+        )
+        for pharmacy_id, pharmacy_name, total_masks, total_dollar, transactions in rows
+    ]
+
+@router.get("/transactions/by_mask", response_model=List[MaskRevenue])
+@db_route
+def revenue_by_mask(
+    start_date: datetime,
+    end_date: datetime,
+    limit: int = Query(50, ge=1, le=1000, description="Max number of masks, by total_dollar."),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Masks sold and dollar value of transactions per mask product within a date range, highest total_dollar first.
+    """
+    if ANALYTICS_BACKEND == "columnar":
+        rows = purchase_analytics.revenue_by_mask(db, start_date, end_date, limit)
+    else:
+        rows = db.execute(purchase_analytics.revenue_by_mask_query(start_date, end_date, limit)).all()
+    return [
+        MaskRevenue(
+            mask_id=mask_id,
+            mask_name=mask_name,
+            pharmacy_id=pharmacy_id,
+            total_masks=int(total_masks),
+            total_dollar=float(total_dollar),
+            transactions=transactions
+        )
+        for mask_id, mask_name, pharmacy_id, total_masks, total_dollar, transactions in rows
+    ]
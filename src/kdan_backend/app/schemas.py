@@ -62,6 +62,19 @@ class PurchaseHistoryBase(BaseModel):
     transaction_amount: float
     transaction_date: datetime
 
+class PurchaseBatchItem(PurchaseHistoryBase):
+    user_id: int
+
+class PurchaseBatchResult(BaseModel):
+    index: int
+    accepted: bool
+    error: Optional[str] = None
+
+class PurchaseBatchResponse(BaseModel):
+    accepted: int
+    rejected: int
+    results: List[PurchaseBatchResult]
+
 class PurchaseHistory(PurchaseHistoryBase):
     id: int
     user_id: int
@@ -82,6 +95,21 @@ class TransactionSummary(BaseModel):
     total_masks: int
     total_dollar: float
 
+class PharmacyRevenue(BaseModel):
+    pharmacy_id: int
+    pharmacy_name: Optional[str] = None
+    total_masks: int
+    total_dollar: float
+    transactions: int
+
+class MaskRevenue(BaseModel):
+    mask_id: int
+    mask_name: Optional[str] = None
+    pharmacy_id: Optional[int] = None
+    total_masks: int
+    total_dollar: float
+    transactions: int
+
 class MaskBase(BaseModel):
     id: int
     name: str
@@ -0,0 +1,41 @@
+import functools
+import inspect
+from fastapi import Depends, params
+from app.config import DB_ASYNC
+from app.database import get_async_db, get_async_read_db, get_db, get_read_db
+
+# 同步 dependency -> 對應的 async dependency
+ASYNC_DEPENDENCIES = {
+    get_db: get_async_db,
+    get_read_db: get_async_read_db,
+}
+
+def db_route(func):
+    """
+    路由只寫一份同步版本；DB_ASYNC=true 時包成 async def：
+    - db 參數改由對應的 async dependency 取得 AsyncSession
+    - 原本的 ORM 程式以 AsyncSession.run_sync 在 asyncpg 上執行，等待 DB 時不佔用 threadpool
+    """
+    if not DB_ASYNC:
+        return func
+
+    signature = inspect.signature(func)
+    db_params = {}
+    parameters = []
+    for name, param in signature.parameters.items():
+        default = param.default
+        if isinstance(default, params.Depends) and default.dependency in ASYNC_DEPENDENCIES:
+            db_params[name] = ASYNC_DEPENDENCIES[default.dependency]
+            param = param.replace(default=Depends(db_params[name]))
+        parameters.append(param)
+    if len(db_params) != 1:
+        raise TypeError(f"{func.__name__} must take exactly one DB session dependency")
+    db_param = next(iter(db_params))
+
+    @functools.wraps(func)
+    async def wrapper(**kwargs):
+        async_db = kwargs[db_param]
+        return await async_db.run_sync(lambda db: func(**{**kwargs, db_param: db}))
+
+    wrapper.__signature__ = signature.replace(parameters=parameters)
+    return wrapper
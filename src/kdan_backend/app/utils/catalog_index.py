@@ -0,0 +1,294 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, Iterable, List, Optional, Set, Tuple, TypeVar
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app.config import CATALOG_CACHE_SIZE, CATALOG_INDEX_TTL
+from app.database import run_on_primary
+from app.utils.single_flight import SingleFlight
+
+T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+# catalog 快取以藥局 id 為 key：各資料表中代表藥局 id 的欄位
+ROW_KEYS = {"pharmacies": "id", "masks": "pharmacy_id", "pharmacy_opening_hours": "pharmacy_id"}
+
+class TouchedTables:
+    """
+    一個 transaction (或一批 NOTIFY) 寫過的資料表/欄位，以及 ROW_KEYS 中各表寫到的藥局 id
+    keys[table] 為 None 表示無法得知寫到哪些藥局 (例如沒有條件的 UPDATE、TRUNCATE)
+    """
+    def __init__(self):
+        self.touched: Set[str] = set()
+        self.keys: Dict[str, Optional[Set[Any]]] = {}
+
+    def add(self, touched: str, keys: Optional[Iterable[Any]] = None) -> None:
+        self.touched.add(touched)
+        table = touched.split(".", 1)[0]
+        if table not in ROW_KEYS:
+            return
+        if keys is None:
+            self.keys[table] = None
+        elif self.keys.get(table, ()) is not None:
+            self.keys.setdefault(table, set()).update(keys)
+
+    def __bool__(self) -> bool:
+        return bool(self.touched)
+
+class DependsOnTables:
+    """
+    記錄依賴的資料表/欄位，寫入 commit 後 (本 worker 的 ORM session 或其他 process 的 NOTIFY)
+    以 on_write() 通知，預設為整個 invalidate()
+    depends_on 可寫資料表 ("masks") 或欄位 ("pharmacies.name")，後者只在該欄位被更新時失效
+    """
+    def __init__(self, depends_on: Iterable[str]):
+        self.depends_on = frozenset(depends_on)
+        _registry.append(self)
+
+    def invalidate(self) -> None:
+        raise NotImplementedError
+
+    def on_write(self, changes: TouchedTables) -> None:
+        if any(self.is_affected_by(t) for t in changes.touched):
+            self.invalidate()
+
+    def is_affected_by(self, touched: str) -> bool:
+        """
+        touched 為 "table" (新增/刪除) 或 "table.column" (更新該欄位)
+        """
+        table = touched.split(".", 1)[0]
+        if "." not in touched:
+            return any(dep.split(".", 1)[0] == table for dep in self.depends_on)
+        return touched in self.depends_on or table in self.depends_on
+
+class CatalogIndex(DependsOnTables, Generic[T]):
+    """
+    由 catalog 資料 (藥局、口罩、營業時間) 建出的 in-process 索引，每個 worker 各一份
+    - 第一次使用或失效後才重建
+    - 同一 worker 內透過 ORM session 寫入相關資料時，commit 後立即失效 (見 DependsOnTables)
+    - 其他 process (其他 worker、etl.py) 的寫入由 catalog_listener 收到 NOTIFY 後失效，TTL 作為保底
+    """
+    def __init__(self, name: str, depends_on: Iterable[str], builder: Callable[[Session], T],
+                 ttl: float = CATALOG_INDEX_TTL):
+        super().__init__(depends_on)
+        self.name = name
+        self._builder = builder
+        self._ttl = ttl
+        self._flight = SingleFlight()
+        self._value: Optional[T] = None
+        self._built_at = 0.0
+        # 每次失效都遞增；重建期間若發生失效，建出的結果可能已過期，不放進索引
+        self._generation = 0
+
+    def _is_fresh(self) -> bool:
+        if self._value is None:
+            return False
+        return self._ttl <= 0 or time.monotonic() - self._built_at < self._ttl
+
+    def get(self, db: Session) -> T:
+        """
+        取得目前的索引，過期時重建 (同一時間只有一個呼叫者重建，其他等待結果)；
+        一律以 primary 重建；DB_ASYNC=true 時在 executor 的 thread 上重建，見 database.run_on_primary
+        """
+        while True:
+            value = self._value
+            if value is not None and self._is_fresh():
+                return value
+            built, value = self._flight.run(lambda: self._build(db))
+            if built:
+                return value
+
+    def _build(self, db: Session) -> T:
+        generation = self._generation
+        value = run_on_primary(db, self._builder)
+        if generation == self._generation:
+            self._value = value
+            self._built_at = time.monotonic()
+        # 這次的結果仍回給呼叫者 (請求開始時還沒有那筆寫入)，下一個請求再重建
+        return value
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._value = None
+
+class CatalogCache(DependsOnTables, Generic[K, V]):
+    """
+    以藥局 id 為 key 的 read-through 快取，每個 worker 各一份
+    - 未命中的 key 以 loader 一次查詢載入，超過 max_size 時淘汰最久未使用的 entry
+    - 本 worker commit 或其他 process 的寫入 (NOTIFY) 只淘汰被寫到的藥局，無法得知時全部清除
+    - 每個 entry 仍有 TTL 作為保底 (例如 LISTEN 連線中斷期間)
+    """
+    def __init__(self, name: str, depends_on: Iterable[str],
+                 loader: Callable[[Session, Set[K]], Dict[K, V]],
+                 max_size: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_INDEX_TTL):
+        super().__init__(depends_on)
+        self.name = name
+        self._loader = loader
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[K, Tuple[float, V]]" = OrderedDict()
+        # 每次失效都遞增；載入期間若發生失效，載入的結果可能已過期，不放進快取
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_many(self, db: Session, keys: Iterable[K]) -> Dict[K, V]:
+        """
+        回傳 keys 中存在的 entry，未命中的一次載入 (一律讀 primary)
+        不存在的 key 不會出現在結果中，也不會被快取
+        """
+        found: Dict[K, V] = {}
+        missing: Set[K] = set()
+        now = time.monotonic()
+        with self._lock:
+            for key in set(keys):
+                entry = self._entries.get(key)
+                if entry is not None and (self._ttl <= 0 or now - entry[0] < self._ttl):
+                    self._entries.move_to_end(key)
+                    found[key] = entry[1]
+                else:
+                    missing.add(key)
+            self.hits += len(found)
+            self.misses += len(missing)
+            generation = self._generation
+        if not missing:
+            return found
+
+        loaded = run_on_primary(db, lambda primary: self._loader(primary, missing))
+        found.update(loaded)
+        with self._lock:
+            if generation == self._generation:
+                for key, value in loaded.items():
+                    self._entries[key] = (now, value)
+                    self._entries.move_to_end(key)
+                while len(self._entries) > max(self._max_size, 0):
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return found
+
+    def get(self, db: Session, key: K) -> Optional[V]:
+        return self.get_many(db, (key,)).get(key)
+
+    def on_write(self, changes: TouchedTables) -> None:
+        tables = {t.split(".", 1)[0] for t in changes.touched if self.is_affected_by(t)}
+        if not tables:
+            return
+        keys: Set[Any] = set()
+        for table in tables:
+            table_keys = changes.keys.get(table)
+            if table_keys is None:
+                self.invalidate()
+                return
+            keys.update(table_keys)
+        self.discard(keys)
+
+    def discard(self, keys: Iterable[K]) -> None:
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+_registry: List[DependsOnTables] = []
+
+def invalidate_tables(changes: TouchedTables) -> None:
+    """
+    通知所有依賴這些資料表/欄位的索引、快取 (與資料版本)
+    """
+    for index in _registry:
+        index.on_write(changes)
+
+def invalidate_all() -> None:
+    """
+    無法得知漏掉哪些寫入時 (例如 LISTEN 連線重建)，全部失效
+    """
+    for index in _registry:
+        index.invalidate()
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {index.name: index.stats() for index in _registry if isinstance(index, CatalogCache)}
+
+# ---- ORM 事件：記錄 transaction 內寫過的資料表/欄位，commit 後再失效 ----
+def _touched(session: Session) -> TouchedTables:
+    touched = session.info.get("catalog_touched")
+    if touched is None:
+        touched = session.info["catalog_touched"] = TouchedTables()
+    return touched
+
+def _row_keys(state, table_name: str) -> Optional[Set[Any]]:
+    """
+    物件在 ROW_KEYS 欄位的新舊值 (未載入時為 None，視為無法得知)
+    """
+    column = ROW_KEYS.get(table_name)
+    if column is None:
+        return None
+    keys = {value for value in state.attrs[column].history.sum() if value is not None}
+    return keys or None
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session, flush_context):
+    touched = _touched(session)
+    for obj in list(session.new) + list(session.deleted):
+        table = getattr(obj, "__table__", None)
+        if table is not None:
+            touched.add(table.name, _row_keys(inspect(obj), table.name))
+    for obj in session.dirty:
+        table = getattr(obj, "__table__", None)
+        if table is None:
+            continue
+        state = inspect(obj)
+        changed = [attr.key for attr in state.mapper.column_attrs if state.attrs[attr.key].history.has_changes()]
+        if not changed:
+            continue
+        keys = _row_keys(state, table.name)
+        for key in changed:
+            touched.add(f"{table.name}.{key}", keys)
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_executed(orm_execute_state):
+    # db.execute(insert(...)/update(...)/delete(...)) 不經過 flush，需另外記錄 (寫到哪些列無法得知)
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    statement = orm_execute_state.statement
+    table = getattr(statement, "table", None)
+    if table is None:
+        return
+    touched = _touched(orm_execute_state.session)
+    values = getattr(statement, "_values", None)
+    if orm_execute_state.is_update and values:
+        for col in values:
+            touched.add(f"{table.name}.{getattr(col, 'key', col)}")
+    else:
+        touched.add(table.name)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    touched = session.info.pop("catalog_touched", None)
+    if touched:
+        invalidate_tables(touched)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("catalog_touched", None)
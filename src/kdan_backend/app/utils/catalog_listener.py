@@ -0,0 +1,76 @@
+import logging
+import select
+import threading
+from typing import Iterable
+import psycopg2
+from app.config import get_database_url
+from app.utils.catalog_index import TouchedTables, invalidate_all, invalidate_tables
+
+logger = logging.getLogger(__name__)
+
+# 需與 etl.py 的 CATALOG_CHANNEL 相同
+CATALOG_CHANNEL = "catalog_changes"
+# 沒有通知時每隔幾秒確認一次連線仍可用
+IDLE_CHECK_SECONDS = 5
+# 連線失敗後等待幾秒重試
+RECONNECT_DELAY = 5
+
+def parse_notifications(payloads: Iterable[str]) -> TouchedTables:
+    """
+    payload 為 "table:藥局 id"、"table.column:藥局 id"，或只有 "table" (TRUNCATE)
+    """
+    changes = TouchedTables()
+    for payload in payloads:
+        touched, _, key = payload.partition(":")
+        try:
+            changes.add(touched, [int(key)])
+        except ValueError:
+            changes.add(touched)
+    return changes
+
+def _listen(conn, stop: threading.Event) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute(f"LISTEN {CATALOG_CHANNEL}")
+    # 連線建立前 (或中斷期間) 的 NOTIFY 已收不到
+    invalidate_all()
+    while not stop.is_set():
+        if select.select([conn], [], [], IDLE_CHECK_SECONDS) == ([], [], []):
+            # 連線斷掉時在這裡拋出例外；期間收到的 NOTIFY 一樣會放進 conn.notifies
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        else:
+            conn.poll()
+        payloads = [notify.payload for notify in conn.notifies]
+        conn.notifies.clear()
+        if payloads:
+            invalidate_tables(parse_notifications(payloads))
+
+def _listen_loop(stop: threading.Event) -> None:
+    failing = False
+    while not stop.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(get_database_url())
+            conn.autocommit = True
+            if failing:
+                logger.info("Catalog listener reconnected")
+            failing = False
+            _listen(conn, stop)
+        except Exception:
+            # 中斷期間的寫入只能靠 TTL，只在剛失敗時記錄與清除一次
+            if not failing:
+                logger.warning("Catalog listener failed; falling back to TTL until it reconnects", exc_info=True)
+                invalidate_all()
+            failing = True
+        finally:
+            if conn is not None:
+                conn.close()
+        stop.wait(RECONNECT_DELAY)
+
+def start_catalog_listener() -> threading.Event:
+    """
+    以獨立連線 (不佔用連線池) LISTEN catalog 異動的背景 thread，回傳用來停止它的 Event
+    """
+    stop = threading.Event()
+    threading.Thread(target=_listen_loop, args=(stop,), name="catalog-listener", daemon=True).start()
+    return stop
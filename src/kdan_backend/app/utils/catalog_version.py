@@ -0,0 +1,130 @@
+import logging
+import threading
+from typing import Iterable, List, Optional, Sequence
+from fastapi import Request, Response
+from sqlalchemy import text
+from app.config import CATALOG_CACHE_MAX_AGE, CATALOG_VERSION_POLL
+from app.database import SessionLocal
+from app.utils.catalog_index import DependsOnTables
+from app.utils.fast_response import wants_ndjson
+
+logger = logging.getLogger(__name__)
+
+class CatalogVersion(DependsOnTables):
+    """
+    資料版本號：由 etl.py 建立的 trigger 在寫入 commit 時對 sequence 執行 nextval，
+    不論寫入來自 API 或 etl.py 都會遞增。背景 thread 定期讀取，路由以此產生 ETag，
+    判斷 If-None-Match 不需要查詢 DB
+    - 同一個值需連續兩次輪詢都讀到才採用 (nextval 與 commit 生效之間有短暫空窗)
+    - 本 worker 寫入相關資料時 commit 後立即失效，直到輪詢讀到新版本
+    - 未知 (尚未穩定、已失效或 DB 沒有 sequence) 時 current() 為 None，路由不回傳 ETag
+    """
+    def __init__(self, name: str, sequence: str, depends_on: Iterable[str]):
+        super().__init__(depends_on)
+        self.name = name
+        self.sequence = sequence
+        self._lock = threading.Lock()
+        self._seen: Optional[int] = None
+        self._current: Optional[int] = None
+        _versions.append(self)
+
+    def current(self) -> Optional[int]:
+        return self._current
+
+    def observe(self, value: int) -> None:
+        with self._lock:
+            if value == self._seen:
+                self._current = value
+            else:
+                self._seen = value
+                self._current = None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._seen = None
+            self._current = None
+
+_versions: List[CatalogVersion] = []
+
+# 藥局名稱、口罩、營業時間
+catalog_version = CatalogVersion(
+    "catalog", "catalog_version_seq",
+    depends_on=("pharmacies.name", "masks", "pharmacy_opening_hours"),
+)
+# 藥局餘額 (含 ledger 模式尚未 rollup 的異動)
+balance_version = CatalogVersion(
+    "balances", "balance_version_seq",
+    depends_on=("pharmacies.cash_balance", "balance_ledger"),
+)
+
+def poll_versions() -> None:
+    """
+    以一個查詢讀取所有 sequence 目前的值
+    剛建立的 sequence 第一次 nextval 前後 last_value 相同，加上 is_called 區分
+    """
+    columns = ", ".join(f"(SELECT last_value + is_called::int FROM {v.sequence})" for v in _versions)
+    with SessionLocal() as db:
+        values = db.execute(text(f"SELECT {columns}")).one()
+    for version, value in zip(_versions, values):
+        version.observe(value)
+
+def _poll_loop(stop: threading.Event) -> None:
+    failing = False
+    while True:
+        try:
+            poll_versions()
+            failing = False
+        except Exception:
+            # 例如資料庫尚未以新版 etl.py 建立 sequence：不回傳 ETag，照常查詢
+            if not failing:
+                logger.warning("Catalog version poll failed; ETags disabled until it succeeds", exc_info=True)
+            failing = True
+            for version in _versions:
+                version.invalidate()
+        if stop.wait(CATALOG_VERSION_POLL):
+            return
+
+def start_version_poller() -> threading.Event:
+    """
+    啟動背景輪詢 thread，回傳用來停止它的 Event
+    """
+    stop = threading.Event()
+    threading.Thread(target=_poll_loop, args=(stop,), name="catalog-version", daemon=True).start()
+    return stop
+
+def _cache_control() -> str:
+    if CATALOG_CACHE_MAX_AGE > 0:
+        return f"public, max-age={CATALOG_CACHE_MAX_AGE:g}"
+    return "no-cache"
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+def conditional_get(request: Request, response: Response,
+                    versions: Sequence[CatalogVersion]) -> Optional[Response]:
+    """
+    在查詢之前呼叫：If-None-Match 與目前版本相同時直接回傳 304，
+    否則在 response 上設定 ETag / Cache-Control 並回傳 None，由路由照常查詢
+    ETag 由版本號與輸出格式組成 (client 以 URL 為單位保存 ETag，不需包含 query string)
+    版本號讀自 primary，使用此函式的路由也要從 primary 查詢 (get_db)：落後的 replica 會讓舊的 body 配上新的 ETag，
+    client 之後帶著它一直收到 304
+    """
+    values = [version.current() for version in versions]
+    if any(value is None for value in values):
+        response.headers["Cache-Control"] = "no-cache"
+        return None
+
+    tag = "-".join(f"{version.name}.{value}" for version, value in zip(versions, values))
+    if wants_ndjson(request):
+        tag += "-ndjson"
+    etag = f'"{tag}"'
+    headers = {"ETag": etag, "Cache-Control": _cache_control(), "Vary": "Accept"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
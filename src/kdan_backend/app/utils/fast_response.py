@@ -0,0 +1,132 @@
+import json
+from datetime import date, datetime, time
+from enum import Enum
+from itertools import islice
+from operator import attrgetter
+from typing import Any, Iterable, Iterator, List, Sequence, Tuple
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from app.config import FAST_RESPONSES
+
+try:
+    import orjson
+except ImportError:  # 未安裝 orjson 時退回標準 json
+    orjson = None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+JSON_MEDIA_TYPE = "application/json"
+
+# 每次編碼的筆數；超過一批的 response 以串流送出，不會把整個 body 放進記憶體
+ENCODE_BATCH = 256
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def schema_fields(schema) -> Tuple[str, ...]:
+    """
+    依 response_model 的欄位順序輸出，body 與驗證模式相同
+    """
+    fields = getattr(schema, "model_fields", None) or schema.__fields__
+    return tuple(fields)
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def _batches(records: Iterable[Any]) -> Iterator[List[Any]]:
+    iterator = iter(records)
+    while True:
+        batch = list(islice(iterator, ENCODE_BATCH))
+        if not batch:
+            return
+        yield batch
+
+def _array_chunks(records: Iterable[dict]) -> Iterator[bytes]:
+    yield b"["
+    separator = b""
+    for batch in _batches(records):
+        yield separator + dumps(batch)[1:-1]
+        separator = b","
+    yield b"]"
+
+def _ndjson_chunks(records: Iterable[dict]) -> Iterator[bytes]:
+    for batch in _batches(records):
+        yield b"".join(dumps(record) + b"\n" for record in batch)
+
+def _object_chunks(groups: Iterable[Tuple[str, List[dict]]]) -> Iterator[bytes]:
+    yield b"{"
+    separator = b""
+    for key, values in groups:
+        yield separator + dumps(key) + b":" + dumps(values)
+        separator = b","
+    yield b"}"
+
+def _respond(chunks: Iterator[bytes], media_type: str, size: int, response: Response) -> Response:
+    """
+    小的 response 一次送出 (帶 Content-Length)，其餘以 StreamingResponse 分批送出
+    並帶上路由設定在 response 參數上的 header (X-Next-Cursor 等)
+    """
+    if size <= ENCODE_BATCH:
+        result = Response(b"".join(chunks), media_type=media_type)
+    else:
+        result = StreamingResponse(chunks, media_type=media_type)
+    result.raw_headers.extend(response.raw_headers)
+    return result
+
+def _records(items: Sequence[Any], fields: Tuple[str, ...]) -> Iterator[dict]:
+    # 直接由屬性取出 tuple，不經 Pydantic 驗證
+    get = attrgetter(*fields)
+    if len(fields) == 1:
+        return ({fields[0]: get(item)} for item in items)
+    return (dict(zip(fields, get(item))) for item in items)
+
+def list_response(request: Request, response: Response, items: Sequence[Any], schema):
+    """
+    列表路由的輸出：
+    - Accept: application/x-ndjson => 每行一筆的 NDJSON 串流
+    - FAST_RESPONSES=true => 略過 response_model 驗證，以 orjson 直接編碼
+    - 其他情況回傳 items，由 FastAPI 照 response_model 驗證與編碼
+    items 為 ORM 物件或 Row，需有 schema 的所有欄位 (內部資料，不再驗證)
+    """
+    fields = schema_fields(schema)
+    if wants_ndjson(request):
+        return _respond(_ndjson_chunks(_records(items, fields)), NDJSON_MEDIA_TYPE, len(items), response)
+    if FAST_RESPONSES:
+        return _respond(_array_chunks(_records(items, fields)), JSON_MEDIA_TYPE, len(items), response)
+    return items
+
+def grouped_response(request: Request, response: Response, rows: Sequence[Any], group_by: str, schema):
+    """
+    以 group_by 欄位分組成 {key: [record, ...]} 的快速輸出，rows 需已依 group_by 相鄰排序
+    NDJSON 時不分組，每行一筆並帶上 group_by 欄位
+    FAST_RESPONSES 未開啟且非 NDJSON 時回傳 None，由呼叫端走原本的流程
+    """
+    fields = schema_fields(schema)
+    if wants_ndjson(request):
+        return _respond(_ndjson_chunks(_records(rows, (group_by,) + fields)), NDJSON_MEDIA_TYPE, len(rows), response)
+    if not FAST_RESPONSES:
+        return None
+
+    get_key = attrgetter(group_by)
+
+    def groups():
+        key, values = None, []
+        for row, record in zip(rows, _records(rows, fields)):
+            row_key = get_key(row)
+            if values and row_key != key:
+                yield key, values
+                values = []
+            key = row_key
+            values.append(record)
+        if values:
+            yield key, values
+
+    return _respond(_object_chunks(groups()), JSON_MEDIA_TYPE, len(rows), response)
@@ -0,0 +1,116 @@
+import logging
+import threading
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from app.config import BALANCE_MODE, LEDGER_ROLLUP_BATCH, LEDGER_ROLLUP_INTERVAL
+from app.database import SessionLocal
+from app.models import BalanceLedger, Pharmacy
+
+logger = logging.getLogger(__name__)
+
+Account = Tuple[str, int]  # ("user" | "pharmacy", id)
+
+# 任意固定值，讓多個 worker 同時間只有一個在做 rollup
+_ROLLUP_LOCK_KEY = 0x6B64616E
+
+def is_ledger_mode() -> bool:
+    return BALANCE_MODE == "ledger"
+
+def append_balance_deltas(db: Session, deltas: Dict[Account, float]) -> None:
+    """
+    以 multi-row INSERT 寫入餘額異動，不更新 users / pharmacies 本身
+    """
+    rows = [
+        {"account_type": account_type, "account_id": account_id, "delta": delta}
+        for (account_type, account_id), delta in sorted(deltas.items())
+    ]
+    if rows:
+        db.execute(insert(BalanceLedger), rows)
+
+def pending_deltas(db: Session, account_type: str, account_ids: Iterable[int]) -> Dict[int, float]:
+    """
+    尚未 rollup 的餘額異動加總
+    """
+    account_ids = set(account_ids)
+    if not account_ids:
+        return {}
+    query = (select(BalanceLedger.account_id, func.sum(BalanceLedger.delta))
+             .where(BalanceLedger.account_type == account_type,
+                    BalanceLedger.account_id.in_(account_ids))
+             .group_by(BalanceLedger.account_id))
+    return dict(db.execute(query).all())
+
+def with_pending_balances(db: Session, pharmacies: List[Pharmacy]) -> List[Pharmacy]:
+    """
+    ledger 模式下把未 rollup 的異動加到藥局的 cash_balance 上 (只改記憶體內的值，不會寫回 DB)
+    """
+    if not is_ledger_mode() or not pharmacies:
+        return pharmacies
+    pending = pending_deltas(db, "pharmacy", (ph.id for ph in pharmacies))
+    for ph in pharmacies:
+        if ph.id in pending:
+            set_committed_value(ph, "cash_balance", (ph.cash_balance or 0) + pending[ph.id])
+    return pharmacies
+
+_ROLLUP_SQL = text("""
+    WITH moved AS (
+        DELETE FROM balance_ledger
+        WHERE id IN (SELECT id FROM balance_ledger ORDER BY id LIMIT :batch)
+        RETURNING account_type, account_id, delta
+    ), totals AS (
+        SELECT account_type, account_id, sum(delta) AS delta
+        FROM moved
+        GROUP BY account_type, account_id
+    ), updated_pharmacies AS (
+        UPDATE pharmacies p SET cash_balance = p.cash_balance + t.delta
+        FROM totals t
+        WHERE t.account_type = 'pharmacy' AND p.id = t.account_id
+        RETURNING p.id
+    ), updated_users AS (
+        UPDATE users u SET cash_balance = u.cash_balance + t.delta
+        FROM totals t
+        WHERE t.account_type = 'user' AND u.id = t.account_id
+        RETURNING u.id
+    )
+    SELECT count(*) FROM moved
+""")
+
+def rollup_ledger(db: Session, batch: int = LEDGER_ROLLUP_BATCH) -> int:
+    """
+    把 ledger 併回 cash_balance：刪除異動與更新餘額在同一個 statement 內完成
+    回傳處理的異動筆數；其他 worker 正在 rollup 時直接回傳 0
+    """
+    total = 0
+    while True:
+        locked = db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _ROLLUP_LOCK_KEY}).scalar()
+        if not locked:
+            db.rollback()
+            return total
+        moved = db.execute(_ROLLUP_SQL, {"batch": batch}).scalar()
+        db.commit()
+        total += moved
+        if moved < batch:
+            return total
+
+def _rollup_loop(stop: threading.Event) -> None:
+    while not stop.wait(LEDGER_ROLLUP_INTERVAL):
+        db = SessionLocal()
+        try:
+            moved = rollup_ledger(db)
+            if moved:
+                logger.info("Rolled up %d balance ledger entries", moved)
+        except Exception:
+            db.rollback()
+            logger.exception("Balance ledger rollup failed")
+        finally:
+            db.close()
+
+def start_rollup_worker() -> threading.Event:
+    """
+    啟動背景 rollup thread，回傳用來停止它的 Event
+    """
+    stop = threading.Event()
+    threading.Thread(target=_rollup_loop, args=(stop,), name="ledger-rollup", daemon=True).start()
+    return stop
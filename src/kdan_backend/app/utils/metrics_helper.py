@@ -0,0 +1,35 @@
+import bisect
+import threading
+from typing import Dict, Sequence
+
+# 預設的秒數 bucket (1ms ~ 10s)
+DEFAULT_SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+    """
+    固定 bucket 的累計直方圖 (與 Prometheus histogram 相同語意：bucket 為 <= le 的累計次數)
+    """
+    def __init__(self, buckets: Sequence[float] = DEFAULT_SECONDS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = {}
+        running = 0
+        for le, count in zip(self.buckets, counts):
+            running += count
+            cumulative[str(le)] = running
+        running += counts[-1]
+        cumulative["+Inf"] = running
+        return {"buckets": cumulative, "count": running, "sum": total}
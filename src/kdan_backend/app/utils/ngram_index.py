@@ -0,0 +1,92 @@
+import heapq
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from sqlalchemy.orm import Session
+from app.models import Pharmacy, Mask
+from app.utils.catalog_index import CatalogIndex
+
+MAX_GRAM = 3
+# 同分時藥局排在口罩前面 (與原本先放藥局再 stable sort 的結果一致)
+KIND_ORDER = {"pharmacy": 0, "mask": 1}
+
+class SearchDoc(NamedTuple):
+    kind: str
+    id: int
+    pharmacy_id: int
+    name: str
+    price: Optional[float]
+
+# 排序鍵：(-rank, 類型, id)，越小越前面；也是分頁 cursor 的內容
+SortKey = Tuple[int, int, int]
+
+def rank_of(position: int) -> int:
+    """
+    相關度：關鍵字出現的位置越前面分數越高
+    """
+    return 100 - position
+
+class NgramIndex:
+    """
+    名稱 (小寫) 的 1~3-gram 倒排索引
+    - posting 記錄每個 gram 在該名稱中第一次出現的位置，長度 <= 3 的查詢可直接算出 rank
+    - 較長的查詢取最少筆的 trigram posting 作為候選，再以 str.find 驗證並算出 rank
+    - 結果以 heap 取前 k 筆，不排序全部符合的資料
+    """
+    def __init__(self, docs: Iterable[SearchDoc]):
+        self.docs: List[SearchDoc] = list(docs)
+        self._lowered = [doc.name.lower() for doc in self.docs]
+        postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        for doc_idx, name in enumerate(self._lowered):
+            for n in range(1, MAX_GRAM + 1):
+                for pos in range(len(name) - n + 1):
+                    postings[name[pos:pos + n]].setdefault(doc_idx, pos)
+        self._postings = dict(postings)
+
+    def _matches(self, q: str) -> Iterator[Tuple[int, int]]:
+        """
+        產生 (doc_idx, 第一次出現的位置)
+        """
+        if not q:
+            yield from ((doc_idx, 0) for doc_idx in range(len(self.docs)))
+            return
+        if len(q) <= MAX_GRAM:
+            yield from self._postings.get(q, {}).items()
+            return
+        candidates = []
+        for pos in range(len(q) - MAX_GRAM + 1):
+            posting = self._postings.get(q[pos:pos + MAX_GRAM])
+            if posting is None:
+                return
+            candidates.append(posting)
+        for doc_idx in min(candidates, key=len):
+            pos = self._lowered[doc_idx].find(q)
+            if pos >= 0:
+                yield doc_idx, pos
+
+    def sort_key(self, doc_idx: int, position: int) -> SortKey:
+        doc = self.docs[doc_idx]
+        return (-rank_of(position), KIND_ORDER[doc.kind], doc.id)
+
+    def search(self, q: str, limit: int,
+               after: Optional[Sequence[int]] = None) -> Tuple[List[Tuple[SortKey, SearchDoc]], bool]:
+        """
+        回傳 (排序鍵在 after 之後的前 limit 筆, 是否還有下一頁)
+        """
+        keys = (self.sort_key(doc_idx, pos) + (doc_idx,) for doc_idx, pos in self._matches(q.lower()))
+        if after is not None:
+            after = tuple(after)
+            keys = (key for key in keys if key[:3] > after)
+        top = heapq.nsmallest(limit + 1, keys)
+        hits = [(key[:3], self.docs[key[3]]) for key in top[:limit]]
+        return hits, len(top) > limit
+
+def build_ngram_index(db: Session) -> NgramIndex:
+    docs = [SearchDoc("pharmacy", pid, pid, name, None)
+            for pid, name in db.query(Pharmacy.id, Pharmacy.name)]
+    docs.extend(SearchDoc("mask", mid, pharmacy_id, name, price)
+                for mid, pharmacy_id, name, price in db.query(Mask.id, Mask.pharmacy_id, Mask.name, Mask.price))
+    return NgramIndex(docs)
+
+search_index: CatalogIndex[NgramIndex] = CatalogIndex(
+    "search", depends_on=("pharmacies.name", "masks"), builder=build_ngram_index
+)
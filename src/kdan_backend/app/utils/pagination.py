@@ -0,0 +1,104 @@
+import base64
+import json
+import math
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Type, Union
+from fastapi import HTTPException, Response
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import Session
+
+# 下一頁游標與總筆數放在 response header，維持原本的 response body 格式
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+# 列表路由的 limit 預設值與上限
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# 排序鍵為數值 (例如價格) 時 cursor 內可能是 int 或 float
+NUMBER = (int, float)
+# Postgres bigint 的範圍，超出時查詢會失敗
+_BIGINT = 2 ** 63
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    將排序鍵 (keyset) 編碼成不透明的 cursor 字串
+    """
+    raw = json.dumps(list(values), separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str],
+                  types: Sequence[Union[Type, Tuple[Type, ...]]]) -> Optional[List[Any]]:
+    """
+    解碼 cursor，types 為每個排序鍵的型別；格式錯誤或型別不符時回傳 400
+    (client 可任意竄改 cursor，不檢查的話會在比較或查詢時變成 500)
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if (not isinstance(values, list) or len(values) != len(types)
+            or not all(_is_valid(value, expected) for value, expected in zip(values, types))):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def _is_valid(value: Any, expected: Union[Type, Tuple[Type, ...]]) -> bool:
+    # bool 是 int 的子類別，排序鍵不會是 bool
+    if isinstance(value, bool) or not isinstance(value, expected):
+        return False
+    if isinstance(value, int):
+        return -_BIGINT <= value < _BIGINT
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return True
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]) -> None:
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+def set_total_count(response: Response, db: Session, query) -> None:
+    """
+    另外以 count(*) 計算總筆數 (query 為尚未加上 keyset 條件的 select)
+    """
+    total = db.execute(select(func.count()).select_from(query.order_by(None).subquery())).scalar()
+    response.headers[TOTAL_COUNT_HEADER] = str(total)
+
+def keyset_query(query, columns: Sequence[Any], after: Optional[List[Any]], limit: int, descending: bool = False):
+    """
+    依 columns 排序，從 after 之後開始取 limit + 1 筆 (多取一筆用來判斷是否還有下一頁)
+    columns 需能唯一決定順序且有對應的索引，任何一頁都只需走索引，不需 OFFSET 跳過前面的列
+    """
+    key = columns[0] if len(columns) == 1 else tuple_(*columns)
+    if after is not None:
+        bound = after[0] if len(columns) == 1 else tuple_(*after)
+        query = query.where(key < bound if descending else key > bound)
+    return (query
+            .order_by(*(column.desc() if descending else column.asc() for column in columns))
+            .limit(limit + 1))
+
+def keyset_slice(items: Sequence[Any], key_of: Callable[[Any], List[Any]], after: Optional[List[Any]],
+                 limit: int, descending: bool = False) -> List[Any]:
+    """
+    keyset_query 的記憶體版本，用於已在快取中的資料：排序後取 after 之後的 limit + 1 筆
+    """
+    ordered = sorted(items, key=key_of, reverse=descending)
+    if after is not None:
+        try:
+            ordered = [item for item in ordered
+                       if (key_of(item) < after if descending else key_of(item) > after)]
+        except TypeError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return ordered[:limit + 1]
+
+def finish_page(items: List[Any], limit: int, key_of: Callable[[Any], Sequence[Any]],
+                response: Response) -> List[Any]:
+    """
+    去掉多取的那一筆，還有下一頁時以本頁最後一筆的排序鍵設定 X-Next-Cursor
+    """
+    if len(items) <= limit:
+        return items
+    items = items[:limit]
+    set_next_cursor(response, encode_cursor(key_of(items[-1])))
+    return items
@@ -0,0 +1,49 @@
+import logging
+import threading
+from migrations import partitions
+from app.config import PARTITION_MAINTENANCE_INTERVAL, PARTITION_MONTHS_AHEAD, PARTITION_RETENTION_MONTHS
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+def maintain_partitions() -> bool:
+    """
+    建立未來 PARTITION_MONTHS_AHEAD 個月的 purchase_histories 分區，
+    PARTITION_RETENTION_MONTHS > 0 時卸離更早的分區；其他 process 正在維護時回傳 False
+    """
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        if not partitions.try_lock_maintenance(cursor):
+            conn.rollback()
+            return False
+        created, detached = partitions.maintain(cursor, PARTITION_MONTHS_AHEAD, PARTITION_RETENTION_MONTHS)
+        conn.commit()
+        if created:
+            logger.info("Created purchase_histories partitions: %s", ", ".join(m.strftime("%Y-%m") for m in created))
+        if detached:
+            logger.info("Detached purchase_histories partitions: %s", ", ".join(detached))
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _maintenance_loop(stop: threading.Event) -> None:
+    # 啟動後先執行一次，之後每 PARTITION_MAINTENANCE_INTERVAL 秒
+    while True:
+        try:
+            maintain_partitions()
+        except Exception:
+            logger.exception("purchase_histories partition maintenance failed")
+        if stop.wait(PARTITION_MAINTENANCE_INTERVAL):
+            return
+
+def start_partition_maintenance() -> threading.Event:
+    """
+    啟動背景分區維護 thread，回傳用來停止它的 Event
+    """
+    stop = threading.Event()
+    threading.Thread(target=_maintenance_loop, args=(stop,), name="partition-maintenance", daemon=True).start()
+    return stop
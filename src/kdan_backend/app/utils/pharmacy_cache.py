@@ -0,0 +1,45 @@
+from collections import defaultdict
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.models import Mask, Pharmacy
+from app.utils.catalog_index import CatalogCache
+
+class CachedMask(NamedTuple):
+    id: int
+    name: str
+    price: Optional[float]
+    pharmacy_id: int
+
+class CachedPharmacy(NamedTuple):
+    """
+    藥局的 catalog 資料；cash_balance 隨交易變動，不放進快取
+    """
+    id: int
+    name: str
+    masks: Tuple[CachedMask, ...]
+    mask_ids: FrozenSet[int]
+
+def load_pharmacies(db: Session, pharmacy_ids: Set[int]) -> Dict[int, CachedPharmacy]:
+    """
+    以兩個查詢載入多間藥局與其口罩
+    """
+    names = dict(db.execute(select(Pharmacy.id, Pharmacy.name).where(Pharmacy.id.in_(pharmacy_ids))).all())
+    if not names:
+        return {}
+    masks: Dict[int, List[CachedMask]] = defaultdict(list)
+    rows = db.execute(
+        select(Mask.id, Mask.name, Mask.price, Mask.pharmacy_id)
+        .where(Mask.pharmacy_id.in_(names))
+        .order_by(Mask.pharmacy_id, Mask.id)
+    )
+    for mask_id, name, price, pharmacy_id in rows:
+        masks[pharmacy_id].append(CachedMask(mask_id, name, price, pharmacy_id))
+    return {
+        pid: CachedPharmacy(pid, name, tuple(masks[pid]), frozenset(m.id for m in masks[pid]))
+        for pid, name in names.items()
+    }
+
+pharmacy_cache: CatalogCache[int, CachedPharmacy] = CatalogCache(
+    "pharmacies", depends_on=("pharmacies.name", "masks"), loader=load_pharmacies
+)
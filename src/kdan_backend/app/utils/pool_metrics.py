@@ -0,0 +1,91 @@
+import threading
+import time
+from typing import Dict
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from app.utils.metrics_helper import Histogram
+
+class PoolStats:
+    """
+    單一連線池的統計：
+    - checkout_wait: 向 pool 取得連線花的時間 (含排隊等待與建立新連線)
+    - checkout_duration: 連線從取出到歸還的時間
+    - statements: 執行過的 SQL statement 數 (壓測以前後差值計算每個請求的查詢數)
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.checkout_wait = Histogram()
+        self.checkout_duration = Histogram()
+        self.timeouts = 0
+        self.statements = 0
+        self.engine = None
+        self._lock = threading.Lock()
+
+    def count_statement(self) -> None:
+        with self._lock:
+            self.statements += 1
+
+    def snapshot(self) -> Dict:
+        pool = self.engine.pool
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "timeouts": self.timeouts,
+            "statements": self.statements,
+            "checkout_wait_seconds": self.checkout_wait.snapshot(),
+            "checkout_duration_seconds": self.checkout_duration.snapshot(),
+        }
+
+_pools: Dict[str, PoolStats] = {}
+
+class _TimedCheckout:
+    """
+    記錄 _do_get (從 pool 取連線) 的耗時；stats 以 class attribute 綁定，
+    pool 被 recreate (例如 engine.dispose()) 後仍沿用同一份統計
+    """
+    stats: PoolStats
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            self.stats.checkout_wait.observe(time.perf_counter() - started)
+
+def instrumented_pool_class(name: str, is_async: bool = False):
+    """
+    產生要傳給 create_engine(poolclass=...) 的 pool class
+    """
+    stats = _pools.setdefault(name, PoolStats(name))
+    base = AsyncAdaptedQueuePool if is_async else QueuePool
+    return type(f"Instrumented{base.__name__}", (_TimedCheckout, base), {"stats": stats})
+
+def instrument_engine(name: str, engine) -> None:
+    """
+    掛上 checkout / checkin 事件以計算連線占用時間，並計算執行的 statement 數
+    (async engine 請傳入 sync_engine)
+    """
+    stats = _pools[name]
+    stats.engine = engine
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop("checked_out_at", None)
+        if started is not None:
+            stats.checkout_duration.observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        stats.count_statement()
+
+def pool_snapshots() -> Dict[str, Dict]:
+    return {name: stats.snapshot() for name, stats in _pools.items() if stats.engine is not None}
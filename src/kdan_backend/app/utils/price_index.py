@@ -0,0 +1,81 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.models import Mask, Pharmacy
+from app.utils.catalog_index import CatalogIndex
+
+# count_op -> 判斷口罩數量是否符合 (count, count_value, count_max)
+COUNT_OPS: Dict[str, Callable[[int, int, Optional[int]], bool]] = {
+    "gt": lambda count, value, _: count > value,
+    "gte": lambda count, value, _: count >= value,
+    "lt": lambda count, value, _: count < value,
+    "lte": lambda count, value, _: count <= value,
+    "eq": lambda count, value, _: count == value,
+    "between": lambda count, value, count_max: value <= count <= count_max,
+}
+
+class PriceRangeIndex:
+    """
+    每間藥局 (含沒有口罩的) 的口罩價格排序陣列
+    價格區間內的口罩數量為兩次二分搜尋，篩選全部藥局為 O(P log M)
+    """
+    def __init__(self, pharmacy_ids: Iterable[int], prices: Iterable[Tuple[int, float]]):
+        per_pharmacy: Dict[int, List[float]] = defaultdict(list)
+        for pharmacy_id, price in prices:
+            if price is not None:
+                per_pharmacy[pharmacy_id].append(price)
+        self._prices: List[Tuple[int, List[float]]] = [
+            (pid, sorted(per_pharmacy.get(pid, ()))) for pid in sorted(set(pharmacy_ids))
+        ]
+
+    @staticmethod
+    def _count(prices: List[float], price_min: float, price_max: float) -> int:
+        return max(bisect_right(prices, price_max) - bisect_left(prices, price_min), 0)
+
+    def filter(self, count_op: str, count_value: int, price_min: float, price_max: float,
+               count_max: Optional[int] = None) -> List[int]:
+        """
+        回傳 price_min ~ price_max (含頭尾) 的口罩數量符合 count_op 的藥局 id (依 id 排序)
+        """
+        matches = COUNT_OPS[count_op]
+        return [
+            pid for pid, prices in self._prices
+            if matches(self._count(prices, price_min, price_max), count_value, count_max)
+        ]
+
+def count_filter_query(count_op: str, count_value: int, price_min: float, price_max: float,
+                       count_max: Optional[int] = None):
+    """
+    FILTER_BACKEND=sql：與 PriceRangeIndex.filter 相同的結果，交給 PostgreSQL 計算
+    價格區間走 (price, pharmacy_id) 索引，以 LEFT JOIN 讓區間內沒有口罩的藥局也以 0 參與比較
+    """
+    subq_count = (select(Mask.pharmacy_id, func.count().label("cnt"))
+                  .where(Mask.price.between(price_min, price_max))
+                  .group_by(Mask.pharmacy_id)
+                  ).subquery()
+    cnt = func.coalesce(subq_count.c.cnt, 0)
+    conditions = {
+        "gt": cnt > count_value,
+        "gte": cnt >= count_value,
+        "lt": cnt < count_value,
+        "lte": cnt <= count_value,
+        "eq": cnt == count_value,
+        "between": cnt.between(count_value, count_max),
+    }
+    return (select(Pharmacy.id)
+            .outerjoin(subq_count, subq_count.c.pharmacy_id == Pharmacy.id)
+            .where(conditions[count_op])
+            .order_by(Pharmacy.id))
+
+def build_price_index(db: Session) -> PriceRangeIndex:
+    return PriceRangeIndex(
+        (pid for pid, in db.query(Pharmacy.id)),
+        db.query(Mask.pharmacy_id, Mask.price),
+    )
+
+# cash_balance 等其他欄位的更新不影響此索引
+price_index: CatalogIndex[PriceRangeIndex] = CatalogIndex(
+    "price", depends_on=("pharmacies.id", "masks.price", "masks.pharmacy_id"), builder=build_price_index
+)
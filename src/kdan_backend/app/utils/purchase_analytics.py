@@ -0,0 +1,347 @@
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.config import ANALYTICS_FULL_REFRESH, ANALYTICS_PARQUET, ANALYTICS_REFRESH_INTERVAL
+from app.database import run_on_primary
+from app.models import Mask, Pharmacy, PurchaseHistory, User
+from app.utils.rollup_helper import inclusive_end
+from app.utils.single_flight import SingleFlight
+
+try:
+    import numpy as np
+except ImportError:  # ANALYTICS_BACKEND=sql 時不需要 numpy
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 未安裝 pyarrow 時不寫入 / 讀取 Parquet
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+# 每批從 DB 讀取的列數
+FETCH_BATCH = 100_000
+# 增量更新時往回重讀的 id 數：id 由 sequence 配發但 commit 順序不一定相同，
+# 較小的 id 可能晚於較大的 id 才看得到，重讀這段並略過已載入的 id
+ID_LOOKBACK = 10_000
+
+_COLUMNS = (
+    PurchaseHistory.id,
+    PurchaseHistory.transaction_date,
+    PurchaseHistory.user_id,
+    PurchaseHistory.pharmacy_id,
+    PurchaseHistory.mask_id,
+    PurchaseHistory.quantity,
+    PurchaseHistory.transaction_amount,
+)
+
+class PurchaseColumns(NamedTuple):
+    """
+    一段依 ts 排序的欄式資料；mask_id 為 NULL 時存 -1
+    建立後不再修改，更新時換成新的一份，讀取中的請求不受影響
+    """
+    id: "np.ndarray"
+    ts: "np.ndarray"
+    user_id: "np.ndarray"
+    pharmacy_id: "np.ndarray"
+    mask_id: "np.ndarray"
+    quantity: "np.ndarray"
+    amount: "np.ndarray"
+
+    @property
+    def rows(self) -> int:
+        return len(self.id)
+
+    def date_range(self, start: datetime, end: datetime) -> slice:
+        """
+        start ~ end (含頭尾) 的交易在陣列中的範圍，兩次二分搜尋
+        """
+        lo = int(np.searchsorted(self.ts, _datetime64(start), side="left"))
+        hi = int(np.searchsorted(self.ts, _datetime64(end), side="right"))
+        return slice(lo, max(lo, hi))
+
+    def take(self, index) -> "PurchaseColumns":
+        return PurchaseColumns(*(array[index] for array in self))
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("ANALYTICS_BACKEND=columnar requires numpy (pip install numpy)")
+
+def _datetime64(value: datetime) -> "np.datetime64":
+    # transaction_date 為不帶時區的 TIMESTAMP，與 SQL 的比較方式相同
+    return np.datetime64(value.replace(tzinfo=None), "us")
+
+def _to_columns(rows) -> PurchaseColumns:
+    ids, ts, user_ids, pharmacy_ids, mask_ids, quantities, amounts = zip(*rows)
+    return PurchaseColumns(
+        id=np.array(ids, np.int64),
+        ts=np.array(ts, "datetime64[us]"),
+        user_id=np.array(user_ids, np.int32),
+        pharmacy_id=np.array(pharmacy_ids, np.int32),
+        mask_id=np.array([-1 if m is None else m for m in mask_ids], np.int32),
+        # 與 SQL 的 SUM(quantity) 一致：NULL 不計入
+        quantity=np.array([0 if q is None else q for q in quantities], np.int32),
+        amount=np.array([0.0 if a is None else a for a in amounts], np.float64),
+    )
+
+def _merge(parts: List[PurchaseColumns]) -> Optional[PurchaseColumns]:
+    """
+    合併成一段並依 ts 排序 (stable，相同時間維持原本順序)
+    """
+    parts = [p for p in parts if p.rows]
+    if not parts:
+        return None
+    merged = PurchaseColumns(*(np.concatenate(arrays) for arrays in zip(*parts)))
+    return merged.take(np.argsort(merged.ts, kind="stable"))
+
+def _fetch(db: Session, after_id: int) -> Optional[PurchaseColumns]:
+    query = (select(*_COLUMNS)
+             .where(PurchaseHistory.id > after_id)
+             .execution_options(stream_results=True, yield_per=FETCH_BATCH))
+    return _merge([_to_columns(batch) for batch in db.execute(query).partitions(FETCH_BATCH)])
+
+class Snapshot(NamedTuple):
+    """
+    多段 PurchaseColumns：完整載入的一段加上之後增量讀到的幾段，每段各自依 ts 排序
+    增量的段數超過 MAX_SEGMENTS 時才合併，避免每次更新都複製整份資料
+    """
+    segments: Tuple[PurchaseColumns, ...]
+
+    @property
+    def rows(self) -> int:
+        return sum(segment.rows for segment in self.segments)
+
+    def window(self, start: datetime, end: datetime, *fields: str) -> List["np.ndarray"]:
+        """
+        start ~ end 內的交易的指定欄位 (各段以二分搜尋取範圍後串接)；end 的處理與 SQL 相同 (inclusive_end)
+        """
+        end = inclusive_end(end)
+        ranges = [(segment, segment.date_range(start, end)) for segment in self.segments]
+        return [np.concatenate([getattr(segment, field)[window] for segment, window in ranges])
+                if ranges else np.empty(0) for field in fields]
+
+# 增量的段數上限
+MAX_SEGMENTS = 16
+
+class PurchaseSnapshot:
+    """
+    purchase_histories 的欄式快照，每個 worker 各一份
+    - 第一次使用時載入全部 (有 ANALYTICS_PARQUET 時先讀檔，再補上之後新增的)
+    - 之後超過 ANALYTICS_REFRESH_INTERVAL 秒才在請求時增量讀取 id 大於已載入最大 id 的交易
+    - 增量更新看不到既有交易的修改與刪除 (etl.py incremental、刪除使用者)，每 ANALYTICS_FULL_REFRESH 秒完整重建；
+      資料表被重建 (max(id) 變小) 時立即完整重建
+    """
+    def __init__(self):
+        self._flight = SingleFlight()
+        self._snapshot: Optional[Snapshot] = None
+        self._watermark = 0
+        # 最大 id 往回 ID_LOOKBACK 以內已載入的 id
+        self._recent_ids: Set[int] = set()
+        self._built_at = 0.0
+        self._refreshed_at = 0.0
+
+    def get(self, db: Session) -> Snapshot:
+        _require_numpy()
+        while True:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._refreshed_at < ANALYTICS_REFRESH_INTERVAL:
+                return snapshot
+            # 已有快照時不等待其他呼叫者更新
+            updated, _ = self._flight.run(lambda: self._update(db), wait=snapshot is None)
+            if updated:
+                return self._snapshot
+            if snapshot is not None:
+                return snapshot
+
+    def _update(self, db: Session) -> None:
+        # 一律讀 primary：落後的 replica 上 max(id) 會小於 watermark，每次都變成全部重建
+        run_on_primary(db, self._update_from)
+
+    def _update_from(self, db: Session) -> None:
+        if self._snapshot is None and ANALYTICS_PARQUET and os.path.exists(ANALYTICS_PARQUET):
+            self._load_parquet(ANALYTICS_PARQUET)
+        now = time.monotonic()
+        if self._snapshot is None or now - self._built_at >= ANALYTICS_FULL_REFRESH:
+            self._rebuild(db)
+        elif now - self._refreshed_at >= ANALYTICS_REFRESH_INTERVAL:
+            self._refresh(db)
+
+    def _set(self, segments: List[PurchaseColumns]) -> None:
+        segments = [segment for segment in segments if segment is not None and segment.rows]
+        if len(segments) > MAX_SEGMENTS:
+            segments = [_merge(segments)]
+        self._snapshot = Snapshot(tuple(segments))
+        # 新的段只會有更大的 id 或回補 ID_LOOKBACK 內的 id
+        ids = [segment.id for segment in segments]
+        self._watermark = max((int(a.max()) for a in ids), default=0)
+        floor = self._watermark - ID_LOOKBACK
+        self._recent_ids = {i for a in ids for i in a[a > floor].tolist()}
+        self._refreshed_at = time.monotonic()
+
+    def _rebuild(self, db: Session) -> None:
+        started = time.perf_counter()
+        self._set([_fetch(db, 0)])
+        self._built_at = time.monotonic()
+        logger.info("Purchase snapshot built: %d rows in %.2fs", self._snapshot.rows, time.perf_counter() - started)
+        if ANALYTICS_PARQUET:
+            self.save(ANALYTICS_PARQUET)
+
+    def _refresh(self, db: Session) -> None:
+        max_id = db.execute(select(func.max(PurchaseHistory.id))).scalar() or 0
+        if max_id < self._watermark:
+            self._rebuild(db)
+            return
+        if max_id == self._watermark:
+            self._refreshed_at = time.monotonic()
+            return
+        fetched = _fetch(db, max(self._watermark - ID_LOOKBACK, 0))
+        if fetched is not None and self._recent_ids:
+            seen = np.fromiter(self._recent_ids, np.int64, len(self._recent_ids))
+            fetched = fetched.take(~np.isin(fetched.id, seen))
+        self._set([*self._snapshot.segments, fetched])
+
+    def save(self, path: str) -> bool:
+        """
+        合併成一段後寫成 Parquet (需要 pyarrow)，重新啟動時不必從 DB 讀取全部交易
+        """
+        snapshot = self._snapshot
+        if pa is None or snapshot is None or not snapshot.rows:
+            return False
+        columns = _merge(list(snapshot.segments))
+        table = pa.table({name: getattr(columns, name) for name in PurchaseColumns._fields})
+        table = table.replace_schema_metadata({"built_at": str(time.time())})
+        # 同一台機器的多個 worker 可能同時寫入，各自使用不同的暫存檔
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        return True
+
+    def _load_parquet(self, path: str) -> None:
+        if pa is None:
+            logger.warning("ANALYTICS_PARQUET is set but pyarrow is not installed; loading from the database")
+            return
+        table = pq.read_table(path)
+        self._set([PurchaseColumns(*(table.column(name).to_numpy() for name in PurchaseColumns._fields))])
+        # 依檔案建立的時間排定下次完整重建
+        built_at = float((table.schema.metadata or {}).get(b"built_at", time.time()))
+        self._built_at = time.monotonic() - max(time.time() - built_at, 0)
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        segments = snapshot.segments if snapshot is not None else ()
+        return {
+            "rows": sum(segment.rows for segment in segments),
+            "segments": len(segments),
+            "max_id": self._watermark,
+            "bytes": sum(array.nbytes for segment in segments for array in segment),
+        }
+
+purchase_snapshot = PurchaseSnapshot()
+
+def _group_sums(keys: "np.ndarray", quantity: "np.ndarray", amount: "np.ndarray"
+                ) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    依 key (非負整數 id) 分組加總：回傳 (有交易的 key, 數量, 金額, 交易筆數)
+    """
+    if not len(keys):
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64), np.empty(0, np.int64)
+    keys = keys.astype(np.int64, copy=False)
+    counts = np.bincount(keys)
+    present = np.nonzero(counts)[0]
+    quantities = np.bincount(keys, weights=quantity)[present].astype(np.int64)
+    amounts = np.bincount(keys, weights=amount)[present]
+    return present, quantities, amounts, counts[present]
+
+def _top(amounts: "np.ndarray", keys: "np.ndarray", limit: int) -> "np.ndarray":
+    """
+    依金額由大到小、金額相同時 id 由小到大，取前 limit 個的位置
+    """
+    return np.lexsort((keys, -amounts))[:limit]
+
+def top_spenders(db: Session, start: datetime, end: datetime, top_x: int) -> List[Tuple[int, str, float]]:
+    """
+    與 rollup_helper.top_spenders_query 相同的結果：[(user_id, user_name, total_spent), ...]
+    """
+    user_ids, quantity, amount = purchase_snapshot.get(db).window(start, end, "user_id", "quantity", "amount")
+    users, _, amounts, _ = _group_sums(user_ids, quantity, amount)
+    ranked = _top(amounts, users, len(users))
+    result: List[Tuple[int, str, float]] = []
+    # 快照完整重建前，已刪除的使用者仍可能出現：查不到名稱的略過，由後面的名次遞補 (與 SQL 的 JOIN 相同)
+    for lo in range(0, len(ranked), max(top_x, 1)):
+        if len(result) >= top_x:
+            break
+        chunk = ranked[lo:lo + top_x]
+        ids = [int(users[i]) for i in chunk]
+        names = dict(db.execute(select(User.id, User.name).where(User.id.in_(ids))).all())
+        result.extend((uid, names[uid], float(amounts[i])) for uid, i in zip(ids, chunk) if uid in names)
+    return result[:top_x]
+
+def transaction_summary(db: Session, start: datetime, end: datetime) -> Tuple[int, float]:
+    """
+    (數量加總, 金額加總)
+    """
+    quantity, amount = purchase_snapshot.get(db).window(start, end, "quantity", "amount")
+    return int(quantity.sum()), float(amount.sum())
+
+def _revenue(db: Session, start: datetime, end: datetime, key: str, limit: int):
+    keys, quantity, amount = purchase_snapshot.get(db).window(start, end, key, "quantity", "amount")
+    if key == "mask_id":
+        # 沒有對應口罩的交易不列入
+        known = keys >= 0
+        keys, quantity, amount = keys[known], quantity[known], amount[known]
+    ids, quantities, amounts, counts = _group_sums(keys, quantity, amount)
+    top = _top(amounts, ids, limit)
+    return [(int(ids[i]), int(quantities[i]), float(amounts[i]), int(counts[i])) for i in top]
+
+def revenue_by_pharmacy(db: Session, start: datetime, end: datetime, limit: int) -> List[Tuple]:
+    """
+    [(pharmacy_id, pharmacy_name, total_quantity, total_amount, transactions), ...]，依金額由大到小
+    """
+    rows = _revenue(db, start, end, "pharmacy_id", limit)
+    names = dict(db.execute(select(Pharmacy.id, Pharmacy.name)
+                            .where(Pharmacy.id.in_([row[0] for row in rows]))).all())
+    return [(pid, names.get(pid), quantity, amount, count) for pid, quantity, amount, count in rows]
+
+def revenue_by_mask(db: Session, start: datetime, end: datetime, limit: int) -> List[Tuple]:
+    """
+    [(mask_id, mask_name, pharmacy_id, total_quantity, total_amount, transactions), ...]，依金額由大到小
+    """
+    rows = _revenue(db, start, end, "mask_id", limit)
+    masks = {m.id: m for m in db.execute(select(Mask.id, Mask.name, Mask.pharmacy_id)
+                                         .where(Mask.id.in_([row[0] for row in rows]))).all()}
+    return [
+        (mid, masks[mid].name if mid in masks else None, masks[mid].pharmacy_id if mid in masks else None,
+         quantity, amount, count)
+        for mid, quantity, amount, count in rows
+    ]
+
+def _revenue_query(key, start: datetime, end: datetime, limit: int):
+    total_amount = func.sum(PurchaseHistory.transaction_amount)
+    return (select(key, func.sum(PurchaseHistory.quantity), total_amount, func.count())
+            .where(PurchaseHistory.transaction_date.between(start, inclusive_end(end)), key.isnot(None))
+            .group_by(key)
+            .order_by(total_amount.desc(), key)
+            .limit(limit)
+            .subquery())
+
+def revenue_by_pharmacy_query(start: datetime, end: datetime, limit: int):
+    """
+    ANALYTICS_BACKEND=sql：依日期剪枝到涵蓋的月份分區後 GROUP BY
+    """
+    sub = _revenue_query(PurchaseHistory.pharmacy_id, start, end, limit)
+    pharmacy_id, quantity, amount, count = sub.c
+    return (select(pharmacy_id, Pharmacy.name, quantity, amount, count)
+            .outerjoin(Pharmacy, Pharmacy.id == pharmacy_id)
+            .order_by(amount.desc(), pharmacy_id))
+
+def revenue_by_mask_query(start: datetime, end: datetime, limit: int):
+    sub = _revenue_query(PurchaseHistory.mask_id, start, end, limit)
+    mask_id, quantity, amount, count = sub.c
+    return (select(mask_id, Mask.name, Mask.pharmacy_id, quantity, amount, count)
+            .outerjoin(Mask, Mask.id == mask_id)
+            .order_by(amount.desc(), mask_id))
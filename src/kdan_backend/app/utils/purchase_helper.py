@@ -0,0 +1,96 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set
+from sqlalchemy import Float, Integer, column, insert, select, update, values
+from sqlalchemy.orm import Session
+from app.models import Mask, Pharmacy, PurchaseHistory, User
+from app.utils.pharmacy_cache import pharmacy_cache
+
+def lock_pharmacies(db: Session, pharmacy_ids: Iterable[int], lock: bool = True) -> Set[int]:
+    """
+    一次鎖定所有相關藥局並回傳存在的 id
+    依 id 排序上鎖，並行的交易以相同順序取得鎖，避免互相 deadlock
+    lock=False 時只確認存在 (ledger 模式不更新藥局，不需要鎖)
+    """
+    pharmacy_ids = set(pharmacy_ids)
+    if not pharmacy_ids:
+        return set()
+    query = (select(Pharmacy.id)
+             .where(Pharmacy.id.in_(pharmacy_ids))
+             .order_by(Pharmacy.id))
+    if lock:
+        query = query.with_for_update()
+    return set(db.execute(query).scalars())
+
+def find_mask_pharmacies(db: Session, mask_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    一次查出 mask_id -> pharmacy_id
+    """
+    mask_ids = set(mask_ids)
+    if not mask_ids:
+        return {}
+    return dict(db.execute(select(Mask.id, Mask.pharmacy_id).where(Mask.id.in_(mask_ids))).all())
+
+def cached_mask_pharmacies(db: Session, items) -> Dict[int, int]:
+    """
+    與 find_mask_pharmacies 相同，但先比對 catalog 快取中各藥局的口罩
+    快取中對不上的 (例如其他 worker 剛新增、NOTIFY 尚未送達) 再查 DB 確認，不會誤判為不存在
+    """
+    entries = pharmacy_cache.get_many(db, {item.pharmacy_id for item in items if item.mask_id})
+    found: Dict[int, int] = {}
+    unknown: Set[int] = set()
+    for item in items:
+        if not item.mask_id:
+            continue
+        entry = entries.get(item.pharmacy_id)
+        if entry is not None and item.mask_id in entry.mask_ids:
+            found[item.mask_id] = item.pharmacy_id
+        else:
+            unknown.add(item.mask_id)
+    found.update(find_mask_pharmacies(db, unknown - found.keys()))
+    return found
+
+def sum_by_pharmacy(items) -> Dict[int, float]:
+    deltas: Dict[int, float] = defaultdict(float)
+    for item in items:
+        deltas[item.pharmacy_id] += item.transaction_amount
+    return dict(deltas)
+
+def apply_balance_deltas(db: Session, model, deltas: Dict[int, float]) -> None:
+    """
+    以單一 UPDATE ... FROM (VALUES ...) 調整多筆 users / pharmacies 的 cash_balance
+    """
+    if not deltas:
+        return
+    delta_rows = values(
+        column("id", Integer), column("delta", Float), name="deltas"
+    ).data(sorted(deltas.items()))
+    db.execute(
+        update(model)
+        .where(model.id == delta_rows.c.id)
+        .values(cash_balance=model.cash_balance + delta_rows.c.delta)
+        .execution_options(synchronize_session=False)
+    )
+
+def apply_pharmacy_deltas(db: Session, deltas: Dict[int, float]) -> None:
+    apply_balance_deltas(db, Pharmacy, deltas)
+
+def lock_users(db: Session, user_ids: Iterable[int]) -> Dict[int, float]:
+    """
+    依 id 排序一次鎖定多個 user，回傳存在的 user_id -> cash_balance
+    (與單筆購買相同，先鎖 user 再鎖藥局)
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    query = (select(User.id, User.cash_balance)
+             .where(User.id.in_(user_ids))
+             .order_by(User.id)
+             .with_for_update())
+    return {user_id: balance or 0 for user_id, balance in db.execute(query).all()}
+
+def insert_purchase_histories(db: Session, rows: List[dict]) -> None:
+    """
+    以 multi-row INSERT 寫入多筆 purchase_histories
+    """
+    if rows:
+        db.execute(insert(PurchaseHistory), rows)
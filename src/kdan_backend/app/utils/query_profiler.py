@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+from sqlalchemy import event
+from app.config import EXPLAIN_SAMPLE_RATE, QUERY_PROFILE_PLANS, SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+# 等待 EXPLAIN 的 statement 上限，滿了就丟棄 (不讓 profiler 拖慢請求)
+EXPLAIN_QUEUE_SIZE = 100
+# EXPLAIN ANALYZE 會真的執行一次查詢，限制它的執行時間
+EXPLAIN_TIMEOUT_MS = 30000
+# 只 EXPLAIN 讀取的 statement；其餘即使 rollback 也會拿鎖、觸發 trigger
+_READ_ONLY = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+# WITH 內可以有 DELETE ... RETURNING 等修改資料的子句 (例如 ledger 的 rollup)
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE)\b", re.IGNORECASE)
+# SELECT ... FOR UPDATE 會在旁路連線上等原本的交易放鎖
+_LOCKING = re.compile(r"\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE|KEY\s+SHARE)\b", re.IGNORECASE)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM = re.compile(r"%\([^)]+\)s|%s|\$\d+")
+# IN (?, ?, ?) 的參數數量不同仍視為同一個 statement
+_PARAM_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+def fingerprint(statement: str) -> str:
+    """
+    把字串、數字與 bind 參數換成 ?，IN 的參數列表收成 (...)，空白壓成一格
+    """
+    normalized = _STRING.sub("?", statement)
+    normalized = _PARAM.sub("?", normalized)
+    normalized = _NUMBER.sub("?", normalized)
+    normalized = _PARAM_LIST.sub("(...)", normalized)
+    return _SPACE.sub(" ", normalized).strip()
+
+class StatementStats:
+    """
+    單一 fingerprint 的呼叫次數、總耗時與最大耗時，以及抽樣取得的執行計畫
+    """
+    def __init__(self, statement: str):
+        self.statement = statement
+        self.calls = 0
+        self.slow_calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.plans: Deque[Dict] = deque(maxlen=QUERY_PROFILE_PLANS)
+
+    def snapshot(self, fp: str) -> Dict:
+        return {
+            "fingerprint": fp,
+            "example": self.statement,
+            "calls": self.calls,
+            "slow_calls": self.slow_calls,
+            "total_ms": round(self.total_seconds * 1000, 3),
+            "mean_ms": round(self.total_seconds * 1000 / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "plans": list(self.plans),
+        }
+
+class QueryProfiler:
+    def __init__(self):
+        self.stats: Dict[str, StatementStats] = {}
+        self.started_at = datetime.now(timezone.utc)
+        self.explain_queue: "queue.Queue" = queue.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+        self.explain_dropped = 0
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, parameters, seconds: float, explainable: bool) -> None:
+        fp = fingerprint(statement)
+        slow = seconds * 1000 >= SLOW_QUERY_MS
+        with self._lock:
+            stats = self.stats.get(fp)
+            if stats is None:
+                stats = self.stats[fp] = StatementStats(statement)
+            stats.calls += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            if slow:
+                stats.slow_calls += 1
+        if slow and explainable and random.random() < EXPLAIN_SAMPLE_RATE:
+            params = dict(parameters) if isinstance(parameters, dict) else parameters
+            try:
+                self.explain_queue.put_nowait((fp, statement, params, seconds))
+            except queue.Full:
+                self.explain_dropped += 1
+
+    def add_plan(self, fp: str, plan: Dict) -> None:
+        with self._lock:
+            stats = self.stats.get(fp)
+            if stats is not None:
+                stats.plans.append(plan)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stats = {}
+            self.started_at = datetime.now(timezone.utc)
+
+    def snapshot(self, limit: Optional[int] = None) -> Dict:
+        """
+        依總耗時排序的 statement 統計
+        """
+        with self._lock:
+            statements = [stats.snapshot(fp) for fp, stats in self.stats.items()]
+        statements.sort(key=lambda s: s["total_ms"], reverse=True)
+        return {
+            "since": self.started_at.isoformat(),
+            "slow_query_ms": SLOW_QUERY_MS,
+            "explain_sample_rate": EXPLAIN_SAMPLE_RATE,
+            "explain_pending": self.explain_queue.qsize(),
+            "explain_dropped": self.explain_dropped,
+            "statements": statements[:limit] if limit else statements,
+        }
+
+    def dump(self, path: str) -> str:
+        """
+        把目前的統計寫成 JSON 檔，回傳實際的路徑 (path 中的 {pid} 換成 process id，多個 worker 不互相覆寫)
+        """
+        path = path.format(pid=os.getpid())
+        snapshot = self.snapshot()
+        with open(path, "w", encoding="utf-8") as f:
+            # 參數可能含 datetime / Decimal
+            json.dump(snapshot, f, ensure_ascii=False, indent=2, default=str)
+        return path
+
+query_profiler = QueryProfiler()
+
+def profile_engine(engine) -> None:
+    """
+    掛上 cursor 事件記錄每個 statement 的耗時 (async engine 請傳入 sync_engine)；
+    只有 psycopg2 的 statement 會送去 EXPLAIN (參數格式與旁路連線相同)
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["profile_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("profile_started", None)
+        if started is None:
+            return
+        explainable = not executemany and conn.dialect.driver == "psycopg2" and is_read_only(statement)
+        query_profiler.record(statement, parameters, time.perf_counter() - started, explainable)
+
+def is_read_only(statement: str) -> bool:
+    """
+    只讀取、不上鎖的 statement 才能在旁路連線重新執行 (字串常數內的關鍵字不算)
+    """
+    if _READ_ONLY.match(statement) is None:
+        return False
+    code = _STRING.sub("''", statement)
+    return _LOCKING.search(code) is None and _WRITES.search(code) is None
+
+def explain_analyze(engine, statement: str, parameters) -> List:
+    """
+    在另一條連線以 EXPLAIN (ANALYZE, BUFFERS) 重新執行，結束後 rollback
+    交易設為 READ ONLY：即使 is_read_only 漏判，會寫入的 statement 也只會失敗，不會執行
+    """
+    if not is_read_only(statement):
+        raise ValueError("Only read-only statements can be explained")
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SET TRANSACTION READ ONLY")
+        cursor.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters)
+        return cursor.fetchone()[0]
+    finally:
+        conn.rollback()
+        conn.close()
+
+def _explain_loop(engine, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            fp, statement, parameters, seconds = query_profiler.explain_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        try:
+            plan = explain_analyze(engine, statement, parameters)
+        except Exception:
+            logger.warning("EXPLAIN ANALYZE failed for: %s", fp, exc_info=True)
+            continue
+        query_profiler.add_plan(fp, {
+            "captured_at": datetime.now(timezone.utc).isoformat(),
+            "observed_ms": round(seconds * 1000, 3),
+            "parameters": parameters,
+            "plan": plan,
+        })
+
+def start_explain_worker(engine) -> threading.Event:
+    """
+    啟動背景 EXPLAIN thread，回傳用來停止它的 Event
+    """
+    stop = threading.Event()
+    threading.Thread(target=_explain_loop, args=(engine, stop), name="query-explain", daemon=True).start()
+    return stop
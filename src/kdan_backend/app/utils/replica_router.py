@@ -0,0 +1,198 @@
+import itertools
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from app.config import READ_YOUR_WRITES_SECONDS, REPLICA_LAG_POLL, REPLICA_MAX_LAG
+
+logger = logging.getLogger(__name__)
+
+# 寫入後回給 client 的 cookie / header，值為應讀 primary 到何時 (epoch 秒)
+PIN_COOKIE = "db_pin"
+PIN_HEADER = "X-DB-Pin-Until"
+# 超過幾個量測間隔沒有更新延遲時，視為無法使用
+STALE_CHECKS = 3
+
+# replica 已重播到 primary 目前的 WAL 位置時視為沒有延遲；
+# 否則以最後重播的交易時間估計 (primary 閒置時 now() - replay 時間會一直變大，不能單獨使用)
+_PRIMARY_LSN = text("SELECT pg_current_wal_lsn()::text")
+_REPLICA_LAG = text("""
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn) THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+END
+""")
+
+class ReplicaState:
+    """
+    單一 replica 的延遲；lag 為 None 表示尚未量測或無法連線，不會被選用
+    """
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.lag: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def usable(self) -> bool:
+        # 量測結果太舊 (例如背景 thread 卡住) 時也不使用
+        return (self.lag is not None and self.lag <= REPLICA_MAX_LAG
+                and time.monotonic() - self.checked_at <= REPLICA_LAG_POLL * STALE_CHECKS)
+
+    def snapshot(self) -> Dict:
+        return {
+            "name": self.name,
+            "lag_seconds": self.lag,
+            "healthy": self.usable(),
+            "checked_seconds_ago": round(time.monotonic() - self.checked_at, 3) if self.checked_at else None,
+            "error": self.error,
+        }
+
+class RequestRouting:
+    """
+    單一請求的路由狀態：pinned 為 client 帶來的 read-your-writes 期限未過；wrote 為本請求在 primary commit 過
+    """
+    __slots__ = ("pinned", "wrote")
+
+    def __init__(self, pinned: bool):
+        self.pinned = pinned
+        self.wrote = False
+
+_routing: ContextVar[Optional[RequestRouting]] = ContextVar("request_routing", default=None)
+
+class ReplicaRouter:
+    def __init__(self):
+        self.replicas: List[ReplicaState] = []
+        self.fallbacks = 0
+        self._next = itertools.count()
+
+    def register(self, name: str, engine) -> None:
+        self.replicas.append(ReplicaState(name, engine))
+
+    def choose(self) -> Optional[int]:
+        """
+        讀取路由要用的 replica 位置，None 表示改用 primary：
+        請求在 read-your-writes 期限內、或所有 replica 延遲都超過 REPLICA_MAX_LAG (或無法連線)
+        """
+        if not self.replicas:
+            return None
+        routing = _routing.get()
+        if routing is not None and routing.pinned:
+            return None
+        healthy = [i for i, replica in enumerate(self.replicas) if replica.usable()]
+        if not healthy:
+            self.fallbacks += 1
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+    def snapshot(self) -> Dict:
+        return {
+            "max_lag_seconds": REPLICA_MAX_LAG,
+            "read_your_writes_seconds": READ_YOUR_WRITES_SECONDS,
+            "primary_fallbacks": self.fallbacks,
+            "replicas": [replica.snapshot() for replica in self.replicas],
+        }
+
+replica_router = ReplicaRouter()
+
+def _on_commit(session: Session) -> None:
+    # replica 的 session 不會寫入；背景 thread 沒有請求 context
+    routing = _routing.get()
+    if routing is not None and not session.info.get("replica"):
+        routing.wrote = True
+
+# AsyncSession 內部也是 Session，同樣會觸發
+event.listen(Session, "after_commit", _on_commit)
+
+def _pinned_until(scope) -> float:
+    values = []
+    for name, value in scope.get("headers", []):
+        if name == b"cookie":
+            for part in value.decode("latin-1").split(";"):
+                key, _, cookie = part.strip().partition("=")
+                if key == PIN_COOKIE:
+                    values.append(cookie)
+        elif name == PIN_HEADER.lower().encode():
+            values.append(value.decode("latin-1"))
+    pinned = 0.0
+    for value in values:
+        try:
+            pinned = max(pinned, float(value))
+        except ValueError:
+            continue
+    return pinned
+
+class ReadYourWritesMiddleware:
+    """
+    請求在 primary commit 後，response 帶上 db_pin cookie 與 X-DB-Pin-Until header (READ_YOUR_WRITES_SECONDS 秒後)；
+    之後帶著其中之一的請求在期限內讀取路由也走 primary，看得到自己剛寫入的資料
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        routing = RequestRouting(_pinned_until(scope) > time.time())
+        token = _routing.set(routing)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and routing.wrote:
+                until = f"{time.time() + READ_YOUR_WRITES_SECONDS:.3f}"
+                cookie = (f"{PIN_COOKIE}={until}; Max-Age={int(READ_YOUR_WRITES_SECONDS) + 1}; "
+                          "Path=/; HttpOnly; SameSite=Lax")
+                message = {**message, "headers": [
+                    *message.get("headers", []),
+                    (b"set-cookie", cookie.encode("latin-1")),
+                    (PIN_HEADER.lower().encode(), until.encode("latin-1")),
+                ]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _routing.reset(token)
+
+def measure_lag(primary_engine, replica: ReplicaState) -> None:
+    with primary_engine.connect() as conn:
+        lsn = conn.execute(_PRIMARY_LSN).scalar()
+    try:
+        with replica.engine.connect() as conn:
+            lag = float(conn.execute(_REPLICA_LAG, {"lsn": lsn}).scalar())
+    except Exception as e:
+        if replica.error is None:
+            logger.warning("Replica %s is unreachable, reads fall back to the primary", replica.name, exc_info=True)
+        replica.lag = None
+        replica.error = f"{type(e).__name__}: {e}"
+    else:
+        if lag > REPLICA_MAX_LAG and (replica.lag is None or replica.lag <= REPLICA_MAX_LAG):
+            logger.warning("Replica %s lags %.2fs behind (max %.2fs), reads fall back", replica.name, lag,
+                           REPLICA_MAX_LAG)
+        replica.lag = lag
+        replica.error = None
+    replica.checked_at = time.monotonic()
+
+def _monitor_loop(primary_engine, stop: threading.Event) -> None:
+    while True:
+        for replica in replica_router.replicas:
+            try:
+                measure_lag(primary_engine, replica)
+            except Exception:
+                # primary 無法連線時無從比較，維持上一次的結果
+                logger.warning("Replica lag check failed", exc_info=True)
+        if stop.wait(REPLICA_LAG_POLL):
+            return
+
+def start_replica_monitor(primary_engine) -> threading.Event:
+    """
+    啟動背景 thread 定期量測各 replica 的延遲，回傳用來停止它的 Event
+    """
+    stop = threading.Event()
+    threading.Thread(target=_monitor_loop, args=(primary_engine, stop), name="replica-monitor", daemon=True).start()
+    return stop
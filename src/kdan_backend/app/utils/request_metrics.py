@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from app.config import QUERY_COUNT_WARN
+from app.utils.metrics_helper import Histogram
+from app.utils.pool_metrics import pool_snapshots
+from app.utils.replica_router import replica_router
+
+logger = logging.getLogger(__name__)
+
+# response 大小 (bytes) 與每個請求的查詢數的 bucket
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+# 沒有對應到任何路由的請求 (404) 共用一個 label，避免任意路徑產生大量時間序列
+UNMATCHED_ROUTE = "unmatched"
+
+class RequestQueries:
+    """
+    單一請求執行的 SQL 數與耗時；由 middleware 放進 contextvar，
+    threadpool 與 AsyncSession 的 greenlet 都會複製 context，拿到的是同一個物件
+    """
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("request_queries", default=None)
+
+class RouteMetrics:
+    """
+    單一 (method, 路由樣板) 的統計
+    """
+    def __init__(self):
+        self.duration = Histogram()
+        self.response_size = Histogram(SIZE_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.query_duration = Histogram()
+        self.statuses: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, status: int, seconds: float, size: int, queries: RequestQueries) -> None:
+        self.duration.observe(seconds)
+        self.response_size.observe(size)
+        self.queries.observe(queries.count)
+        self.query_duration.observe(queries.seconds)
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+_routes: Dict[Tuple[str, str], RouteMetrics] = {}
+_routes_lock = threading.Lock()
+
+def route_metrics(method: str, route: str) -> RouteMetrics:
+    key = (method, route)
+    metrics = _routes.get(key)
+    if metrics is None:
+        with _routes_lock:
+            metrics = _routes.setdefault(key, RouteMetrics())
+    return metrics
+
+def track_request_queries(engine) -> None:
+    """
+    掛上 cursor 事件，把 statement 數與耗時記到目前請求上 (async engine 請傳入 sync_engine)；
+    背景 thread (預熱、rollup、LISTEN) 沒有請求 context，不會被計入
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info["request_query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("request_query_started", None)
+        queries = _current.get()
+        if queries is not None and started is not None:
+            queries.count += 1
+            queries.seconds += time.perf_counter() - started
+
+class RequestMetricsMiddleware:
+    """
+    記錄每個路由的延遲、response 大小 (實際送出的 bytes，gzip 後)、SQL 數與 SQL 耗時；
+    查詢數超過 QUERY_COUNT_WARN 時記錄警告 (找出 N+1)
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        queries = RequestQueries()
+        token = _current.set(queries)
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - started
+            # 路由比對後 FastAPI 會把 APIRoute 放進 scope，用路徑樣板 (/users/{user_id}/purchases) 當 label
+            route = scope.get("route")
+            path = getattr(route, "path", UNMATCHED_ROUTE)
+            route_metrics(scope["method"], path).observe(status, elapsed, size, queries)
+            if 0 < QUERY_COUNT_WARN < queries.count:
+                logger.warning("%s %s issued %d queries (%.1fms in DB, %.1fms total), threshold %d",
+                               scope["method"], path, queries.count, queries.seconds * 1000, elapsed * 1000,
+                               QUERY_COUNT_WARN)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _histogram_lines(name: str, snapshot: Dict, **labels) -> List[str]:
+    lines = [f"{name}_bucket{_labels(**labels, le=le)} {count}" for le, count in snapshot["buckets"].items()]
+    lines.append(f"{name}_sum{_labels(**labels)} {snapshot['sum']}")
+    lines.append(f"{name}_count{_labels(**labels)} {snapshot['count']}")
+    return lines
+
+def _family(name: str, kind: str, help_text: str, lines: List[str]) -> List[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *lines]
+
+def render_prometheus() -> str:
+    """
+    以 Prometheus text format (0.0.4) 輸出本 worker 的路由與連線池統計
+    """
+    with _routes_lock:
+        routes = sorted(_routes.items())
+
+    requests, duration, size, queries, query_duration = [], [], [], [], []
+    for (method, route), metrics in routes:
+        with metrics._lock:
+            statuses = sorted(metrics.statuses.items())
+        for status, count in statuses:
+            requests.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+        duration += _histogram_lines("http_request_duration_seconds", metrics.duration.snapshot(),
+                                     method=method, route=route)
+        size += _histogram_lines("http_response_size_bytes", metrics.response_size.snapshot(),
+                                 method=method, route=route)
+        queries += _histogram_lines("http_request_db_queries", metrics.queries.snapshot(),
+                                    method=method, route=route)
+        query_duration += _histogram_lines("http_request_db_duration_seconds", metrics.query_duration.snapshot(),
+                                           method=method, route=route)
+
+    checked_out, overflow, timeouts, statements = [], [], [], []
+    for name, pool in pool_snapshots().items():
+        checked_out.append(f"db_pool_checked_out{_labels(pool=name)} {pool['checked_out']}")
+        overflow.append(f"db_pool_overflow{_labels(pool=name)} {pool['overflow']}")
+        timeouts.append(f"db_pool_timeouts_total{_labels(pool=name)} {pool['timeouts']}")
+        statements.append(f"db_statements_total{_labels(pool=name)} {pool['statements']}")
+
+    replica_lag = [f"db_replica_lag_seconds{_labels(replica=replica.name)} {replica.lag}"
+                   for replica in replica_router.replicas if replica.lag is not None]
+
+    lines = [
+        *_family("http_requests_total", "counter", "Requests by route and status code.", requests),
+        *_family("http_request_duration_seconds", "histogram", "Request latency by route.", duration),
+        *_family("http_response_size_bytes", "histogram", "Response body bytes sent by route.", size),
+        *_family("http_request_db_queries", "histogram", "SQL statements executed per request.", queries),
+        *_family("http_request_db_duration_seconds", "histogram", "Time spent in SQL per request.", query_duration),
+        *_family("db_pool_checked_out", "gauge", "Connections currently checked out.", checked_out),
+        *_family("db_pool_overflow", "gauge", "Overflow connections currently open.", overflow),
+        *_family("db_pool_timeouts_total", "counter", "Pool checkout timeouts.", timeouts),
+        *_family("db_statements_total", "counter", "SQL statements executed, including background work.", statements),
+        *_family("db_replica_lag_seconds", "gauge", "Measured replication lag of each read replica.", replica_lag),
+    ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,121 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import and_, func, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app.config import DAILY_SPEND_SHARDS
+from app.models import DailySpend, PurchaseHistory, User, UserDailySpend
+
+def add_to_spend_rollups(db: Session, user_id: int, items: Iterable) -> None:
+    """
+    在購買的 transaction 內累加 user_daily_spend / daily_spend
+    items 需有 quantity、transaction_amount、transaction_date
+    """
+    add_batch_to_spend_rollups(db, ((user_id, item) for item in items))
+
+def add_batch_to_spend_rollups(db: Session, purchases: Iterable[Tuple[int, object]]) -> None:
+    """
+    與 add_to_spend_rollups 相同，purchases 為多個 user 的 (user_id, item)
+    先依 (user, 日) 與 (日, shard) 彙總，每張表只需一個 upsert；
+    依 key 排序寫入，並行交易以相同順序取得 row lock
+    """
+    per_user_day: Dict[Tuple[int, date], List[float]] = defaultdict(lambda: [0, 0.0])
+    per_day_shard: Dict[Tuple[date, int], List[float]] = defaultdict(lambda: [0, 0.0])
+    for user_id, item in purchases:
+        day = item.transaction_date.date()
+        for totals in (per_user_day[(user_id, day)], per_day_shard[(day, user_id % DAILY_SPEND_SHARDS)]):
+            totals[0] += item.quantity
+            totals[1] += item.transaction_amount
+    if not per_user_day:
+        return
+
+    for model, keys, totals in (
+        (UserDailySpend, ["user_id", "day"], per_user_day),
+        (DailySpend, ["day", "shard"], per_day_shard),
+    ):
+        stmt = pg_insert(model).values([
+            dict(zip(keys, key), total_quantity=totals[key][0], total_amount=totals[key][1])
+            for key in sorted(totals)
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={
+                "total_quantity": model.total_quantity + stmt.excluded.total_quantity,
+                "total_amount": model.total_amount + stmt.excluded.total_amount,
+            },
+        ))
+
+# 結束時間在此之後 (含) 視為涵蓋到當天結束
+_LAST_SECOND = time(23, 59, 59)
+
+def inclusive_end(end: datetime) -> datetime:
+    """
+    client 以 "...T23:59:59" 表示到當天結束：結束時間在 23:59:59 之後 (含) 時延伸到當天最後一個 microsecond，
+    23:59:59.5 之類的交易不會漏掉，當天也能整天由每日彙總回答
+    """
+    if end.time() >= _LAST_SECOND:
+        return datetime.combine(end.date(), time.max, tzinfo=end.tzinfo)
+    return end
+
+def split_range(start: datetime, end: datetime) -> Tuple[Optional[Tuple[date, date]], list]:
+    """
+    將 [start, end] 拆成「完整的日子」與頭尾不滿一天的部分 (end 先經過 inclusive_end)
+    回傳 ((第一個完整日, 最後一個完整日) 或 None, 需掃原始資料的條件 list)
+    """
+    ts = PurchaseHistory.transaction_date
+    end = inclusive_end(end)
+    if end < start:
+        return None, [and_(ts >= start, ts <= end)]
+
+    first_full = start.date() if start.time() == time.min else start.date() + timedelta(days=1)
+    # end 為當天最後一個 microsecond 時，當天也算完整
+    last_full = (end + timedelta(microseconds=1)).date() - timedelta(days=1)
+    if first_full > last_full:
+        return None, [and_(ts >= start, ts <= end)]
+
+    raw_conditions = []
+    head_end = datetime.combine(first_full, time.min)
+    if start < head_end:
+        raw_conditions.append(and_(ts >= start, ts < head_end))
+    tail_start = datetime.combine(last_full + timedelta(days=1), time.min)
+    if tail_start <= end:
+        raw_conditions.append(and_(ts >= tail_start, ts <= end))
+    return (first_full, last_full), raw_conditions
+
+def top_spenders_query(start: datetime, end: datetime, top_x: int):
+    """
+    完整日子讀 user_daily_spend，頭尾不滿一天才掃 purchase_histories，並在同一個查詢 join 使用者名稱
+    """
+    full_days, raw_conditions = split_range(start, end)
+    parts = []
+    if full_days:
+        parts.append(select(UserDailySpend.user_id, UserDailySpend.total_amount.label("amount"))
+                     .where(UserDailySpend.day.between(*full_days)))
+    for condition in raw_conditions:
+        parts.append(select(PurchaseHistory.user_id, PurchaseHistory.transaction_amount.label("amount"))
+                     .where(condition))
+    spend = union_all(*parts).subquery()
+
+    total_spent = func.sum(spend.c.amount)
+    return (select(spend.c.user_id, User.name.label("user_name"), total_spent.label("total_spent"))
+            .join(User, User.id == spend.c.user_id)
+            .group_by(spend.c.user_id, User.name)
+            .order_by(total_spent.desc(), spend.c.user_id)
+            .limit(top_x))
+
+def transaction_summary_query(start: datetime, end: datetime):
+    """
+    完整日子讀 daily_spend (加總所有 shard)，頭尾不滿一天才掃 purchase_histories
+    """
+    full_days, raw_conditions = split_range(start, end)
+    parts = []
+    if full_days:
+        parts.append(select(DailySpend.total_quantity.label("quantity"), DailySpend.total_amount.label("amount"))
+                     .where(DailySpend.day.between(*full_days)))
+    for condition in raw_conditions:
+        parts.append(select(PurchaseHistory.quantity.label("quantity"),
+                            PurchaseHistory.transaction_amount.label("amount"))
+                     .where(condition))
+    spend = union_all(*parts).subquery()
+    return select(func.sum(spend.c.quantity), func.sum(spend.c.amount))
@@ -0,0 +1,124 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import time
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+from sqlalchemy.orm import Session
+from app.models import PharmacyOpeningHours
+from app.utils.catalog_index import CatalogIndex
+from app.utils.time_helper import MINUTES_PER_DAY, MINUTES_PER_WEEK, minute_of_week
+
+Interval = Tuple[int, int]
+
+def _to_week_intervals(day_of_week: str, open_time: time, close_time: time) -> List[Interval]:
+    """
+    將單一營業時段轉成 minute-of-week 的半開區間 [start, end)
+    - 營業時間含頭尾 (與 is_open_now 一致)，因此 end 為 close 的下一分鐘
+    - close_time < open_time 視為跨午夜，延伸到隔天
+    - 超出週日 24:00 的部分繞回週一開頭
+    """
+    start = minute_of_week(day_of_week, open_time)
+    length = (close_time.hour * 60 + close_time.minute) - (open_time.hour * 60 + open_time.minute)
+    if length < 0:
+        length += MINUTES_PER_DAY
+    end = start + length + 1
+    if end <= MINUTES_PER_WEEK:
+        return [(start, end)]
+    return [(start, MINUTES_PER_WEEK), (0, end - MINUTES_PER_WEEK)]
+
+def _merge(intervals: List[Interval]) -> List[Interval]:
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+class WeeklyScheduleIndex:
+    """
+    以 minute-of-week (Mon 00:00 = 0 ~ Sun 23:59 = 10079) 為 key 的營業時段索引
+    - 每間藥局的時段合併成排序好的區間，用來判斷是否「整段時間」都有營業
+    - 所有區間端點把一週切成若干基本區段，每段預先算好當下營業中的藥局集合
+    """
+    def __init__(self, rows: Iterable[Tuple[int, str, time, time]]):
+        per_pharmacy: Dict[int, List[Interval]] = defaultdict(list)
+        for pharmacy_id, day_of_week, open_time, close_time in rows:
+            per_pharmacy[pharmacy_id].extend(_to_week_intervals(day_of_week, open_time, close_time))
+
+        self._intervals: Dict[int, List[Interval]] = {
+            pid: _merge(intervals) for pid, intervals in per_pharmacy.items()
+        }
+        self._interval_starts: Dict[int, List[int]] = {
+            pid: [start for start, _ in intervals] for pid, intervals in self._intervals.items()
+        }
+
+        # 掃描線：在每個端點加入/移除藥局，得到每個基本區段的營業集合
+        events: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+        for pid, intervals in self._intervals.items():
+            for start, end in intervals:
+                events[start].append((pid, 1))
+                events[end].append((pid, -1))
+        self._bounds: List[int] = [0]
+        self._segments: List[FrozenSet[int]] = [frozenset()]
+        current: Set[int] = set()
+        for minute in sorted(events):
+            for pid, delta in events[minute]:
+                if delta > 0:
+                    current.add(pid)
+                else:
+                    current.discard(pid)
+            if minute >= MINUTES_PER_WEEK:
+                continue
+            if self._bounds[-1] == minute:
+                self._segments[-1] = frozenset(current)
+            else:
+                self._bounds.append(minute)
+                self._segments.append(frozenset(current))
+
+    def open_at(self, minute: int) -> FrozenSet[int]:
+        """
+        回傳在該分鐘有營業的藥局 id
+        """
+        minute %= MINUTES_PER_WEEK
+        return self._segments[bisect_right(self._bounds, minute) - 1]
+
+    def _covered_until(self, pharmacy_id: int, minute: int) -> int:
+        """
+        從 minute 開始連續營業到哪一分鐘 (不含)，可能超過一週的長度以處理週日跨到週一
+        """
+        starts = self._interval_starts[pharmacy_id]
+        intervals = self._intervals[pharmacy_id]
+        _, end = intervals[bisect_right(starts, minute) - 1]
+        if end == MINUTES_PER_WEEK and starts[0] == 0:
+            # 週日營業到午夜且週一 00:00 也有營業，兩段視為連續
+            end += intervals[0][1]
+        return end
+
+    def open_during(self, start_minute: int, end_minute: int) -> Set[int]:
+        """
+        回傳 start_minute ~ end_minute (含頭尾) 整段時間都有營業的藥局 id
+        end_minute 早於 start_minute 時視為跨週 (Sun 深夜 ~ Mon 凌晨)
+        """
+        start_minute %= MINUTES_PER_WEEK
+        span = (end_minute - start_minute) % MINUTES_PER_WEEK
+        required_end = start_minute + span + 1
+        return {
+            pid for pid in self.open_at(start_minute)
+            if self._covered_until(pid, start_minute) >= required_end
+        }
+
+def build_schedule_index(db: Session) -> WeeklyScheduleIndex:
+    rows = db.query(
+        PharmacyOpeningHours.pharmacy_id,
+        PharmacyOpeningHours.day_of_week,
+        PharmacyOpeningHours.open_time,
+        PharmacyOpeningHours.close_time,
+    ).all()
+    return WeeklyScheduleIndex(
+        (pharmacy_id, day_of_week.value, open_time, close_time)
+        for pharmacy_id, day_of_week, open_time, close_time in rows
+    )
+
+schedule_index: CatalogIndex[WeeklyScheduleIndex] = CatalogIndex(
+    "schedule", depends_on=("pharmacy_opening_hours",), builder=build_schedule_index
+)
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from typing import Any, Callable, Optional, Tuple
+from sqlalchemy.util import await_only
+
+# 等待其他呼叫者時，每隔幾秒確認一次 (避免持有者的 thread 意外結束時永遠等待)
+WAIT_CHECK_SECONDS = 1.0
+
+class SingleFlight:
+    """
+    同一時間只讓一個呼叫者執行 (例如重建 in-process 索引)，其他呼叫者等它完成或直接略過
+    - 執行期間不持有任何 lock，持有者在 DB I/O 時可被暫停
+    - DB_ASYNC=true 時路由在 event loop thread 上以 AsyncSession.run_sync 執行，持有者與等待者可能在同一個 thread；
+      等待改由 executor 的 thread 等 Event，以 await_only 交還 event loop，不卡住持有者
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running: Optional[threading.Event] = None
+
+    @property
+    def busy(self) -> bool:
+        return self._running is not None
+
+    def run(self, func: Callable[[], Any], wait: bool = True) -> Tuple[bool, Any]:
+        """
+        沒有其他呼叫者在執行時執行 func()，回傳 (True, 結果)；
+        否則 wait=True 時等它結束、wait=False 時立即回傳 (False, None)，由呼叫者決定是否重試
+        """
+        with self._lock:
+            running = self._running
+            if running is None:
+                self._running = done = threading.Event()
+        if running is not None:
+            if wait:
+                _wait(running)
+            return False, None
+        try:
+            return True, func()
+        finally:
+            with self._lock:
+                self._running = None
+            done.set()
+
+def _wait(event: threading.Event) -> None:
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    while not event.is_set():
+        if loop is None:
+            event.wait(WAIT_CHECK_SECONDS)
+        else:
+            # 在 event loop thread 上 (run_sync 的 greenlet 內)：不能直接阻擋這個 thread
+            await_only(loop.run_in_executor(None, event.wait, WAIT_CHECK_SECONDS))
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from sqlalchemy import select
+import migrations
+from app.config import (
+    ANALYTICS_BACKEND,
+    CATALOG_CACHE_SIZE,
+    CATALOG_PRELOAD,
+    DB_POOL_SIZE,
+    FILTER_BACKEND,
+    SCHEMA_CHECK,
+    SEARCH_BACKEND,
+    STARTUP_BUDGET,
+    WARM_POOL
+)
+from app.database import SessionLocal, async_engine, engine
+from app.models import Pharmacy
+
+logger = logging.getLogger(__name__)
+
+# 連線失敗時的重試間隔 (秒)，每次加倍到上限為止
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 10
+
+class StartupState:
+    """
+    記錄啟動各階段的耗時；全部完成後 ready 才為 True (/readyz)
+    """
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.ready = False
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[phase] = round(seconds, 4)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            phases = dict(self.phases)
+        total = phases.get("total", self.elapsed())
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "phases_seconds": phases,
+            "budget_seconds": STARTUP_BUDGET,
+            "within_budget": total <= STARTUP_BUDGET,
+        }
+
+# app/main.py import 時建立，import 本身的耗時也算在啟動時間內
+startup_state = StartupState()
+
+def check_schema() -> None:
+    """
+    只記錄警告，不阻擋啟動 (schema 由 migrate.py / etl.py 建立)
+    """
+    conn = engine.raw_connection()
+    try:
+        pending = migrations.pending_migrations(conn)
+    finally:
+        conn.close()
+    if pending:
+        names = ", ".join(f"{m.version:04d}_{m.name}" for m in pending)
+        logger.warning("Pending schema migrations: %s (run `python migrate.py`)", names)
+
+def warm_pool() -> None:
+    """
+    同時取出 pool_size 條連線再歸還，之後的請求不需等待建立連線
+    """
+    connections = []
+    try:
+        for _ in range(max(DB_POOL_SIZE, 1)):
+            conn = engine.connect()
+            connections.append(conn)
+            conn.exec_driver_sql("SELECT 1")
+    finally:
+        for conn in connections:
+            conn.close()
+
+async def warm_async_pool() -> None:
+    connections = []
+    try:
+        for _ in range(max(DB_POOL_SIZE, 1)):
+            conn = await async_engine.connect()
+            connections.append(conn)
+            await conn.exec_driver_sql("SELECT 1")
+    finally:
+        for conn in connections:
+            await conn.close()
+
+def preload_catalog() -> None:
+    """
+    預先建立 in-process 索引，並把藥局 (最多 CATALOG_CACHE_SIZE 間) 載入 catalog 快取；
+    ANALYTICS_BACKEND=columnar 時一併載入消費紀錄的欄式快照
+    """
+    from app.utils.ngram_index import search_index
+    from app.utils.pharmacy_cache import pharmacy_cache
+    from app.utils.price_index import price_index
+    from app.utils.schedule_index import schedule_index
+    from app.utils.suggest_index import suggest_index
+
+    with SessionLocal() as db:
+        schedule_index.get(db)
+        if SEARCH_BACKEND != "pg_trgm":
+            search_index.get(db)
+        suggest_index.get(db)
+        if FILTER_BACKEND != "sql":
+            price_index.get(db)
+        if CATALOG_CACHE_SIZE > 0:
+            pharmacy_ids = db.execute(select(Pharmacy.id).order_by(Pharmacy.id).limit(CATALOG_CACHE_SIZE)).scalars()
+            pharmacy_cache.get_many(db, pharmacy_ids)
+        if ANALYTICS_BACKEND == "columnar":
+            from app.utils.purchase_analytics import purchase_snapshot
+            purchase_snapshot.get(db)
+
+def _timed(phase: str, func) -> None:
+    started = time.perf_counter()
+    func()
+    startup_state.record(phase, time.perf_counter() - started)
+
+def _warm_up(stop: threading.Event, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    phases = []
+    if WARM_POOL:
+        phases.append(("pool_warmup", warm_pool))
+        if async_engine is not None and loop is not None:
+            phases.append(("async_pool_warmup",
+                           lambda: asyncio.run_coroutine_threadsafe(warm_async_pool(), loop).result()))
+    if SCHEMA_CHECK:
+        phases.append(("schema_check", check_schema))
+    if CATALOG_PRELOAD:
+        phases.append(("catalog_preload", preload_catalog))
+
+    delay = RETRY_DELAY
+    done = set()
+    while not stop.is_set():
+        try:
+            for phase, func in phases:
+                if phase not in done:
+                    _timed(phase, func)
+                    done.add(phase)
+            break
+        except Exception as e:
+            # 例如滾動重啟時 Postgres 暫時無法連線：process 保持存活 (/healthz)，稍後重試
+            startup_state.error = f"{type(e).__name__}: {e}"
+            logger.warning("Startup warm-up failed, retrying in %ss", delay, exc_info=True)
+            if stop.wait(delay):
+                return
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    total = startup_state.elapsed()
+    startup_state.record("total", total)
+    startup_state.error = None
+    startup_state.ready = True
+    if total > STARTUP_BUDGET:
+        logger.warning("Startup took %.2fs (budget %.2fs): %s", total, STARTUP_BUDGET, startup_state.phases)
+    else:
+        logger.info("Ready in %.2fs: %s", total, startup_state.phases)
+
+def start_warm_up(loop: Optional[asyncio.AbstractEventLoop] = None) -> threading.Event:
+    """
+    在背景 thread 執行啟動的預熱，不阻擋 lifespan (DB 暫時無法連線時也能啟動)，回傳用來停止它的 Event
+    loop 為 lifespan 的 event loop，用來預熱 async engine 的連線池
+    """
+    startup_state.record("import", startup_state.elapsed())
+    stop = threading.Event()
+    threading.Thread(target=_warm_up, args=(stop, loop), name="startup-warmup", daemon=True).start()
+    return stop
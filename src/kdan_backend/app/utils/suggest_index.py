@@ -0,0 +1,283 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.config import CATALOG_INDEX_TTL, SUGGEST_REFRESH_DELAY
+from app.database import SessionLocal, run_on_primary
+from app.models import Mask, Pharmacy
+from app.utils.catalog_index import DependsOnTables, TouchedTables
+from app.utils.ngram_index import KIND_ORDER
+from app.utils.pharmacy_cache import load_pharmacies
+from app.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 每個前綴最多回傳 (也預先計算) 幾個建議
+TOP_K = 20
+# 符合的 key 不超過此數量的前綴在查詢時直接掃描，超過的才預先計算 top-k
+SCAN_LIMIT = 256
+
+_WORD = re.compile(r"\w+")
+# 比 BMP 外所有字元都大，作為前綴範圍的上界
+_MAX_CHAR = "\U0010ffff"
+
+def normalize(text: str) -> str:
+    """
+    小寫並把標點、括號與連續空白收成一個空白："MaskT (green) (10 per pack)" -> "maskt green 10 per pack"
+    """
+    return " ".join(_WORD.findall(text.lower()))
+
+class Suggestion(NamedTuple):
+    """
+    同類型、同名稱的項目合併為一筆：count 為藥局數 / 販售該口罩的藥局數，id 為其中最小的 id
+    """
+    kind: str
+    name: str
+    count: int
+    id: int
+
+class SuggestIndex:
+    """
+    名稱與名稱中每個字開頭的後綴，排序後存成陣列 (等同把 trie 攤平)：
+    - 前綴查詢以兩次二分搜尋取得範圍
+    - 範圍大於 SCAN_LIMIT 的前綴 (trie 上層的節點) 預先算好 top-k，其餘在查詢時掃描
+    - 排序：名稱開頭符合 > 中間的字開頭符合，再依藥局數多到少、藥局在口罩前、名稱短到長
+    記憶體與 (不同的名稱數 x 每個名稱的字數) 成正比，預先計算的節點最多約 key 數 / SCAN_LIMIT x 名稱長度個，每個 TOP_K 筆
+    """
+    def __init__(self, suggestions: Iterable[Suggestion]):
+        # 依藥局數多到少、藥局在口罩前、名稱短到長排好，位置即為排序
+        self.suggestions: List[Suggestion] = sorted(
+            suggestions, key=lambda s: (-s.count, KIND_ORDER[s.kind], len(s.name), s.name))
+        total = len(self.suggestions)
+        entries = []
+        for idx, suggestion in enumerate(self.suggestions):
+            normalized = normalize(suggestion.name)
+            for match in _WORD.finditer(normalized):
+                # rank 越小越前面：名稱開頭符合的排在所有中間的字符合的前面
+                entries.append((normalized[match.start():], idx + total if match.start() else idx))
+        entries.sort()
+        self._total = total
+        self._keys: List[str] = [key for key, _ in entries]
+        self._ranks: List[int] = [rank for _, rank in entries]
+        self._top: Dict[str, Tuple[int, ...]] = {}
+        self._precompute()
+
+    def _distinct(self, ranks: Iterable[int], limit: int) -> List[int]:
+        """
+        由小到大取前 limit 個不同建議的 rank (同一個建議可能有多個 key 符合)
+        """
+        found: List[int] = []
+        seen: Set[int] = set()
+        for rank in sorted(ranks):
+            idx = rank % self._total
+            if idx not in seen:
+                seen.add(idx)
+                found.append(rank)
+                if len(found) >= limit:
+                    break
+        return found
+
+    def _scan(self, lo: int, hi: int, limit: int) -> List[int]:
+        return self._distinct(self._ranks[lo:hi], limit)
+
+    def _precompute(self, lo: int = 0, hi: Optional[int] = None, depth: int = 0) -> List[int]:
+        """
+        keys[lo:hi] 共用長度為 depth 的前綴 (trie 的一個節點)，回傳該節點的 top-k；
+        由子節點的 top-k 合併而來，每個 key 只在葉節點排序一次
+        """
+        keys = self._keys
+        hi = len(keys) if hi is None else hi
+        if hi - lo <= SCAN_LIMIT:
+            return self._scan(lo, hi, TOP_K)
+        # 等於前綴本身的 key 排在最前面，不屬於任何子節點
+        i = lo
+        while i < hi and len(keys[i]) <= depth:
+            i += 1
+        ranks = self._ranks[lo:i]
+        while i < hi:
+            j = bisect.bisect_left(keys, keys[i][:depth + 1] + _MAX_CHAR, i, hi)
+            ranks.extend(self._precompute(i, j, depth + 1))
+            i = j
+        top = self._distinct(ranks, TOP_K)
+        self._top[keys[lo][:depth]] = tuple(rank % self._total for rank in top)
+        return top
+
+    def suggest(self, q: str, limit: int) -> List[Suggestion]:
+        q = normalize(q)
+        top = self._top.get(q)
+        if top is None:
+            lo = bisect.bisect_left(self._keys, q)
+            hi = bisect.bisect_left(self._keys, q + _MAX_CHAR, lo)
+            # 沒有預先計算的前綴，範圍一定不超過 SCAN_LIMIT
+            top = [rank % self._total for rank in self._scan(lo, hi, limit)]
+        return [self.suggestions[idx] for idx in top[:limit]]
+
+    def stats(self) -> Dict[str, int]:
+        return {"suggestions": len(self.suggestions), "keys": len(self._keys), "precomputed": len(self._top)}
+
+class SuggestCatalog(DependsOnTables):
+    """
+    /search/suggest 的索引，每個 worker 各一份
+    - 記錄每間藥局貢獻的名稱 (藥局名稱、其口罩名稱)，寫入時只重新載入被寫到的藥局 (pharmacy_cache.load_pharmacies)，
+      無法得知寫到哪些藥局時、或超過 CATALOG_INDEX_TTL 才全部重新載入
+    - 已有索引時由背景 thread 重建後換上，請求一律使用目前的索引、不等待 (寫入後約 delay 秒才查得到)；
+      寫入後等待 delay 秒才開始重建，連續的寫入合併成一次
+    - 只有第一次建立時請求需要等待
+    """
+    def __init__(self, ttl: float = CATALOG_INDEX_TTL, delay: float = SUGGEST_REFRESH_DELAY):
+        # 口罩價格變動不影響名稱
+        super().__init__(("pharmacies.name", "masks.name", "masks.pharmacy_id"))
+        self.name = "suggest"
+        self._ttl = ttl
+        self._delay = delay
+        self._flight = SingleFlight()
+        self._index: Optional[SuggestIndex] = None
+        self._loaded_at = 0.0
+        self._full_reload = True
+        self._pending: Set[int] = set()
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        # 藥局 id -> 該藥局貢獻的 (類型, 名稱, id)
+        self._contributions: Dict[int, List[Tuple[str, str, int]]] = {}
+        # (類型, 名稱) -> 這個名稱的所有 id
+        self._ids: Dict[Tuple[str, str], Set[int]] = defaultdict(set)
+
+    def _is_fresh(self) -> bool:
+        if self._index is None or self._full_reload or self._pending:
+            return False
+        return self._ttl <= 0 or time.monotonic() - self._loaded_at < self._ttl
+
+    def get(self, db: Session) -> SuggestIndex:
+        while True:
+            index = self._index
+            if index is not None:
+                if not self._is_fresh():
+                    self._schedule_refresh()
+                return index
+            # 第一次建立：其他呼叫者等待同一次建立
+            refreshed, _ = self._flight.run(lambda: run_on_primary(db, self._refresh))
+            if refreshed:
+                return self._index
+
+    def _schedule_refresh(self) -> None:
+        """
+        喚醒背景的重建 thread (第一次呼叫時才啟動)
+        """
+        self._wakeup.set()
+        if self._worker is None:
+            with self._pending_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._refresh_loop, name="suggest-refresh", daemon=True)
+                    self._worker.start()
+
+    def _refresh_loop(self) -> None:
+        while True:
+            self._wakeup.wait()
+            time.sleep(self._delay)
+            # 重建期間的寫入會再次喚醒，重建完成後再處理
+            self._wakeup.clear()
+            if self._is_fresh():
+                continue
+            try:
+                self._flight.run(self._refresh_in_background)
+            except Exception:
+                # 待處理的藥局已還原，下一次請求或寫入時重試
+                logger.warning("Suggest index refresh failed", exc_info=True)
+
+    def _refresh_in_background(self) -> None:
+        with SessionLocal() as db:
+            self._refresh(db)
+
+    def _refresh(self, db: Session) -> None:
+        started = time.perf_counter()
+        # 先取出待處理的藥局與全部重新載入的標記，載入期間的寫入 / invalidate() 留到下一次
+        with self._pending_lock:
+            pending, self._pending = self._pending, set()
+            full_reload, self._full_reload = self._full_reload, False
+        full = full_reload or self._index is None or (
+            self._ttl > 0 and time.monotonic() - self._loaded_at >= self._ttl)
+        try:
+            loaded_at = time.monotonic()
+            contributions = self._load(db, full, pending)
+            # 在新的 dict 上套用，成功建出索引後才一起換上；失敗時舊的索引與記錄都不受影響
+            if full:
+                owners: Dict[int, List[Tuple[str, str, int]]] = {}
+                names: Dict[Tuple[str, str], Set[int]] = defaultdict(set)
+            else:
+                owners = dict(self._contributions)
+                names = defaultdict(set, {key: set(ids) for key, ids in self._ids.items()})
+            _apply(owners, names, contributions)
+            index = SuggestIndex(
+                Suggestion(kind, name, len(ids), min(ids)) for (kind, name), ids in names.items()
+            )
+        except BaseException:
+            # 還原取出的待處理藥局與全部重新載入的標記，下一次請求重試
+            with self._pending_lock:
+                self._pending.update(pending)
+                self._full_reload = self._full_reload or full_reload
+            raise
+        self._contributions, self._ids, self._index = owners, names, index
+        if full:
+            self._loaded_at = loaded_at
+        logger.debug("Suggest index rebuilt (%s) in %.3fs: %s", "full" if full else f"{len(pending)} pharmacies",
+                     time.perf_counter() - started, index.stats())
+
+    def _load(self, db: Session, full: bool, pending: Set[int]) -> Dict[int, List[Tuple[str, str, int]]]:
+        """
+        藥局 id -> 該藥局貢獻的 (類型, 名稱, id)；只載入 pending 時，已不存在的藥局對應到空的 list
+        """
+        if full:
+            contributions: Dict[int, List[Tuple[str, str, int]]] = defaultdict(list)
+            for pid, name in db.execute(select(Pharmacy.id, Pharmacy.name)):
+                contributions[pid].append(("pharmacy", name, pid))
+            for mid, name, pid in db.execute(select(Mask.id, Mask.name, Mask.pharmacy_id)):
+                contributions[pid].append(("mask", name, mid))
+            return contributions
+        loaded = load_pharmacies(db, pending) if pending else {}
+        contributions = {pid: [] for pid in pending}
+        for pid, pharmacy in loaded.items():
+            contributions[pid] = [("pharmacy", pharmacy.name, pid)]
+            contributions[pid].extend(("mask", mask.name, mask.id) for mask in pharmacy.masks)
+        return contributions
+
+    def on_write(self, changes: TouchedTables) -> None:
+        tables = {t.split(".", 1)[0] for t in changes.touched if self.is_affected_by(t)}
+        for table in tables:
+            keys = changes.keys.get(table)
+            if keys is None:
+                self.invalidate()
+                return
+            with self._pending_lock:
+                self._pending.update(keys)
+        if tables and self._index is not None:
+            self._schedule_refresh()
+
+    def invalidate(self) -> None:
+        with self._pending_lock:
+            self._full_reload = True
+        if self._index is not None:
+            self._schedule_refresh()
+
+def _apply(owners: Dict[int, List[Tuple[str, str, int]]], names: Dict[Tuple[str, str], Set[int]],
+           contributions: Dict[int, List[Tuple[str, str, int]]]) -> None:
+    """
+    以 contributions 取代 owners 中這些藥局原本的貢獻，並同步更新 names
+    """
+    for pid, entries in contributions.items():
+        for kind, name, item_id in owners.pop(pid, ()):
+            ids = names[(kind, name)]
+            ids.discard(item_id)
+            if not ids:
+                del names[(kind, name)]
+        if entries:
+            owners[pid] = list(entries)
+            for kind, name, item_id in entries:
+                names[(kind, name)].add(item_id)
+
+suggest_index = SuggestCatalog()
@@ -1,8 +1,28 @@
 from datetime import time
 
+# 與 DayOfWeekEnum 順序一致，索引值即為星期幾的偏移量 (Mon = 0)
+DAYS_OF_WEEK = ["Mon", "Tue", "Wed", "Thur", "Fri", "Sat", "Sun"]
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
 def is_open_now(open_time: time, close_time: time, check_time: time) -> bool:
     """
-    簡易判斷 check_time 是否在 open_time <= x <= close_time 之間
-    未處理跨午夜。若要跨午夜，可擴充。
+    判斷 check_time 是否在 open_time <= x <= close_time 之間
+    close_time < open_time 視為跨午夜 (例如 20:00 - 02:00)
+    """
+    if open_time <= close_time:
+        return open_time <= check_time <= close_time
+    return check_time >= open_time or check_time <= close_time
+
+def parse_time_str(time_str: str) -> time:
+    """
+    將 "14:00" 或 "14" 轉成 time，格式錯誤時拋出 ValueError
+    """
+    hour_min = time_str.split(":")
+    return time(int(hour_min[0]), int(hour_min[1]) if len(hour_min) > 1 else 0)
+
+def minute_of_week(day_of_week: str, t: time) -> int:
+    """
+    將 (星期幾, 時間) 轉成一週中的第幾分鐘 (Mon 00:00 = 0)
     """
-    return open_time <= check_time <= close_time
\ No newline at end of file
+    return DAYS_OF_WEEK.index(day_of_week) * MINUTES_PER_DAY + t.hour * 60 + t.minute
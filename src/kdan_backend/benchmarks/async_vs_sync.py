@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# benchmarks/async_vs_sync.py
+"""
+比較 DB_ASYNC=false / true 的吞吐量 (需先用 etl.py 把資料匯入本機 Postgres，並安裝 asyncpg)
+
+    cd src/kdan_backend
+    python benchmarks/async_vs_sync.py --concurrency 200 --duration 20
+
+每種模式各啟動一個 uvicorn worker，以固定併發數輪流請求讀取路由，結果以 JSON 輸出
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+DEFAULT_PATHS = [
+    "/pharmacies/all_pharmacies",
+    "/pharmacies/open?day_of_week=Thur&time_str=14:00",
+    "/pharmacies/1/masks?sort_by=price&sort_order=desc",
+    "/pharmacies/filter?count_op=gt&count_value=2&price_min=10&price_max=50",
+    "/users/top_spenders?start_date=2021-01-01T00:00:00&end_date=2021-01-31T23:59:59&top_x=5",
+    "/users/transactions/summary?start_date=2021-01-01T00:00:00&end_date=2021-01-31T23:59:59",
+    "/search?q=mask",
+]
+
+async def _request(reader, writer, host: str, path: str, method: str = "GET", body: bytes = b"") -> int:
+    """
+    以 keep-alive 連線送出一個請求 (body 為 JSON)，讀完整個 response 後回傳 status code
+    """
+    headers = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+    if body:
+        headers += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+    writer.write(headers.encode() + b"\r\n" + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+
+    length = 0
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding" and "chunked" in value.lower():
+            chunked = True
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status
+
+async def _worker(host, port, paths, offset, deadline, latencies, errors):
+    reader = writer = None
+    i = offset
+    while time.perf_counter() < deadline:
+        # paths 的元素為路徑 (GET) 或 (method, path, body)
+        target = paths[i % len(paths)]
+        method, path, body = target if isinstance(target, tuple) else ("GET", target, b"")
+        i += 1
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            started = time.perf_counter()
+            status = await _request(reader, writer, host, path, method, body)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            errors.append(0)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+async def run_load(host: str, port: int, paths, concurrency: int, duration: float) -> dict:
+    latencies, errors = [], []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(
+        _worker(host, port, paths, n, deadline, latencies, errors) for n in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+def wait_ready(host: str, port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://{host}:{port}/openapi.json", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} not ready after {timeout}s")
+
+def bench_mode(mode: str, args) -> dict:
+    env = dict(os.environ, DB_ASYNC="true" if mode == "async" else "false")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", args.host,
+         "--port", str(args.port), "--workers", "1", "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        wait_ready(args.host, args.port, timeout=30)
+        asyncio.run(run_load(args.host, args.port, args.paths, args.concurrency, args.warmup))
+        result = asyncio.run(run_load(args.host, args.port, args.paths, args.concurrency, args.duration))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return dict(mode=mode, concurrency=args.concurrency, duration_s=args.duration, **result)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync vs async request path throughput.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=15, help="seconds of measured load per mode")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of unmeasured load per mode")
+    parser.add_argument("--modes", default="sync,async")
+    parser.add_argument("--path", dest="paths", action="append", help="route to request (repeatable)")
+    parser.add_argument("--output", help="also write results to this JSON file")
+    args = parser.parse_args()
+    args.paths = args.paths or DEFAULT_PATHS
+
+    results = [bench_mode(mode, args) for mode in args.modes.split(",")]
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# benchmarks/generate_data.py
+"""
+產生與 data/pharmacies.json、data/users.json 相同格式的大量資料 (固定 seed，每次結果相同)
+
+    cd src/kdan_backend
+    python benchmarks/generate_data.py --pharmacies 10000 --masks-per-pharmacy 20 \\
+        --users 100000 --purchases 10000000 --out-dir ./data/generated
+
+預設輸出 NDJSON (每行一筆，etl.py 以串流方式讀取)，邊產生邊寫出，記憶體用量與購買筆數無關
+- 名稱皆唯一 (藥局、同一藥局內的口罩、使用者)，同一使用者的交易時間不重複 (etl.py 的自然鍵)
+- 購買集中在少數熱門藥局 (權重 1 / rank^0.8)，每位使用者的購買數不同
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+BRANDS = ["True Barrier", "MaskT", "Second Smile", "Masquerade", "Cotton Kiss", "Smile Mask", "Air Shield", "Pure Breath"]
+COLORS = ["green", "black", "blue", "white", "pink"]
+PACK_SIZES = [3, 6, 10]
+MASK_NAMES = [f"{brand} ({color}) ({size} per pack)"
+              for brand, color, size in itertools.product(BRANDS, COLORS, PACK_SIZES)]
+
+PHARMACY_WORDS = ["Care", "Health", "Well", "Med", "Rx", "Life", "Cure", "Vital", "Prime", "Family"]
+PHARMACY_KINDS = ["Pharmacy", "Drugstore", "Apothecary", "Chemist", "Wellness"]
+FIRST_NAMES = ["Yvonne", "Ada", "Eric", "Mia", "Noah", "Liam", "Emma", "Olivia", "Lucas", "Chloe"]
+LAST_NAMES = ["Guerrero", "Chen", "Wang", "Lin", "Smith", "Garcia", "Brown", "Lee", "Wu", "Huang"]
+
+# 與範例資料相同的營業時間格式 (含跨午夜)
+OPENING_HOURS = [
+    "Mon - Fri 08:00 - 17:00",
+    "Mon - Fri 08:00 - 17:00 / Sat, Sun 08:00 - 12:00",
+    "Mon, Wed, Fri 08:00 - 12:00 / Tue, Thur 14:00 - 18:00",
+    "Mon - Wed 08:00 - 17:00 / Thur, Sat 20:00 - 02:00",
+    "Fri - Sun 20:00 - 02:00",
+    "Mon, Wed, Fri 20:00 - 02:00",
+]
+
+# 交易時間分布在 2021 年
+PERIOD_START = datetime(2021, 1, 1)
+PERIOD_SECONDS = 365 * 24 * 3600
+
+def pharmacy_name(i: int) -> str:
+    word = PHARMACY_WORDS[i % len(PHARMACY_WORDS)]
+    kind = PHARMACY_KINDS[(i // len(PHARMACY_WORDS)) % len(PHARMACY_KINDS)]
+    return f"{word} {kind} {i + 1}"
+
+def user_name(i: int) -> str:
+    first = FIRST_NAMES[i % len(FIRST_NAMES)]
+    last = LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    return f"{first} {last} {i + 1}"
+
+def generate_pharmacies(rng: random.Random, count: int, masks_per_pharmacy: int) -> Iterator[dict]:
+    for i in range(count):
+        mask_count = rng.randint(max(masks_per_pharmacy // 2, 1), max(masks_per_pharmacy * 3 // 2, 1))
+        yield {
+            "name": pharmacy_name(i),
+            "cashBalance": round(rng.uniform(100, 1000), 2),
+            "openingHours": rng.choice(OPENING_HOURS),
+            "masks": [
+                {"name": name, "price": round(rng.uniform(3, 50), 2)}
+                for name in rng.sample(MASK_NAMES, min(mask_count, len(MASK_NAMES)))
+            ],
+        }
+
+def purchase_counts(rng: random.Random, users: int, purchases: int) -> Iterator[int]:
+    """
+    每位使用者的購買數 (平均 purchases / users，總和剛好為 purchases)
+    """
+    remaining = purchases
+    for i in range(users):
+        left = users - i
+        if left == 1:
+            yield remaining
+            return
+        average = remaining / left
+        count = min(remaining, rng.randint(0, int(2 * average)))
+        remaining -= count
+        yield count
+
+def generate_users(rng: random.Random, count: int, purchases: int,
+                   catalog: List[Tuple[str, List[Tuple[str, float]]]]) -> Iterator[dict]:
+    # 熱門藥局的累計權重，rng.choices 以二分搜尋抽樣
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) ** 0.8 for rank in range(len(catalog))))
+    for i, purchase_count in enumerate(purchase_counts(rng, count, purchases)):
+        histories = []
+        offsets = sorted(rng.sample(range(PERIOD_SECONDS), purchase_count))
+        picks = rng.choices(catalog, cum_weights=cum_weights, k=purchase_count)
+        for offset, (pharmacy, masks) in zip(offsets, picks):
+            mask, price = rng.choice(masks)
+            histories.append({
+                "pharmacyName": pharmacy,
+                "maskName": mask,
+                "transactionAmount": round(price * rng.uniform(0.9, 1.0), 2),
+                "transactionDate": (PERIOD_START + timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        yield {
+            "name": user_name(i),
+            "cashBalance": round(rng.uniform(100, 1000), 2),
+            "purchaseHistories": histories,
+        }
+
+def write_records(path: str, records: Iterator[dict], fmt: str) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        if fmt == "json":
+            f.write("[\n")
+        for record in records:
+            if fmt == "json" and count:
+                f.write(",\n")
+            f.write(json.dumps(record, ensure_ascii=False))
+            if fmt == "ndjson":
+                f.write("\n")
+            count += 1
+        if fmt == "json":
+            f.write("\n]\n")
+    return count
+
+def generate(out_dir: str, pharmacies: int, masks_per_pharmacy: int, users: int, purchases: int,
+             seed: int = 42, fmt: str = "ndjson") -> Dict[str, str]:
+    """
+    產生資料並回傳 {"pharmacies": 路徑, "users": 路徑}
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    ext = "ndjson" if fmt == "ndjson" else "json"
+    paths = {
+        "pharmacies": os.path.join(out_dir, f"pharmacies.{ext}"),
+        "users": os.path.join(out_dir, f"users.{ext}"),
+    }
+    rng = random.Random(seed)
+
+    # 購買需要藥局與口罩的對照，只保留名稱與價格
+    catalog: List[Tuple[str, List[Tuple[str, float]]]] = []
+
+    def remember(records):
+        for record in records:
+            catalog.append((record["name"], [(m["name"], m["price"]) for m in record["masks"]]))
+            yield record
+
+    started = time.perf_counter()
+    count = write_records(paths["pharmacies"], remember(generate_pharmacies(rng, pharmacies, masks_per_pharmacy)), fmt)
+    print(f"[INFO] {count} pharmacies written to {paths['pharmacies']} in {time.perf_counter() - started:.2f}s.")
+
+    started = time.perf_counter()
+    count = write_records(paths["users"], generate_users(rng, users, purchases, catalog), fmt)
+    print(f"[INFO] {count} users ({purchases} purchases) written to {paths['users']} "
+          f"in {time.perf_counter() - started:.2f}s.")
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate pharmacies / users files at scale.")
+    parser.add_argument("--pharmacies", type=int, default=1000)
+    parser.add_argument("--masks-per-pharmacy", type=int, default=20, help="average masks per pharmacy")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--purchases", type=int, default=1000000, help="total purchase histories")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--format", choices=["ndjson", "json"], default="ndjson")
+    parser.add_argument("--out-dir", default="./data/generated")
+    args = parser.parse_args()
+    generate(args.out_dir, args.pharmacies, args.masks_per_pharmacy, args.users, args.purchases,
+             args.seed, args.format)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# benchmarks/load_suite.py
+"""
+端到端壓測：(選擇性) 產生資料 -> 以 etl.py 匯入本機 Postgres -> 逐一對每個路由施加固定併發數的負載
+
+    cd src/kdan_backend
+    python benchmarks/load_suite.py --generate --pharmacies 10000 --users 100000 --purchases 10000000 \\
+        --concurrency 50 --duration 20 --output bench.json
+    python benchmarks/load_suite.py --skip-load --output bench.json   # 資料已匯入時
+
+每個路由各自量測 p50/p95/p99 延遲、吞吐量與每個請求的 SQL 查詢數 (由 /internal/pool 的 statements 差值計算)，
+結果以 JSON 輸出 (含 git commit)，可用來比較不同 commit
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import secrets
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+from async_vs_sync import run_load
+from generate_data import generate
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+# (名稱, method, 路徑樣板)；{pharmacy_id} / {user_id} / {day} / {q} 以實際資料輪流代入
+ROUTES = [
+    ("GET /pharmacies/all_pharmacies", "GET", "/pharmacies/all_pharmacies?limit=100"),
+    ("GET /pharmacies/open", "GET", "/pharmacies/open?day_of_week={day}&time_str=14:00"),
+    ("GET /pharmacies/open (window)", "GET", "/pharmacies/open?day_of_week={day}&time_str=20:00&end_time_str=01:00"),
+    ("GET /pharmacies/{id}/masks", "GET", "/pharmacies/{pharmacy_id}/masks?sort_by=price&sort_order=desc"),
+    ("GET /pharmacies/filter", "GET", "/pharmacies/filter?count_op=gt&count_value=5&price_min=10&price_max=30"),
+    ("GET /pharmacies/all_masks", "GET", "/pharmacies/all_masks?limit=100"),
+    ("GET /users", "GET", "/users?limit=100"),
+    ("GET /users/{id}/purchases", "GET", "/users/{user_id}/purchases?limit=100"),
+    ("GET /users/top_spenders", "GET",
+     "/users/top_spenders?start_date=2021-01-01T00:00:00&end_date=2021-03-31T12:00:00&top_x=10"),
+    ("GET /users/transactions/summary", "GET",
+     "/users/transactions/summary?start_date=2021-01-01T00:00:00&end_date=2021-03-31T12:00:00"),
+    ("GET /search", "GET", "/search?q={q}&limit=20"),
+    # 會寫入資料，放在最後
+    ("POST /users/{id}/purchase", "POST", "/users/{user_id}/purchase"),
+]
+DAYS = ["Mon", "Tue", "Wed", "Thur", "Fri", "Sat", "Sun"]
+QUERIES = ["mask", "care", "blue", "smile", "pack", "rx"]
+# 每個路由輪流使用的樣本數
+SAMPLES = 20
+
+# 啟動的 server 以此 token 開放 /internal/* (見 INTERNAL_TOKEN)
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN") or secrets.token_urlsafe(16)
+
+def _get_json(base: str, path: str, headers: dict = None):
+    request = urllib.request.Request(base + path, headers=headers or {})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)
+
+def statement_count(base: str) -> int:
+    pools = _get_json(base, "/internal/pool", {"X-Internal-Token": INTERNAL_TOKEN})
+    return sum(pool["statements"] for pool in pools.values())
+
+def wait_ready(base: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base + "/readyz", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {base} not ready after {timeout}s")
+
+def sample_targets(base: str):
+    """
+    以 API 取得實際存在的藥局、口罩與使用者，組成每個路由要請求的目標
+    """
+    pharmacy_ids = [ph["id"] for ph in _get_json(base, f"/pharmacies/all_pharmacies?limit={SAMPLES}")]
+    user_ids = [u["id"] for u in _get_json(base, f"/users?limit={SAMPLES}")]
+    masks = [m for pid in pharmacy_ids for m in _get_json(base, f"/pharmacies/{pid}/masks?limit=1")]
+    if not (pharmacy_ids and user_ids and masks):
+        raise RuntimeError("database has no pharmacies / users / masks; load data first")
+
+    targets = {}
+    for name, method, template in ROUTES:
+        items = []
+        for i in range(SAMPLES):
+            path = template.format(
+                pharmacy_id=pharmacy_ids[i % len(pharmacy_ids)],
+                user_id=user_ids[i % len(user_ids)],
+                day=DAYS[i % len(DAYS)],
+                q=QUERIES[i % len(QUERIES)],
+            )
+            body = b""
+            if method == "POST":
+                mask = masks[i % len(masks)]
+                body = json.dumps([{
+                    "pharmacy_id": mask["pharmacy_id"],
+                    "mask_id": mask["id"],
+                    "mask_name": mask["name"],
+                    "quantity": 1,
+                    "transaction_amount": 0.01,
+                    "transaction_date": "2021-06-01T10:00:00",
+                }]).encode()
+            items.append((method, path, body))
+        targets[name] = items
+    return targets
+
+def load_data(pharmacies_path: str, users_path: str, mode: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "etl.py", "--mode", mode, "--restart",
+                    "--pharmacies", os.path.abspath(pharmacies_path), "--users", os.path.abspath(users_path)],
+                   cwd=APP_DIR, stdout=sys.stderr, check=True)
+    return time.perf_counter() - started
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def run_suite(args) -> dict:
+    result = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "workers": args.workers,
+    }
+    # 進度訊息一律寫 stderr，stdout 只留結果 JSON
+    if args.generate:
+        with contextlib.redirect_stdout(sys.stderr):
+            paths = generate(args.data_dir, args.pharmacies, args.masks_per_pharmacy, args.users, args.purchases,
+                             args.seed)
+        args.pharmacies_file, args.users_file = paths["pharmacies"], paths["users"]
+        result["dataset"] = {"pharmacies": args.pharmacies, "masks_per_pharmacy": args.masks_per_pharmacy,
+                             "users": args.users, "purchases": args.purchases, "seed": args.seed}
+    if not args.skip_load:
+        result["etl_seconds"] = round(load_data(args.pharmacies_file, args.users_file, args.etl_mode), 2)
+
+    # 資料版本只在啟動時讀一次，背景輪詢不會算進每個請求的查詢數
+    env = dict(os.environ, CATALOG_VERSION_POLL="3600", INTERNAL_TOKEN=INTERNAL_TOKEN)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", args.host, "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=APP_DIR, env=env, stdout=sys.stderr,
+    )
+    base = f"http://{args.host}:{args.port}"
+    routes = []
+    try:
+        wait_ready(base, timeout=args.ready_timeout)
+        targets = sample_targets(base)
+        for name, _, _ in ROUTES:
+            if args.only and not any(part in name for part in args.only):
+                continue
+            asyncio.run(run_load(args.host, args.port, targets[name], args.concurrency, args.warmup))
+            before = statement_count(base)
+            stats = asyncio.run(run_load(args.host, args.port, targets[name], args.concurrency, args.duration))
+            statements = statement_count(base) - before
+            # 多個 worker 時 /internal/pool 只反映其中一個，查詢數無法計算
+            if args.workers == 1 and stats["requests"]:
+                stats["queries_per_request"] = round(statements / stats["requests"], 3)
+            routes.append(dict(route=name, **stats))
+            print(f"[INFO] {name}: {stats}", file=sys.stderr)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    result["routes"] = routes
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Load data through etl.py and benchmark every route.")
+    parser.add_argument("--generate", action="store_true", help="generate a dataset first (see generate_data.py)")
+    parser.add_argument("--pharmacies", type=int, default=1000)
+    parser.add_argument("--masks-per-pharmacy", type=int, default=20)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--purchases", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default="./data/generated")
+    parser.add_argument("--pharmacies-file", default="./data/generated/pharmacies.ndjson")
+    parser.add_argument("--users-file", default="./data/generated/users.ndjson")
+    parser.add_argument("--skip-load", action="store_true", help="use the data already in the database")
+    parser.add_argument("--etl-mode", choices=["default", "bulk"], default="bulk")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=15, help="seconds of measured load per route")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of unmeasured load per route")
+    parser.add_argument("--ready-timeout", type=float, default=120)
+    parser.add_argument("--only", action="append", help="only routes whose name contains this (repeatable)")
+    parser.add_argument("--output", help="also write results to this JSON file")
+    args = parser.parse_args()
+
+    result = run_suite(args)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
 # etl.py
 
+import argparse
+import hashlib
+import itertools
 import psycopg2
+import psycopg2.extras
 import json
 import re
-from datetime import datetime
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
 import os
 from dotenv import load_dotenv
+import migrations
+from migrations import m0002_keys_and_triggers as catalog_keys
+from migrations import m0003_hot_query_indexes as hot_query_indexes
+from migrations import partitions
 
 env = os.getenv('ENV', 'dev')
 load_dotenv(f".env.{env}")
@@ -18,125 +31,100 @@ DB_NAME = os.getenv('POSTGRES_DB')
 DB_USER = os.getenv('POSTGRES_USER')
 DB_PASSWORD = os.getenv('POSTGRES_PASSWORD')
 
-# === 2) 建立 ENUM 與五個資料表 (無 address, phone) ===
-def create_tables():
+# 需與 API 的 DAILY_SPEND_SHARDS 相同
+DAILY_SPEND_SHARDS = int(os.getenv('DAILY_SPEND_SHARDS', 16))
+
+# 每個 INSERT ... ON CONFLICT 的列數
+UPSERT_BATCH_SIZE = int(os.getenv('ETL_UPSERT_BATCH_SIZE', 1000))
+# 每次 commit (並更新 checkpoint) 的來源筆數 (藥局 / 使用者)
+CHUNK_SIZE = int(os.getenv('ETL_CHUNK_SIZE', 500))
+# 解析營業時間與日期的 process 數，1 表示在主程式中解析
+WORKERS = int(os.getenv('ETL_WORKERS', os.cpu_count() or 1))
+CHECKPOINT_PATH = os.getenv('ETL_CHECKPOINT', './data/.etl_checkpoint.json')
+
+DEFAULT_TRANSACTION_DATE = "2021-01-01 00:00:00"
+
+def get_connection():
+    return psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+
+# === 2) 建立 / 升級 schema (定義在 migrations/) ===
+def create_tables(defer_constraints: bool = False, drop_existing: bool = True):
     """
-    建立:
-      1. ENUM day_of_week_enum (含 'Thur')
-      2. pharmacies (id, name, cash_balance)
-      3. pharmacy_opening_hours (id, pharmacy_id, day_of_week, open_time, close_time)
-      4. masks (id, pharmacy_id, name, price)
-      5. users (id, name, cash_balance)
-      6. purchase_histories (id, user_id, pharmacy_id, mask_id, mask_name, quantity, transaction_amount, transaction_date)
+    以 migrations 建立或升級 schema
+    defer_constraints=True 時先不套用排在最後的 DEFERRABLE migration (purchase_histories 的索引與外鍵)，
+    由呼叫端在匯入後執行 apply_migrations()；m0002 / m0003 需在 m0004 之前套用，
+    其他表的索引、外鍵與 trigger 由 bulk_import 在 COPY 前拿掉、restore_bulk_table_keys() 重建
+    drop_existing=False 時保留既有資料 (incremental 模式)，只套用尚未套用的 migration
     """
     drop_schema_sql = """
+    DROP TABLE IF EXISTS daily_spend CASCADE;
+    DROP TABLE IF EXISTS user_daily_spend CASCADE;
+    DROP TABLE IF EXISTS balance_ledger CASCADE;
     DROP TABLE IF EXISTS purchase_histories CASCADE;
     DROP TABLE IF EXISTS masks CASCADE;
     DROP TABLE IF EXISTS pharmacy_opening_hours CASCADE;
     DROP TABLE IF EXISTS pharmacies CASCADE;
     DROP TABLE IF EXISTS users CASCADE;
     DROP TYPE IF EXISTS day_of_week_enum CASCADE;
-    """
-
-    create_enum = """
-    DO $$
-    BEGIN
-        IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'day_of_week_enum') THEN
-            CREATE TYPE day_of_week_enum AS ENUM ('Mon','Tue','Wed','Thur','Fri','Sat','Sun');
-        END IF;
-    END$$;
-    """
-
-    create_pharmacies = """
-    CREATE TABLE IF NOT EXISTS pharmacies (
-        id SERIAL PRIMARY KEY,
-        name VARCHAR(255) NOT NULL,
-        cash_balance DOUBLE PRECISION DEFAULT 0
-    );
-    """
-
-    create_pharmacy_opening_hours = """
-    CREATE TABLE IF NOT EXISTS pharmacy_opening_hours (
-        id SERIAL PRIMARY KEY,
-        pharmacy_id INT NOT NULL,
-        day_of_week day_of_week_enum NOT NULL,
-        open_time TIME NOT NULL,
-        close_time TIME NOT NULL,
-        CONSTRAINT fk_pharmacy
-            FOREIGN KEY (pharmacy_id) REFERENCES pharmacies(id)
-            ON DELETE CASCADE
-    );
-    """
-
-    create_masks = """
-    CREATE TABLE IF NOT EXISTS masks (
-        id SERIAL PRIMARY KEY,
-        pharmacy_id INT NOT NULL,
-        name VARCHAR(255) NOT NULL,
-        price DOUBLE PRECISION DEFAULT 0,
-        CONSTRAINT fk_pharmacy
-            FOREIGN KEY (pharmacy_id) REFERENCES pharmacies(id)
-            ON DELETE CASCADE
-    );
-    """
-
-    create_users = """
-    CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        name VARCHAR(255) NOT NULL,
-        cash_balance DOUBLE PRECISION DEFAULT 0
-    );
-    """
-
-    create_purchase_histories = """
-    CREATE TABLE IF NOT EXISTS purchase_histories (
-        id SERIAL PRIMARY KEY,
-        user_id INT NOT NULL,
-        pharmacy_id INT NOT NULL,
-        mask_id INT,
-        mask_name VARCHAR(255),
-        quantity INT DEFAULT 1,
-        transaction_amount DOUBLE PRECISION DEFAULT 0,
-        transaction_date TIMESTAMP,
-        CONSTRAINT fk_user
-            FOREIGN KEY (user_id) REFERENCES users(id)
-            ON DELETE CASCADE,
-        CONSTRAINT fk_pharmacy
-            FOREIGN KEY (pharmacy_id) REFERENCES pharmacies(id)
-            ON DELETE CASCADE,
-        CONSTRAINT fk_mask
-            FOREIGN KEY (mask_id) REFERENCES masks(id)
-            ON DELETE CASCADE
-    );
+    DROP TABLE IF EXISTS schema_migrations;
     """
 
     conn = None
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        cursor = conn.cursor()
+        conn = get_connection()
+        if drop_existing:
+            with conn.cursor() as cursor:
+                cursor.execute(drop_schema_sql)
+            conn.commit()
+        migrations.upgrade(conn, skip_deferrable=defer_constraints)
+        print("[INFO] Tables created (or already exist).")
+    except Exception as e:
+        print("[ERROR] Failed to create tables:", e)
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
 
-        # 若想保留舊資料，可註解以下:
-        cursor.execute(drop_schema_sql)
+def apply_migrations():
+    """
+    套用所有尚未套用的 migration (bulk 匯入後補上 purchase_histories 的索引與外鍵)
+    """
+    conn = get_connection()
+    try:
+        started = time.perf_counter()
+        migrations.upgrade(conn)
+        print(f"[INFO] Indexes, foreign keys and triggers created in {time.perf_counter() - started:.2f}s.")
+    finally:
+        conn.close()
 
-        # 建立 enum + tables
-        cursor.execute(create_enum)
-        cursor.execute(create_pharmacies)
-        cursor.execute(create_pharmacy_opening_hours)
-        cursor.execute(create_masks)
-        cursor.execute(create_users)
-        cursor.execute(create_purchase_histories)
+def create_search_indexes():
+    """
+    建立 /search (SEARCH_BACKEND=pg_trgm) 使用的 pg_trgm GIN 索引
+    需要 CREATE EXTENSION 權限，失敗時只警告，不影響 memory 模式的搜尋
+    """
+    create_trgm_indexes = """
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS ix_pharmacies_name_trgm ON pharmacies USING gin (name gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS ix_masks_name_trgm ON masks USING gin (name gin_trgm_ops);
+    """
 
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(create_trgm_indexes)
         conn.commit()
         cursor.close()
-        print("[INFO] Tables created (or already exist).")
+        print("[INFO] pg_trgm search indexes created.")
     except Exception as e:
-        print("[ERROR] Failed to create tables:", e)
+        print("[WARN] Failed to create pg_trgm search indexes:", e)
         if conn:
             conn.rollback()
     finally:
@@ -182,11 +170,319 @@ def parse_opening_hours(opening_str: str):
                     print(f"[WARN] Unrecognized day '{d}'. Skipping.")
     return results
 
-# === 4) 匯入 pharmacies.json → pharmacies, pharmacy_opening_hours, masks ===
-def import_pharmacies(pharmacies_json_path: str):
+# === 自然鍵與內容雜湊 (所有匯入模式共用，之後的 incremental 匯入才能比對) ===
+def content_hash(*values) -> str:
+    """
+    來源欄位的 md5，用來判斷該列自上次匯入後是否變更
+    """
+    payload = json.dumps(values, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+def pharmacy_hash(item) -> str:
+    return content_hash(float(item.get("cashBalance", 0)), item.get("openingHours", ""))
+
+def mask_hash(m) -> str:
+    return content_hash(float(m["price"]))
+
+def user_hash(u) -> str:
+    return content_hash(float(u.get("cashBalance", 0)))
+
+def purchase_keys(user_name: str, histories) -> list:
+    """
+    一個使用者的購買紀錄的自然鍵：使用者名稱 + 交易時間 (+ 同一時間的第幾筆)
+    同一次結帳買多種口罩時交易時間相同，依來源檔中的順序編號；第一筆沿用原本的格式，既有資料的 key 不變
+    """
+    seen = Counter()
+    keys = []
+    for ph in histories:
+        transaction_date = ph.get("transactionDate", DEFAULT_TRANSACTION_DATE)
+        ordinal = seen[transaction_date]
+        seen[transaction_date] += 1
+        keys.append(f"{user_name}|{transaction_date}" + (f"|{ordinal}" if ordinal else ""))
+    return keys
+
+def purchase_hash(ph) -> str:
+    return content_hash(ph["pharmacyName"], ph.get("maskName", ""), float(ph.get("transactionAmount", 0)))
+
+# === 4) 串流讀取來源檔 + 平行解析 + checkpoint ===
+READ_SIZE = 1 << 16
+_WHITESPACE = re.compile(r"\s*")
+
+class _TextChunks:
+    """
+    以固定大小讀取檔案，只保留尚未解析的部分
+    """
+    def __init__(self, f, read_size: int):
+        self.f = f
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self) -> None:
+        chunk = self.f.read(self.read_size)
+        self.eof = not chunk
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def skip_whitespace(self) -> bool:
+        """
+        略過空白，回傳後面是否還有內容
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return True
+            if self.eof:
+                return False
+            self.read_more()
+
+def iter_records(path: str, read_size: int = READ_SIZE):
+    """
+    逐筆 yield 來源檔中的物件，支援:
+      - JSON array: [{...}, {...}]
+      - NDJSON: 每行一個物件
+    記憶體中只有目前的讀取區塊與正在解析的那一筆，與檔案大小無關
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        chunks = _TextChunks(f, read_size)
+        if not chunks.skip_whitespace():
+            return
+        in_array = chunks.buf[chunks.pos] == "["
+        if in_array:
+            chunks.pos += 1
+
+        while True:
+            if not chunks.skip_whitespace():
+                if in_array:
+                    raise ValueError(f"{path}: unterminated JSON array")
+                return
+            if in_array and chunks.buf[chunks.pos] == "]":
+                return
+
+            # 物件不完整時 raw_decode 會失敗，讀入下一個區塊再試
+            while True:
+                try:
+                    record, end = decoder.raw_decode(chunks.buf, chunks.pos)
+                    break
+                except json.JSONDecodeError:
+                    if chunks.eof:
+                        raise
+                    chunks.read_more()
+            if not isinstance(record, dict):
+                raise ValueError(f"{path}: expected JSON objects, got {type(record).__name__}")
+            chunks.pos = end
+
+            if in_array and chunks.skip_whitespace() and chunks.buf[chunks.pos] == ",":
+                chunks.pos += 1
+            yield record
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+@contextmanager
+def parser_pool(workers: int):
+    """
+    回傳 map 函式：workers > 1 時在 process pool 中解析營業時間與日期
+    """
+    if workers <= 1:
+        yield lambda fn, items: list(map(fn, items))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield lambda fn, items: list(pool.map(fn, items, chunksize=max(1, len(items) // (workers * 4))))
+
+def prepare_pharmacy(item):
+    """
+    (name, cash_balance, content_hash, opening_hours, [(mask_name, price, content_hash), ...])
+    在 worker process 中執行
+    """
+    return (
+        item["name"],
+        float(item.get("cashBalance", 0)),
+        pharmacy_hash(item),
+        parse_opening_hours(item.get("openingHours", "")),
+        [(m["name"], float(m["price"]), mask_hash(m)) for m in item.get("masks", [])],
+    )
+
+def prepare_user(u):
+    """
+    (name, cash_balance, content_hash,
+     [(pharmacy_name, mask_name, amount, transaction_date, etl_key, content_hash), ...])
+    在 worker process 中執行
     """
-    期待 JSON 結構:
-    [
+    histories = u.get("purchaseHistories", [])
+    return (
+        u["name"],
+        float(u.get("cashBalance", 0)),
+        user_hash(u),
+        [
+            (
+                ph["pharmacyName"],
+                ph.get("maskName", ""),
+                float(ph.get("transactionAmount", 0)),
+                datetime.strptime(ph.get("transactionDate", DEFAULT_TRANSACTION_DATE), "%Y-%m-%d %H:%M:%S"),
+                key,
+                purchase_hash(ph),
+            )
+            for ph, key in zip(histories, purchase_keys(u["name"], histories))
+        ],
+    )
+
+class Checkpoint:
+    """
+    記錄每個來源檔已 commit 的筆數與購買紀錄有變動的日子，中斷後重新執行會從該處繼續
+    與模式及來源檔的大小、修改時間綁定，來源檔換過就重新開始
+    """
+    def __init__(self, path: str, mode: str, sources: dict):
+        self.path = path
+        self.state = {
+            "mode": mode,
+            "sources": {name: self._signature(src) for name, src in sources.items()},
+            "done": {name: 0 for name in sources},
+            "dirty_days": [],
+        }
+
+    @staticmethod
+    def _signature(path: str) -> dict:
+        stat = os.stat(path)
+        return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+    def load(self) -> bool:
+        """
+        讀入相符的 checkpoint，回傳是否為續跑
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get("mode") != self.state["mode"] or saved.get("sources") != self.state["sources"]:
+            print(f"[INFO] Ignoring checkpoint {self.path}: source files or mode changed.")
+            return False
+        self.state = saved
+        return True
+
+    def done(self, name: str) -> int:
+        return self.state["done"][name]
+
+    def advance(self, name: str, count: int) -> None:
+        self.state["done"][name] += count
+        self.save()
+
+    def add_dirty_days(self, days) -> None:
+        new_days = {day.isoformat() for day in days} - set(self.state["dirty_days"])
+        if new_days:
+            self.state["dirty_days"] = sorted(set(self.state["dirty_days"]) | new_days)
+            self.save()
+
+    def dirty_days(self):
+        return [date.fromisoformat(day) for day in self.state["dirty_days"]]
+
+    def save(self) -> None:
+        # 先寫暫存檔再 rename，中斷時不會留下寫到一半的 checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def upsert_rows(cursor, sql: str, rows, page_size: int = UPSERT_BATCH_SIZE):
+    """
+    以 execute_values 分批執行 INSERT ... ON CONFLICT ... RETURNING，回傳所有 RETURNING 的列
+    同一批內的自然鍵不可重複 (ON CONFLICT 不能在同一個 statement 更新同一列兩次)，由呼叫端先去重
+    """
+    if not rows:
+        return []
+    return psycopg2.extras.execute_values(cursor, sql, rows, page_size=page_size, fetch=True)
+
+def _count(counts: Counter, table: str, returned) -> None:
+    # RETURNING 的最後一欄為 (xmax = 0)：新插入的列為 true，被更新的列為 false
+    inserted = sum(1 for row in returned if row[-1])
+    counts[f"{table} inserted"] += inserted
+    counts[f"{table} updated"] += len(returned) - inserted
+
+# 自然鍵衝突且 content_hash 相同時 WHERE 不成立，該列不會被寫入也不會出現在 RETURNING
+SQL_UPSERT_PHARMACIES = """
+    INSERT INTO pharmacies (name, cash_balance, content_hash) VALUES %s
+    ON CONFLICT (name) DO UPDATE
+        SET cash_balance = EXCLUDED.cash_balance, content_hash = EXCLUDED.content_hash
+        WHERE pharmacies.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+    RETURNING id, name, (xmax = 0)
+"""
+
+SQL_UPSERT_MASKS = """
+    INSERT INTO masks (pharmacy_id, name, price, content_hash) VALUES %s
+    ON CONFLICT (pharmacy_id, name) DO UPDATE
+        SET price = EXCLUDED.price, content_hash = EXCLUDED.content_hash
+        WHERE masks.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+    RETURNING (xmax = 0)
+"""
+
+SQL_UPSERT_USERS = """
+    INSERT INTO users (name, cash_balance, content_hash) VALUES %s
+    ON CONFLICT (name) DO UPDATE
+        SET cash_balance = EXCLUDED.cash_balance, content_hash = EXCLUDED.content_hash
+        WHERE users.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+    RETURNING (xmax = 0)
+"""
+
+SQL_UPSERT_PURCHASES = """
+    INSERT INTO purchase_histories
+        (user_id, pharmacy_id, mask_id, mask_name, quantity, transaction_amount, transaction_date,
+         etl_key, content_hash)
+    VALUES %s
+    ON CONFLICT (etl_key, transaction_date) DO UPDATE
+        SET pharmacy_id = EXCLUDED.pharmacy_id,
+            mask_id = EXCLUDED.mask_id,
+            mask_name = EXCLUDED.mask_name,
+            transaction_amount = EXCLUDED.transaction_amount,
+            content_hash = EXCLUDED.content_hash
+        WHERE purchase_histories.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+    RETURNING transaction_date::date, (xmax = 0)
+"""
+
+# === 5) 匯入 pharmacies.json → pharmacies, pharmacy_opening_hours, masks ===
+def _write_pharmacies(cursor, prepared, counts: Counter) -> None:
+    # 同一批內名稱重複時以最後一筆為準
+    by_name = {p[0]: p for p in prepared}
+    changed = upsert_rows(cursor, SQL_UPSERT_PHARMACIES, [
+        (name, cash_balance, digest) for name, cash_balance, digest, _, _ in by_name.values()
+    ])
+    _count(counts, "pharmacies", changed)
+
+    # 新增或內容變更的藥局才重建營業時間
+    changed_ids = [pharmacy_id for pharmacy_id, _, _ in changed]
+    if changed_ids:
+        cursor.execute("DELETE FROM pharmacy_opening_hours WHERE pharmacy_id = ANY(%s)", (changed_ids,))
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO pharmacy_opening_hours (pharmacy_id, day_of_week, open_time, close_time) VALUES %s
+        """, [
+            (pharmacy_id, dow, open_t, close_t)
+            for pharmacy_id, name, _ in changed
+            for (dow, open_t, close_t) in by_name[name][3]
+        ], page_size=UPSERT_BATCH_SIZE)
+
+    cursor.execute("SELECT name, id FROM pharmacies WHERE name = ANY(%s)", (list(by_name),))
+    pharmacy_ids = dict(cursor.fetchall())
+    mask_rows = {}
+    for name, _, _, _, masks in by_name.values():
+        for mask_name, price, digest in masks:
+            mask_rows[(pharmacy_ids[name], mask_name)] = (pharmacy_ids[name], mask_name, price, digest)
+    _count(counts, "masks", upsert_rows(cursor, SQL_UPSERT_MASKS, list(mask_rows.values())))
+
+def import_pharmacies(pharmacies_json_path: str, checkpoint: Checkpoint,
+                      chunk_size: int = CHUNK_SIZE, workers: int = WORKERS):
+    """
+    期待 JSON array 或 NDJSON，每筆結構:
       {
         "name": "DFW Wellness",
         "cashBalance": 328.41,
@@ -195,78 +491,83 @@ def import_pharmacies(pharmacies_json_path: str):
           {"name": "MaskT (green) (10 per pack)", "price": 41.86},
           ...
         ]
-      },
-      ...
-    ]
+      }
+    每 chunk_size 間藥局 commit 一次並更新 checkpoint；以自然鍵 upsert，重跑同一段不會重複寫入
     """
     conn = None
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
+        conn = get_connection()
         cursor = conn.cursor()
+        counts = Counter()
+        skip = checkpoint.done("pharmacies")
+        if skip:
+            print(f"[INFO] Resuming pharmacies after {skip} records.")
 
-        with open(pharmacies_json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        inserted_count = 0
-
-        for item in data:
-            name = item["name"]
-            cash_balance = float(item.get("cashBalance", 0))
-            opening_str = item.get("openingHours", "")
-
-            # INSERT pharmacies
-            sql_pharmacy = """
-                INSERT INTO pharmacies (name, cash_balance)
-                VALUES (%s, %s)
-                RETURNING id
-            """
-            cursor.execute(sql_pharmacy, (name, cash_balance))
-            pharmacy_id = cursor.fetchone()[0]
-
-            # 插入營業時間
-            oh_list = parse_opening_hours(opening_str)
-            for (dow, open_t, close_t) in oh_list:
-                sql_oh = """
-                    INSERT INTO pharmacy_opening_hours
-                    (pharmacy_id, day_of_week, open_time, close_time)
-                    VALUES (%s, %s, %s, %s)
-                """
-                cursor.execute(sql_oh, (pharmacy_id, dow, open_t, close_t))
-
-            # 插入口罩
-            for m in item.get("masks", []):
-                mask_name = m["name"]
-                mask_price = float(m["price"])
-                sql_mask = """
-                    INSERT INTO masks (pharmacy_id, name, price)
-                    VALUES (%s, %s, %s)
-                """
-                cursor.execute(sql_mask, (pharmacy_id, mask_name, mask_price))
-
-            inserted_count += 1
+        with parser_pool(workers) as parse:
+            for chunk in chunked(itertools.islice(iter_records(pharmacies_json_path), skip, None), chunk_size):
+                _write_pharmacies(cursor, parse(prepare_pharmacy, chunk), counts)
+                conn.commit()
+                checkpoint.advance("pharmacies", len(chunk))
 
-        conn.commit()
         cursor.close()
-        print(f"[INFO] Inserted {inserted_count} pharmacies (opening_hours, masks).")
+        print(f"[INFO] Imported {checkpoint.done('pharmacies')} pharmacies: {dict(counts)}.")
     except Exception as e:
         print("[ERROR] Failed to import pharmacies:", e)
         if conn:
             conn.rollback()
+        raise
     finally:
         if conn:
             conn.close()
 
-# === 5) 匯入 users.json → users, purchase_histories ===
-def import_users(users_json_path: str):
+# === 6) 匯入 users.json → users, purchase_histories ===
+def _write_users(cursor, prepared, counts: Counter):
+    """
+    回傳購買紀錄有新增或變更的日子
     """
-    期待 JSON 結構:
-    [
+    by_name = {p[0]: p for p in prepared}
+    _count(counts, "users", upsert_rows(cursor, SQL_UPSERT_USERS, [
+        (name, cash_balance, digest) for name, cash_balance, digest, _ in by_name.values()
+    ]))
+    cursor.execute("SELECT name, id FROM users WHERE name = ANY(%s)", (list(by_name),))
+    user_ids = dict(cursor.fetchall())
+
+    # 只查這一批用到的藥局與其口罩
+    pharmacy_names = {purchase[0] for _, _, _, purchases in by_name.values() for purchase in purchases}
+    cursor.execute("SELECT name, id FROM pharmacies WHERE name = ANY(%s)", (list(pharmacy_names),))
+    pharmacy_ids = dict(cursor.fetchall())
+    cursor.execute("SELECT pharmacy_id, name, id FROM masks WHERE pharmacy_id = ANY(%s)",
+                   (list(pharmacy_ids.values()),))
+    mask_ids = {(pharmacy_id, name): mask_id for pharmacy_id, name, mask_id in cursor.fetchall()}
+
+    purchase_rows = {}
+    for user_name, _, _, purchases in by_name.values():
+        for pharmacy_name, mask_name, amount, transaction_date, key, digest in purchases:
+            pharmacy_id = pharmacy_ids.get(pharmacy_name)
+            if pharmacy_id is None:
+                counts["purchases skipped (unknown pharmacy)"] += 1
+                continue
+            purchase_rows[key] = (
+                user_ids[user_name],
+                pharmacy_id,
+                mask_ids.get((pharmacy_id, mask_name)),
+                mask_name,
+                1,
+                amount,
+                transaction_date,
+                key,
+                digest,
+            )
+    # 先建立這一批用到的月份分區，不落到預設分區
+    partitions.ensure_partitions(cursor, {row[6] for row in purchase_rows.values()})
+    changed = upsert_rows(cursor, SQL_UPSERT_PURCHASES, list(purchase_rows.values()))
+    _count(counts, "purchase_histories", changed)
+    return {day for day, _ in changed}
+
+def import_users(users_json_path: str, checkpoint: Checkpoint,
+                 chunk_size: int = CHUNK_SIZE, workers: int = WORKERS):
+    """
+    期待 JSON array 或 NDJSON，每筆結構:
       {
         "name": "Yvonne Guerrero",
         "cashBalance": 191.83,
@@ -279,103 +580,379 @@ def import_users(users_json_path: str):
           },
           ...
         ]
-      },
-      ...
-    ]
+      }
+    每 chunk_size 位使用者 commit 一次並更新 checkpoint
+    有變動的日子在 commit 前先記入 checkpoint，中斷後續跑也不會漏掉需要重算彙總的日子
     """
     conn = None
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
+        conn = get_connection()
         cursor = conn.cursor()
+        counts = Counter()
+        skip = checkpoint.done("users")
+        if skip:
+            print(f"[INFO] Resuming users after {skip} records.")
 
-        with open(users_json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        user_count = 0
-        purchase_count = 0
-
-        for u in data:
-            user_name = u["name"]
-            user_balance = float(u.get("cashBalance", 0))
-            purchase_list = u.get("purchaseHistories", [])
-
-            # 新增 user
-            sql_user = """
-                INSERT INTO users (name, cash_balance)
-                VALUES (%s, %s)
-                RETURNING id
-            """
-            cursor.execute(sql_user, (user_name, user_balance))
-            user_id = cursor.fetchone()[0]
-            user_count += 1
-
-            # 新增 purchase_histories
-            for ph in purchase_list:
-                pharmacy_name = ph["pharmacyName"]
-                mask_name = ph.get("maskName", "")
-                amt = float(ph.get("transactionAmount", 0))
-                dt_str = ph.get("transactionDate", "2021-01-01 00:00:00")
-                dt_obj = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
-
-                # 查找 pharmacy_id
-                sql_find_pharmacy = "SELECT id FROM pharmacies WHERE name=%s"
-                cursor.execute(sql_find_pharmacy, (pharmacy_name,))
-                row_p = cursor.fetchone()
-                if not row_p:
-                    print(f"[WARN] Pharmacy '{pharmacy_name}' not found. Skipping.")
-                    continue
-                pharmacy_id = row_p[0]
-
-                # 查找 mask_id
-                sql_find_mask = """
-                    SELECT id FROM masks
-                    WHERE pharmacy_id=%s AND name=%s
-                """
-                cursor.execute(sql_find_mask, (pharmacy_id, mask_name))
-                row_m = cursor.fetchone()
-                if not row_m:
-                    print(f"[WARN] Mask '{mask_name}' not found under pharmacy '{pharmacy_name}'. Skipping mask_id.")
-                    mask_id = None
-                else:
-                    mask_id = row_m[0]
-
-                # 預設 quantity=1
-                sql_insert_ph = """
-                    INSERT INTO purchase_histories
-                    (user_id, pharmacy_id, mask_id, mask_name, quantity, transaction_amount, transaction_date)
-                    VALUES (%s, %s, %s, %s, 1, %s, %s)
-                """
-                cursor.execute(sql_insert_ph, (user_id, pharmacy_id, mask_id, mask_name, amt, dt_obj))
-                purchase_count += 1
+        with parser_pool(workers) as parse:
+            for chunk in chunked(itertools.islice(iter_records(users_json_path), skip, None), chunk_size):
+                checkpoint.add_dirty_days(_write_users(cursor, parse(prepare_user, chunk), counts))
+                conn.commit()
+                checkpoint.advance("users", len(chunk))
 
-        conn.commit()
         cursor.close()
-        print(f"[INFO] Inserted {user_count} users, {purchase_count} purchase records.")
+        print(f"[INFO] Imported {checkpoint.done('users')} users: {dict(counts)}.")
     except Exception as e:
         print("[ERROR] Failed to import users:", e)
         if conn:
             conn.rollback()
+        raise
     finally:
         if conn:
             conn.close()
 
-# === 6) 主程式：建表 & 從JSON匯入 ===
-def main():
-    # (1) 建表
-    create_tables()
+# === 7) bulk 匯入：COPY FROM STDIN + 記憶體內的 key 對照表 ===
+def _copy_value(value) -> str:
+    """
+    轉成 COPY text format 的欄位值
+    """
+    if value is None:
+        return "\\N"
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+def _copy_line(row) -> str:
+    return "\t".join(_copy_value(v) for v in row) + "\n"
+
+class CopyStream:
+    """
+    把 row generator 包成 copy_expert 可讀取的 file-like 物件，
+    邊產生邊送出，不需要先把整張表的內容放進記憶體
+    """
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ""
+        self.count = 0
+
+    def read(self, size: int = -1) -> str:
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = _copy_line(row)
+            parts.append(line)
+            length += len(line)
+            self.count += 1
+        data = "".join(parts)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    readline = read
+
+def copy_rows(cursor, table: str, columns, rows) -> int:
+    """
+    以 COPY FROM STDIN 寫入並印出 rows/s
+    """
+    stream = CopyStream(rows)
+    started = time.perf_counter()
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream)
+    elapsed = time.perf_counter() - started
+    rate = stream.count / elapsed if elapsed > 0 else float("inf")
+    print(f"[INFO] COPY {table}: {stream.count} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+    return stream.count
+
+def copy_partitioned_purchases(cursor, columns, rows) -> int:
+    """
+    purchase_histories 依交易月份直接 COPY 進各月分區，不經由父表逐列判斷分區
+    來源的交易時間沒有排序：先依月份寫到暫存檔，建立缺少的分區後每個分區各 COPY 一次
+    """
+    date_index = columns.index("transaction_date")
+    spools = {}
+    counts = Counter()
+    started = time.perf_counter()
+    try:
+        for row in rows:
+            value = row[date_index]
+            month = date(int(value[:4]), int(value[5:7]), 1)
+            spool = spools.get(month)
+            if spool is None:
+                spool = spools[month] = tempfile.TemporaryFile("w+", encoding="utf-8")
+            spool.write(_copy_line(row))
+            counts[month] += 1
+
+        partitions.ensure_partitions(cursor, spools)
+        for month, spool in sorted(spools.items()):
+            spool.seek(0)
+            cursor.copy_expert(f"COPY {partitions.partition_name(month)} ({', '.join(columns)}) FROM STDIN", spool)
+    finally:
+        for spool in spools.values():
+            spool.close()
+
+    total = sum(counts.values())
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed > 0 else float("inf")
+    print(f"[INFO] COPY purchase_histories: {total} rows into {len(spools)} monthly partitions "
+          f"in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+    return total
+
+# bulk 匯入 COPY 的資料表 (purchase_histories 另由 m0005 在載入後建立索引與外鍵)
+BULK_TABLES = ("pharmacies", "pharmacy_opening_hours", "masks", "users")
+
+def _bulk_table_indexes():
+    """
+    m0002 / m0003 建立在 BULK_TABLES 上的索引：(index, table, columns, unique)
+    """
+    indexes = [index for index in catalog_keys.KEY_INDEXES if index[1] in BULK_TABLES]
+    indexes += [(name, table, columns, False) for name, table, columns in hot_query_indexes.INDEXES
+                if table in BULK_TABLES]
+    return indexes
 
-    # (2) 匯入 pharmacies.json
-    import_pharmacies("./data/pharmacies.json")
+def defer_bulk_table_keys(cursor):
+    """
+    COPY 前 (與 COPY 同一個 transaction) 先拿掉 BULK_TABLES 的索引與外鍵並停用 trigger：
+    m0002 / m0003 需在 m0004 分區前套用，建表時就已建立，否則每一列都要檢查唯一性與外鍵、
+    觸發 NOTIFY 與版本遞增的 trigger；由 restore_bulk_table_keys() 在載入後重建
+    """
+    for table, name, _, _ in catalog_keys.FOREIGN_KEYS:
+        if table in BULK_TABLES:
+            cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+    for name, _, _, _ in _bulk_table_indexes():
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+    for table in BULK_TABLES:
+        cursor.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+
+def restore_bulk_table_keys():
+    """
+    bulk 匯入後重建 BULK_TABLES 的索引與外鍵 (一次建立與驗證) 並啟用 trigger
+    載入期間沒有逐列的 NOTIFY 與版本遞增：改為遞增一次 catalog 版本，並以 TRUNCATE 的格式通知整張表
+    來源有重複的自然鍵時在這裡才失敗 (資料已載入)，修正來源後以 --mode bulk 重新匯入
+    """
+    conn = get_connection()
+    try:
+        started = time.perf_counter()
+        with conn.cursor() as cursor:
+            for name, table, columns, unique in _bulk_table_indexes():
+                cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+            for table, name, column, ref_table in catalog_keys.FOREIGN_KEYS:
+                if table in BULK_TABLES:
+                    cursor.execute(f"""
+                    ALTER TABLE {table} ADD CONSTRAINT {name}
+                        FOREIGN KEY ({column}) REFERENCES {ref_table}(id)
+                        ON DELETE CASCADE
+                    """)
+            for table in BULK_TABLES:
+                cursor.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+            cursor.execute("SELECT nextval('catalog_version_seq'), nextval('balance_version_seq')")
+            for table in ("pharmacies", "masks", "pharmacy_opening_hours"):
+                cursor.execute("SELECT pg_notify(%s, %s)", (catalog_keys.CATALOG_CHANNEL, table))
+        conn.commit()
+        print(f"[INFO] Catalog keys and triggers restored in {time.perf_counter() - started:.2f}s.")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def bulk_import(pharmacies_json_path: str, users_json_path: str):
+    """
+    適合大量資料的匯入方式 (假設資料表剛建立且為空)：
+    - id 在 client 端依序配發，建立 name -> id 與 (pharmacy_id, mask_name) -> id 對照表，
+      不需要每筆購買紀錄都回 DB 查詢
+    - 每張表各用一次 COPY 串流寫入，來源檔逐筆串流讀取 (每張表各讀一遍)
+    - 購買紀錄依月份直接寫入 purchase_histories 的各月分區
+    - 所有表的索引、外鍵與 trigger 都在資料載入後才建立或啟用 (defer_bulk_table_keys)
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        defer_bulk_table_keys(cursor)
+
+        pharmacy_ids = {}
+        mask_ids = {}
+
+        def pharmacy_rows():
+            for pharmacy_id, item in enumerate(iter_records(pharmacies_json_path), start=1):
+                pharmacy_ids.setdefault(item["name"], pharmacy_id)
+                yield (pharmacy_id, item["name"], float(item.get("cashBalance", 0)), pharmacy_hash(item))
+
+        def mask_rows():
+            mask_id = 0
+            for pharmacy_id, item in enumerate(iter_records(pharmacies_json_path), start=1):
+                for m in item.get("masks", []):
+                    mask_id += 1
+                    mask_ids.setdefault((pharmacy_id, m["name"]), mask_id)
+                    yield (mask_id, pharmacy_id, m["name"], float(m["price"]), mask_hash(m))
+
+        copy_rows(cursor, "pharmacies", ("id", "name", "cash_balance", "content_hash"), pharmacy_rows())
+        copy_rows(cursor, "pharmacy_opening_hours", ("pharmacy_id", "day_of_week", "open_time", "close_time"), (
+            (pharmacy_id, dow, open_t, close_t)
+            for pharmacy_id, item in enumerate(iter_records(pharmacies_json_path), start=1)
+            for (dow, open_t, close_t) in parse_opening_hours(item.get("openingHours", ""))
+        ))
+        copy_rows(cursor, "masks", ("id", "pharmacy_id", "name", "price", "content_hash"), mask_rows())
+
+        copy_rows(cursor, "users", ("id", "name", "cash_balance", "content_hash"), (
+            (user_id, u["name"], float(u.get("cashBalance", 0)), user_hash(u))
+            for user_id, u in enumerate(iter_records(users_json_path), start=1)
+        ))
+
+        skipped = []
+
+        def purchase_rows():
+            for user_id, u in enumerate(iter_records(users_json_path), start=1):
+                histories = u.get("purchaseHistories", [])
+                for ph, key in zip(histories, purchase_keys(u["name"], histories)):
+                    pharmacy_id = pharmacy_ids.get(ph["pharmacyName"])
+                    if pharmacy_id is None:
+                        skipped.append(ph["pharmacyName"])
+                        continue
+                    mask_name = ph.get("maskName", "")
+                    yield (
+                        user_id,
+                        pharmacy_id,
+                        mask_ids.get((pharmacy_id, mask_name)),
+                        mask_name,
+                        1,
+                        float(ph.get("transactionAmount", 0)),
+                        ph.get("transactionDate", DEFAULT_TRANSACTION_DATE),
+                        key,
+                        purchase_hash(ph),
+                    )
+
+        copy_partitioned_purchases(cursor,
+                                   ("user_id", "pharmacy_id", "mask_id", "mask_name", "quantity",
+                                    "transaction_amount", "transaction_date", "etl_key", "content_hash"),
+                                   purchase_rows())
+        if skipped:
+            print(f"[WARN] Skipped {len(skipped)} purchases of unknown pharmacies, e.g. '{skipped[0]}'.")
+
+        # id 由 client 配發，需同步 sequence
+        for table in ("pharmacies", "masks", "users"):
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table}"
+            )
 
-    # (3) 匯入 users.json
-    import_users("./data/users.json")
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print("[ERROR] Failed to bulk import:", e)
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+# === 8) 由 purchase_histories 重建每日消費彙總 ===
+def refresh_spend_rollups(cursor, days=None):
+    """
+    重新計算 user_daily_spend / daily_spend
+    days=None 時重建全部，否則只重算指定的日子 (list of date)
+    """
+    purchase_filter = rollup_filter = ""
+    if days is None:
+        cursor.execute("TRUNCATE user_daily_spend, daily_spend")
+    elif not days:
+        return
+    else:
+        cursor.execute("DELETE FROM user_daily_spend WHERE day = ANY(%(days)s)", {"days": days})
+        cursor.execute("DELETE FROM daily_spend WHERE day = ANY(%(days)s)", {"days": days})
+        purchase_filter = "AND transaction_date::date = ANY(%(days)s)"
+        rollup_filter = "WHERE day = ANY(%(days)s)"
+
+    cursor.execute(f"""
+    INSERT INTO user_daily_spend (user_id, day, total_quantity, total_amount)
+    SELECT user_id, transaction_date::date, sum(quantity), sum(transaction_amount)
+    FROM purchase_histories
+    WHERE transaction_date IS NOT NULL {purchase_filter}
+    GROUP BY user_id, transaction_date::date;
+
+    INSERT INTO daily_spend (day, shard, total_quantity, total_amount)
+    SELECT day, user_id %% %(shards)s, sum(total_quantity), sum(total_amount)
+    FROM user_daily_spend
+    {rollup_filter}
+    GROUP BY day, user_id %% %(shards)s;
+    """, {"days": days, "shards": DAILY_SPEND_SHARDS})
+    print(f"[INFO] Spend rollups refreshed ({'all days' if days is None else f'{len(days)} days'}).")
+
+def rebuild_spend_rollups(days=None):
+    """
+    API 在購買時會即時累加，匯入或修正歷史資料後再執行這裡
+    days 見 refresh_spend_rollups；回傳是否成功
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        refresh_spend_rollups(cursor, days)
+        conn.commit()
+        cursor.close()
+        return True
+    except Exception as e:
+        print("[ERROR] Failed to rebuild spend rollups:", e)
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+# === 9) 主程式：建表 & 從JSON匯入 ===
+def main():
+    parser = argparse.ArgumentParser(description="Create tables and import pharmacies / users JSON.")
+    parser.add_argument("--mode", choices=["default", "bulk", "incremental"], default="default",
+                        help="bulk: COPY-based loader for large files; "
+                             "incremental: keep existing data and upsert only new or changed rows")
+    parser.add_argument("--pharmacies", default="./data/pharmacies.json", help="JSON array or NDJSON file")
+    parser.add_argument("--users", default="./data/users.json", help="JSON array or NDJSON file")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="records per commit")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="parser processes (1 = no pool)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    if args.mode == "bulk":
+        # (1) 建表 (purchase_histories 的索引與外鍵延後)，(2)(3) COPY 匯入 (其餘表的索引、外鍵與 trigger
+        # 在同一個 transaction 內先拿掉) 後再重建，(4) 重建每日消費彙總
+        create_tables(defer_constraints=True)
+        bulk_import(args.pharmacies, args.users)
+        restore_bulk_table_keys()
+        apply_migrations()
+        create_search_indexes()
+        rebuild_spend_rollups()
+        return
+
+    # default / incremental：分段 commit，中斷後重新執行同一個指令會從 checkpoint 繼續
+    checkpoint = Checkpoint(args.checkpoint, args.mode, {"pharmacies": args.pharmacies, "users": args.users})
+    resuming = not args.restart and checkpoint.load()
+    if resuming:
+        print(f"[INFO] Resuming from checkpoint {args.checkpoint}.")
+    else:
+        checkpoint.save()
+
+    # (1) 建表：default 模式重新開始時才刪表，incremental 只補上缺少的結構
+    create_tables(drop_existing=args.mode == "default" and not resuming)
+    create_search_indexes()
+
+    # (2) 匯入 pharmacies
+    import_pharmacies(args.pharmacies, checkpoint, args.chunk_size, args.workers)
+
+    # (3) 匯入 users
+    import_users(args.users, checkpoint, args.chunk_size, args.workers)
+
+    # (4) 每日消費彙總：default 全部重建，incremental 只重算有變動的日子
+    days = None if args.mode == "default" else checkpoint.dirty_days()
+    if rebuild_spend_rollups(days):
+        checkpoint.clear()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# migrate.py
+"""
+套用 migrations/ 中的 schema migration，或檢查路由查詢的執行計畫
+
+    cd src/kdan_backend
+    python migrate.py                # 套用所有尚未套用的 migration
+    python migrate.py status         # 列出已套用 / 尚未套用的版本
+    python migrate.py check-plans    # 對路由的查詢執行 EXPLAIN，有 Seq Scan 或沒有剪枝到對應月份分區時以非 0 結束
+    python migrate.py partitions     # 建立未來月份的 purchase_histories 分區 / 卸離過期分區 (放進 cron，例如每小時)
+"""
+import argparse
+import json
+import sys
+from datetime import datetime
+import psycopg2
+import migrations
+from migrations import partitions
+from app.config import PARTITION_MONTHS_AHEAD, PARTITION_RETENTION_MONTHS, get_database_url
+
+def status(conn) -> None:
+    applied = migrations.applied_versions(conn)
+    for migration in migrations.load_migrations():
+        state = "applied" if migration.version in applied else "pending"
+        print(f"{migration.version:04d}_{migration.name}: {state}")
+
+# 頭尾不滿一天，同時涵蓋彙總表與原始交易兩個部分
+PRUNED_RANGE = (datetime(2021, 1, 1, 12), datetime(2021, 1, 31, 12))
+# 有 transaction_date 條件的查詢，purchase_histories 只應掃描 PRUNED_RANGE 涵蓋的月份分區
+PRUNED_QUERIES = ("GET /users/top_spenders", "GET /users/transactions/summary")
+
+def plan_queries():
+    """
+    路由實際使用的查詢 (參數為代表值)
+    載入整張表建立 in-process 索引的查詢 (營業時間、搜尋、價格) 本來就需要全表掃描，不在此列
+    """
+    from sqlalchemy import select
+    from app.models import BalanceLedger, Mask, Pharmacy, PurchaseHistory, User
+    from app.utils.pagination import DEFAULT_PAGE_SIZE, keyset_query
+    from app.utils.price_index import count_filter_query
+    from app.utils.rollup_helper import top_spenders_query, transaction_summary_query
+
+    start, end = PRUNED_RANGE
+    return {
+        "GET /pharmacies/all_pharmacies": keyset_query(select(Pharmacy), [Pharmacy.id], [1], DEFAULT_PAGE_SIZE),
+        "GET /pharmacies/open": select(Pharmacy).where(Pharmacy.id.in_([1, 2, 3])).order_by(Pharmacy.id),
+        "GET /pharmacies/{id}/masks (cache miss)": (select(Mask.id, Mask.name, Mask.price, Mask.pharmacy_id)
+                                                    .where(Mask.pharmacy_id.in_([1]))
+                                                    .order_by(Mask.pharmacy_id, Mask.id)),
+        "GET /pharmacies/filter (FILTER_BACKEND=sql)": count_filter_query("gt", 2, 10, 50),
+        "GET /pharmacies/all_masks": keyset_query(
+            select(Mask.id, Mask.name, Mask.pharmacy_id, Mask.price, Pharmacy.name.label("pharmacy_name")).join(Pharmacy),
+            [Mask.pharmacy_id, Mask.id], [1, 1], DEFAULT_PAGE_SIZE),
+        "GET /users": keyset_query(select(User), [User.id], [1], DEFAULT_PAGE_SIZE),
+        "GET /users/{id}/purchases": keyset_query(select(PurchaseHistory).where(PurchaseHistory.user_id == 1),
+                                                  [PurchaseHistory.id], [1], DEFAULT_PAGE_SIZE),
+        "GET /users/top_spenders": top_spenders_query(start, end, 5),
+        "GET /users/transactions/summary": transaction_summary_query(start, end),
+        "POST /users/{id}/purchase (lock pharmacies)": (select(Pharmacy.id).where(Pharmacy.id.in_([1, 2]))
+                                                        .order_by(Pharmacy.id).with_for_update()),
+        "POST /users/{id}/purchase (masks)": select(Mask.id, Mask.pharmacy_id).where(Mask.id.in_([1, 2])),
+        "BALANCE_MODE=ledger pending balances": (select(BalanceLedger.account_id)
+                                                 .where(BalanceLedger.account_type == "pharmacy",
+                                                        BalanceLedger.account_id.in_([1, 2]))),
+    }
+
+def seq_scans(plan: dict):
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan.get("Relation Name")
+    for child in plan.get("Plans", ()):
+        yield from seq_scans(child)
+
+def scanned_partitions(plan: dict):
+    name = plan.get("Relation Name") or ""
+    if name.startswith(f"{partitions.PARENT}_"):
+        yield name
+    for child in plan.get("Plans", ()):
+        yield from scanned_partitions(child)
+
+def check_plans() -> int:
+    """
+    關閉 enable_seqscan 後執行 EXPLAIN：仍出現 Seq Scan 表示該查詢沒有可用的索引
+    (資料量小時 planner 本來就會選 Seq Scan，不能直接看預設的執行計畫)
+    PRUNED_QUERIES 另外檢查 purchase_histories 是否只掃描查詢範圍內的月份分區
+    """
+    from app.database import engine
+
+    failures = 0
+    with engine.connect() as conn:
+        conn.exec_driver_sql("SET enable_seqscan = off")
+        for name, query in plan_queries().items():
+            compiled = query.compile(dialect=engine.dialect, compile_kwargs={"render_postcompile": True})
+            result = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+            plan = (json.loads(result) if isinstance(result, str) else result)[0]["Plan"]
+            tables = sorted(set(seq_scans(plan)))
+            if tables:
+                failures += 1
+                print(f"[SEQ SCAN] {name}: {', '.join(tables)}")
+            else:
+                print(f"[OK] {name}")
+            if name in PRUNED_QUERIES:
+                failures += check_pruning(name, plan)
+        conn.rollback()
+    return failures
+
+def check_pruning(name: str, plan: dict) -> int:
+    start, end = PRUNED_RANGE
+    expected = {partitions.partition_name(month) for month in partitions.months_between(start.date(), end.date())}
+    scanned = set(scanned_partitions(plan))
+    extra = sorted(scanned - expected)
+    if extra:
+        print(f"[NOT PRUNED] {name}: also scans {', '.join(extra)}")
+        return 1
+    print(f"[PRUNED] {name}: {', '.join(sorted(scanned)) or 'no partition'}")
+    return 0
+
+def maintain_partitions(conn) -> None:
+    with conn.cursor() as cursor:
+        if not partitions.try_lock_maintenance(cursor):
+            conn.rollback()
+            print("[INFO] Partition maintenance is already running elsewhere; skipped.")
+            return
+        created, detached = partitions.maintain(cursor, PARTITION_MONTHS_AHEAD, PARTITION_RETENTION_MONTHS)
+    conn.commit()
+    print(f"[INFO] Partitions created: {', '.join(m.strftime('%Y-%m') for m in created) or 'none'}; "
+          f"detached: {', '.join(detached) or 'none'}.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations or check query plans.")
+    parser.add_argument("command", nargs="?", choices=["upgrade", "status", "check-plans", "partitions"],
+                        default="upgrade")
+    args = parser.parse_args()
+
+    if args.command == "check-plans":
+        sys.exit(1 if check_plans() else 0)
+
+    conn = psycopg2.connect(get_database_url())
+    try:
+        if args.command == "status":
+            status(conn)
+        elif args.command == "partitions":
+            maintain_partitions(conn)
+        else:
+            applied = migrations.upgrade(conn)
+            print(f"[INFO] {len(applied)} migration(s) applied.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
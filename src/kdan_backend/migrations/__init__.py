@@ -0,0 +1,120 @@
+# migrations/__init__.py
+"""
+版本化的 schema migration，資料表、索引、外鍵與 trigger 都只在這裡定義
+- 每個 migration 為 m<4 位數版本>_<名稱>.py，提供 upgrade(cursor)，可設定：
+  TRANSACTIONAL = False: 不在 transaction 內執行 (例如 CREATE INDEX CONCURRENTLY)
+  DEFERRABLE = True: 只建立索引、外鍵或 trigger，bulk 匯入可在資料載入後才套用
+  (只有排在所有非 DEFERRABLE 之後的才會延後，版本順序不變；例如 m0004 需在 m0002 / m0003 之後執行，
+   m0002 / m0003 在其他表上建立的部分由 etl.py 的 bulk 匯入自行在 COPY 前後拿掉與重建)
+- 已套用的 migration 不再修改，調整既有的 schema 一律新增版本
+- 已套用的版本記錄在 schema_migrations，以 advisory lock 避免多個 process 同時升級
+- app/models.py 只是 ORM 對應，不再用來建表
+"""
+import importlib
+import pkgutil
+from typing import Callable, List, NamedTuple, Set
+
+MIGRATIONS_TABLE = "schema_migrations"
+# pg_advisory_lock 的 key，同時只允許一個 process 執行 migration
+LOCK_KEY = 7_061_016
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable
+    transactional: bool
+    deferrable: bool
+
+def load_migrations() -> List[Migration]:
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        name = module_info.name
+        if not (name.startswith("m") and name[1:5].isdigit()):
+            continue
+        module = importlib.import_module(f"{__name__}.{name}")
+        migrations.append(Migration(
+            version=int(name[1:5]),
+            name=name[6:],
+            upgrade=module.upgrade,
+            transactional=getattr(module, "TRANSACTIONAL", True),
+            deferrable=getattr(module, "DEFERRABLE", False),
+        ))
+    migrations.sort()
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Duplicate migration versions: {versions}")
+    return migrations
+
+def applied_versions(conn) -> Set[int]:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (MIGRATIONS_TABLE,))
+        if not cursor.fetchone()[0]:
+            versions = set()
+        else:
+            cursor.execute(f"SELECT version FROM {MIGRATIONS_TABLE}")
+            versions = {version for version, in cursor.fetchall()}
+    conn.rollback()
+    return versions
+
+def pending_migrations(conn, skip_deferrable: bool = False) -> List[Migration]:
+    """
+    尚未套用的 migration；skip_deferrable=True 時去掉最後一個非 DEFERRABLE 之後的 DEFERRABLE migration
+    (排在非 DEFERRABLE 之前的仍要先套用，後面的 migration 可能依賴它建立的物件或改寫它套用的表)
+    """
+    applied = applied_versions(conn)
+    pending = [m for m in load_migrations() if m.version not in applied]
+    if skip_deferrable:
+        while pending and pending[-1].deferrable:
+            pending.pop()
+    return pending
+
+def _apply(conn, migration: Migration) -> None:
+    if migration.transactional:
+        with conn.cursor() as cursor:
+            migration.upgrade(cursor)
+            cursor.execute(f"INSERT INTO {MIGRATIONS_TABLE} (version, name) VALUES (%s, %s)",
+                           (migration.version, migration.name))
+        conn.commit()
+        return
+    # 非 transactional：每個 statement 各自 commit，全部完成後才記錄版本，中途失敗時下次會重跑
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            migration.upgrade(cursor)
+            cursor.execute(f"INSERT INTO {MIGRATIONS_TABLE} (version, name) VALUES (%s, %s)",
+                           (migration.version, migration.name))
+    finally:
+        conn.autocommit = False
+
+def upgrade(conn, skip_deferrable: bool = False) -> List[Migration]:
+    """
+    依版本順序套用尚未套用的 migration，回傳這次套用的
+    skip_deferrable=True 時略過最後面的 DEFERRABLE migration (之後再呼叫一次 upgrade 補上)
+    """
+    conn.rollback()
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+        """)
+    conn.autocommit = False
+    try:
+        applied = []
+        for migration in pending_migrations(conn, skip_deferrable):
+            print(f"[INFO] Applying migration {migration.version:04d}_{migration.name}...")
+            _apply(conn, migration)
+            applied.append(migration)
+        return applied
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+        conn.autocommit = False
@@ -0,0 +1,109 @@
+# migrations/m0001_tables.py
+"""
+ENUM 與資料表 (欄位、主鍵)；索引、外鍵與 trigger 見 m0002
+皆為 IF NOT EXISTS，套用在 migration 之前由舊版 etl.py 建立的資料庫上也不會出錯
+"""
+
+CREATE_ENUM = """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'day_of_week_enum') THEN
+            CREATE TYPE day_of_week_enum AS ENUM ('Mon','Tue','Wed','Thur','Fri','Sat','Sun');
+        END IF;
+    END$$;
+    """
+
+CREATE_TABLES = """
+    CREATE TABLE IF NOT EXISTS pharmacies (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        cash_balance DOUBLE PRECISION DEFAULT 0,
+        content_hash CHAR(32)
+    );
+
+    CREATE TABLE IF NOT EXISTS pharmacy_opening_hours (
+        id SERIAL PRIMARY KEY,
+        pharmacy_id INT NOT NULL,
+        day_of_week day_of_week_enum NOT NULL,
+        open_time TIME NOT NULL,
+        close_time TIME NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS masks (
+        id SERIAL PRIMARY KEY,
+        pharmacy_id INT NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        price DOUBLE PRECISION DEFAULT 0,
+        content_hash CHAR(32)
+    );
+
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        cash_balance DOUBLE PRECISION DEFAULT 0,
+        content_hash CHAR(32)
+    );
+
+    CREATE TABLE IF NOT EXISTS purchase_histories (
+        id SERIAL PRIMARY KEY,
+        user_id INT NOT NULL,
+        pharmacy_id INT NOT NULL,
+        mask_id INT,
+        mask_name VARCHAR(255),
+        quantity INT DEFAULT 1,
+        transaction_amount DOUBLE PRECISION DEFAULT 0,
+        transaction_date TIMESTAMP,
+        etl_key TEXT,
+        content_hash CHAR(32)
+    );
+    """
+
+# 舊版建立的資料表補上增量匯入用的欄位
+UPGRADE_ETL_COLUMNS = """
+    ALTER TABLE pharmacies ADD COLUMN IF NOT EXISTS content_hash CHAR(32);
+    ALTER TABLE masks ADD COLUMN IF NOT EXISTS content_hash CHAR(32);
+    ALTER TABLE users ADD COLUMN IF NOT EXISTS content_hash CHAR(32);
+    ALTER TABLE purchase_histories ADD COLUMN IF NOT EXISTS etl_key TEXT;
+    ALTER TABLE purchase_histories ADD COLUMN IF NOT EXISTS content_hash CHAR(32);
+    """
+
+# BALANCE_MODE=ledger 使用：只 append 餘額異動，由 API 背景 rollup 併回 cash_balance
+CREATE_BALANCE_LEDGER = """
+    CREATE TABLE IF NOT EXISTS balance_ledger (
+        id BIGSERIAL PRIMARY KEY,
+        account_type VARCHAR(16) NOT NULL,
+        account_id INT NOT NULL,
+        delta DOUBLE PRECISION NOT NULL,
+        created_at TIMESTAMP DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS ix_balance_ledger_account ON balance_ledger (account_type, account_id);
+    """
+
+# 每日消費彙總：top_spenders / transactions/summary 的完整日子直接讀這兩張表
+CREATE_SPEND_ROLLUPS = """
+    CREATE TABLE IF NOT EXISTS user_daily_spend (
+        user_id INT NOT NULL,
+        day DATE NOT NULL,
+        total_quantity BIGINT NOT NULL DEFAULT 0,
+        total_amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day),
+        CONSTRAINT fk_user
+            FOREIGN KEY (user_id) REFERENCES users(id)
+            ON DELETE CASCADE
+    );
+    CREATE INDEX IF NOT EXISTS ix_user_daily_spend_day ON user_daily_spend (day);
+    CREATE TABLE IF NOT EXISTS daily_spend (
+        day DATE NOT NULL,
+        shard SMALLINT NOT NULL,
+        total_quantity BIGINT NOT NULL DEFAULT 0,
+        total_amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, shard)
+    );
+    """
+
+def upgrade(cursor):
+    cursor.execute(CREATE_ENUM)
+    cursor.execute(CREATE_TABLES)
+    cursor.execute(UPGRADE_ETL_COLUMNS)
+    cursor.execute(CREATE_BALANCE_LEDGER)
+    cursor.execute(CREATE_SPEND_ROLLUPS)
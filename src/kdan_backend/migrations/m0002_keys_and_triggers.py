@@ -0,0 +1,171 @@
+# migrations/m0002_keys_and_triggers.py
+"""
+自然鍵與分頁索引、外鍵、資料版本 (ETag) 與 catalog NOTIFY 的 trigger
+bulk 匯入時在 COPY 之後才套用，一次建立與驗證
+"""
+
+DEFERRABLE = True
+
+# unique 的為自然鍵，供 ON CONFLICT 使用；其餘為列表路由 keyset 分頁的排序索引
+# (index, table, columns, unique)
+KEY_INDEXES = [
+    ("ux_pharmacies_name", "pharmacies", "name", True),
+    ("ux_masks_pharmacy_name", "masks", "pharmacy_id, name", True),
+    ("ux_users_name", "users", "name", True),
+    ("ux_purchase_histories_etl_key", "purchase_histories", "etl_key", True),
+    ("ix_masks_pharmacy_id", "masks", "pharmacy_id, id", False),
+    ("ix_masks_pharmacy_price", "masks", "pharmacy_id, price, id", False),
+    ("ix_masks_price_pharmacy", "masks", "price, pharmacy_id", False),
+    ("ix_purchase_histories_user_id", "purchase_histories", "user_id, id", False),
+]
+
+# (table, constraint, column, referenced table)
+FOREIGN_KEYS = [
+    ("pharmacy_opening_hours", "fk_pharmacy", "pharmacy_id", "pharmacies"),
+    ("masks", "fk_pharmacy", "pharmacy_id", "pharmacies"),
+    ("purchase_histories", "fk_user", "user_id", "users"),
+    ("purchase_histories", "fk_pharmacy", "pharmacy_id", "pharmacies"),
+    ("purchase_histories", "fk_mask", "mask_id", "masks"),
+]
+
+def create_foreign_keys(cursor):
+    """
+    建立 FOREIGN_KEYS 中尚未存在的外鍵
+    """
+    for table, name, column, ref_table in FOREIGN_KEYS:
+        cursor.execute(f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conname = '{name}' AND conrelid = '{table}'::regclass
+            ) THEN
+                ALTER TABLE {table} ADD CONSTRAINT {name}
+                    FOREIGN KEY ({column}) REFERENCES {ref_table}(id)
+                    ON DELETE CASCADE;
+            END IF;
+        END$$;
+        """)
+
+# API 以 sequence 的值作為資料版本 (ETag)，寫入 commit 時由 trigger 遞增
+# sequence 不隨資料表刪除，重新匯入後版本仍只會往上加，client 手上的舊 ETag 不會誤判為相同
+# (trigger, table, events, sequence, when)
+VERSION_TRIGGERS = [
+    ("trg_pharmacies_catalog_version", "pharmacies", "INSERT OR DELETE OR UPDATE OF name", "catalog_version_seq", None),
+    ("trg_pharmacies_balance_version", "pharmacies", "UPDATE OF cash_balance", "balance_version_seq", None),
+    ("trg_masks_catalog_version", "masks", "INSERT OR UPDATE OR DELETE", "catalog_version_seq", None),
+    ("trg_opening_hours_catalog_version", "pharmacy_opening_hours", "INSERT OR UPDATE OR DELETE",
+     "catalog_version_seq", None),
+    ("trg_balance_ledger_balance_version", "balance_ledger", "INSERT", "balance_version_seq",
+     "NEW.account_type = 'pharmacy'"),
+]
+
+def create_version_triggers(cursor):
+    """
+    建立 VERSION_TRIGGERS 中尚未存在的 trigger，並遞增一次所有版本
+    使用 DEFERRABLE INITIALLY DEFERRED 的 constraint trigger，在 commit 時才 nextval，
+    sequence 不受 transaction 影響也不需要鎖，並行的寫入不會互相等待
+    """
+    cursor.execute("""
+    CREATE SEQUENCE IF NOT EXISTS catalog_version_seq;
+    CREATE SEQUENCE IF NOT EXISTS balance_version_seq;
+
+    CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+    BEGIN
+        PERFORM nextval(TG_ARGV[0]::regclass);
+        RETURN NULL;
+    END$$ LANGUAGE plpgsql;
+    """)
+    for name, table, events, sequence, when in VERSION_TRIGGERS:
+        when_clause = f"WHEN ({when})" if when else ""
+        cursor.execute(f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = '{name}' AND tgrelid = '{table}'::regclass
+            ) THEN
+                CREATE CONSTRAINT TRIGGER {name}
+                    AFTER {events} ON {table}
+                    DEFERRABLE INITIALLY DEFERRED
+                    FOR EACH ROW {when_clause}
+                    EXECUTE FUNCTION bump_data_version('{sequence}');
+            END IF;
+        END$$;
+        """)
+    # constraint trigger 不支援 TRUNCATE，另建 statement trigger
+    for table, sequences in (("pharmacies", ("catalog_version_seq", "balance_version_seq")),
+                             ("masks", ("catalog_version_seq",)),
+                             ("pharmacy_opening_hours", ("catalog_version_seq",))):
+        for sequence in sequences:
+            name = f"trg_{table}_truncate_{sequence.split('_')[0]}"
+            cursor.execute(f"""
+            DROP TRIGGER IF EXISTS {name} ON {table};
+            CREATE TRIGGER {name} AFTER TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version('{sequence}');
+            """)
+    cursor.execute("SELECT nextval('catalog_version_seq'), nextval('balance_version_seq')")
+
+# API 的 catalog 快取以 LISTEN 接收異動，payload 為 "table[.column]:藥局 id"，TRUNCATE 時只有 "table"
+# NOTIFY 在 commit 時才送出，同一個 transaction 內相同的 payload 只會送一次
+# 需與 app/utils/catalog_listener.py 的 CATALOG_CHANNEL 相同
+CATALOG_CHANNEL = "catalog_changes"
+# (trigger, table, events, touched, 藥局 id 欄位, when)
+NOTIFY_TRIGGERS = [
+    ("trg_pharmacies_notify", "pharmacies", "INSERT OR DELETE", "pharmacies", "id", None),
+    ("trg_pharmacies_name_notify", "pharmacies", "UPDATE OF name", "pharmacies.name", "id",
+     "OLD.name IS DISTINCT FROM NEW.name"),
+    ("trg_masks_notify", "masks", "INSERT OR UPDATE OR DELETE", "masks", "pharmacy_id", None),
+    ("trg_opening_hours_notify", "pharmacy_opening_hours", "INSERT OR UPDATE OR DELETE",
+     "pharmacy_opening_hours", "pharmacy_id", None),
+]
+
+def create_notify_triggers(cursor):
+    """
+    建立 NOTIFY_TRIGGERS 與 TRUNCATE 的 statement trigger (已存在時重建)
+    UPDATE 同時通知新舊兩個藥局 id (口罩換到其他藥局時兩邊都要失效)
+    """
+    cursor.execute(f"""
+    CREATE OR REPLACE FUNCTION notify_catalog_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_LEVEL = 'STATEMENT' THEN
+            PERFORM pg_notify('{CATALOG_CHANNEL}', TG_ARGV[0]);
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM pg_notify('{CATALOG_CHANNEL}', TG_ARGV[0] || ':' || (to_jsonb(OLD) ->> TG_ARGV[1]));
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM pg_notify('{CATALOG_CHANNEL}', TG_ARGV[0] || ':' || (to_jsonb(NEW) ->> TG_ARGV[1]));
+        END IF;
+        RETURN NULL;
+    END$$ LANGUAGE plpgsql;
+    """)
+    for name, table, events, touched, key_column, when in NOTIFY_TRIGGERS:
+        when_clause = f"WHEN ({when})" if when else ""
+        cursor.execute(f"""
+        DROP TRIGGER IF EXISTS {name} ON {table};
+        CREATE TRIGGER {name} AFTER {events} ON {table}
+            FOR EACH ROW {when_clause}
+            EXECUTE FUNCTION notify_catalog_change('{touched}', '{key_column}');
+        """)
+    for table in ("pharmacies", "masks", "pharmacy_opening_hours"):
+        cursor.execute(f"""
+        DROP TRIGGER IF EXISTS trg_{table}_truncate_notify ON {table};
+        CREATE TRIGGER trg_{table}_truncate_notify AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_change('{table}');
+        """)
+
+def create_key_indexes(cursor):
+    """
+    建立 KEY_INDEXES 中尚未存在的索引
+    """
+    for name, table, columns, unique in KEY_INDEXES:
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def upgrade(cursor):
+    create_key_indexes(cursor)
+    create_foreign_keys(cursor)
+    create_version_triggers(cursor)
+    create_notify_triggers(cursor)
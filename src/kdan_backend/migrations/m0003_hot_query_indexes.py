@@ -0,0 +1,29 @@
+# migrations/m0003_hot_query_indexes.py
+"""
+熱門查詢的次要索引，以 CREATE INDEX CONCURRENTLY 建立，不會擋住線上的寫入
+其餘熱門查詢已由 m0002 的索引涵蓋：
+- purchase_histories(user_id): ix_purchase_histories_user_id (user_id, id)
+- masks(pharmacy_id, price): ix_masks_pharmacy_price (pharmacy_id, price, id)
+- masks(pharmacy_id, name): ux_masks_pharmacy_name
+"""
+
+TRANSACTIONAL = False
+DEFERRABLE = True
+
+# (index, table, columns)
+INDEXES = [
+    # top_spenders / transactions/summary 頭尾不滿一天的部分掃原始交易
+    ("ix_purchase_histories_transaction_date", "purchase_histories", "transaction_date"),
+    ("ix_opening_hours_day_pharmacy", "pharmacy_opening_hours", "day_of_week, pharmacy_id"),
+]
+
+def upgrade(cursor):
+    for name, table, columns in INDEXES:
+        # 先前中斷的 CONCURRENTLY 會留下 INVALID 的索引，IF NOT EXISTS 會略過它，需先刪除
+        cursor.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+        """, (name,))
+        if cursor.fetchone():
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
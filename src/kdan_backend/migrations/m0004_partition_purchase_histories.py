@@ -0,0 +1,78 @@
+# migrations/m0004_partition_purchase_histories.py
+"""
+purchase_histories 改為依 transaction_date 每月分區 (見 migrations/partitions.py)
+- 既有資料搬進新的分區表後刪除舊表，id 沿用原本的 sequence；整個過程在同一個 transaction 內，
+  資料量大時請在維護時段執行
+- 分區表的 unique 索引需包含分區欄位：主鍵為 (id, transaction_date)，自然鍵為 (etl_key, transaction_date)
+  (etl_key 本身已含交易時間，唯一性不變)
+- transaction_date 為分區欄位，改為 NOT NULL；舊資料為 NULL 的以 etl.py 的預設交易時間補上
+- m0002 / m0003 在舊表上建立的索引與外鍵隨舊表一起刪除，由 m0005 在分區表上以相同名稱重建
+  (m0002 / m0003 已發布，不修改；新的資料庫也是先套用它們再分區)
+- 不是 DEFERRABLE：bulk 匯入可直接 COPY 進各月分區，索引與外鍵由 m0005 在匯入後建立
+"""
+from datetime import date
+from migrations.partitions import (
+    DEFAULT_PARTITION,
+    MONTHS_AHEAD,
+    PARENT,
+    add_months,
+    ensure_partitions,
+    is_partitioned,
+    month_start,
+    months_between
+)
+
+# 需與 etl.py 的 DEFAULT_TRANSACTION_DATE 相同
+DEFAULT_TRANSACTION_DATE = "2021-01-01 00:00:00"
+
+COLUMNS = ("id, user_id, pharmacy_id, mask_id, mask_name, quantity, transaction_amount, transaction_date, "
+           "etl_key, content_hash")
+
+CREATE_PARTITIONED = f"""
+    CREATE SEQUENCE IF NOT EXISTS {PARENT}_id_seq;
+    CREATE TABLE {PARENT} (
+        id INT NOT NULL DEFAULT nextval('{PARENT}_id_seq'),
+        user_id INT NOT NULL,
+        pharmacy_id INT NOT NULL,
+        mask_id INT,
+        mask_name VARCHAR(255),
+        quantity INT DEFAULT 1,
+        transaction_amount DOUBLE PRECISION DEFAULT 0,
+        transaction_date TIMESTAMP NOT NULL,
+        etl_key TEXT,
+        content_hash CHAR(32),
+        PRIMARY KEY (id, transaction_date)
+    ) PARTITION BY RANGE (transaction_date);
+    ALTER SEQUENCE {PARENT}_id_seq OWNED BY {PARENT}.id;
+    CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT;
+    """
+
+def upgrade(cursor):
+    if is_partitioned(cursor):
+        return
+    cursor.execute(f"ALTER TABLE {PARENT} RENAME TO {PARENT}_legacy")
+    # 索引名稱不隨表改名，先讓出主鍵的名稱 (其餘索引在刪除舊表後由 m0005 以原名稱重建)
+    cursor.execute(f"ALTER INDEX IF EXISTS {PARENT}_pkey RENAME TO {PARENT}_legacy_pkey")
+    # SERIAL 的 sequence 屬於舊表，刪除舊表前先解除，改由新表的 id 使用
+    cursor.execute(f"ALTER SEQUENCE IF EXISTS {PARENT}_id_seq OWNED BY NONE")
+    cursor.execute(CREATE_PARTITIONED)
+
+    # 舊資料涵蓋的月份 + 本月起 MONTHS_AHEAD 個月
+    cursor.execute(f"""
+    SELECT min(COALESCE(transaction_date, %(default)s)), max(COALESCE(transaction_date, %(default)s))
+    FROM {PARENT}_legacy
+    """, {"default": DEFAULT_TRANSACTION_DATE})
+    first, last = cursor.fetchone()
+    current = month_start(date.today())
+    months = months_between(current, add_months(current, MONTHS_AHEAD))
+    if first is not None:
+        months += months_between(first.date(), last.date())
+    ensure_partitions(cursor, months)
+
+    cursor.execute(f"""
+    INSERT INTO {PARENT} ({COLUMNS})
+    SELECT id, user_id, pharmacy_id, mask_id, mask_name, quantity, transaction_amount,
+           COALESCE(transaction_date, %(default)s), etl_key, content_hash
+    FROM {PARENT}_legacy
+    """, {"default": DEFAULT_TRANSACTION_DATE})
+    cursor.execute(f"DROP TABLE {PARENT}_legacy CASCADE")
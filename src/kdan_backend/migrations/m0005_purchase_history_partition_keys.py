@@ -0,0 +1,44 @@
+# migrations/m0005_purchase_history_partition_keys.py
+"""
+分區後的 purchase_histories 的索引與外鍵 (m0002 / m0003 建立在舊表上的，已由 m0004 隨舊表刪除)
+建立在父表上的索引與外鍵會套用到每個分區，之後新增的分區也會自動建立
+bulk 匯入時在 COPY 之後才套用
+"""
+
+DEFERRABLE = True
+
+# (index, columns, unique)
+INDEXES = [
+    # 自然鍵，供 etl.py 的 ON CONFLICT 使用
+    ("ux_purchase_histories_etl_key", "etl_key, transaction_date", True),
+    # GET /users/{id}/purchases 的 keyset 分頁；沒有日期條件，每個分區各自走索引後 Merge Append
+    ("ix_purchase_histories_user_id", "user_id, id", False),
+    # top_spenders / transactions/summary 頭尾不滿一天的部分，先依日期剪枝到單月分區再走索引
+    ("ix_purchase_histories_transaction_date", "transaction_date", False),
+]
+
+# (constraint, column, referenced table)
+FOREIGN_KEYS = [
+    ("fk_user", "user_id", "users"),
+    ("fk_pharmacy", "pharmacy_id", "pharmacies"),
+    ("fk_mask", "mask_id", "masks"),
+]
+
+def upgrade(cursor):
+    for name, columns, unique in INDEXES:
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} "
+                       f"ON purchase_histories ({columns})")
+    for name, column, ref_table in FOREIGN_KEYS:
+        cursor.execute(f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conname = '{name}' AND conrelid = 'purchase_histories'::regclass
+            ) THEN
+                ALTER TABLE purchase_histories ADD CONSTRAINT {name}
+                    FOREIGN KEY ({column}) REFERENCES {ref_table}(id)
+                    ON DELETE CASCADE;
+            END IF;
+        END$$;
+        """)
@@ -0,0 +1,131 @@
+# migrations/partitions.py
+"""
+purchase_histories 依 transaction_date 每月一個 range partition (見 m0004)
+- 分區名稱為 purchase_histories_y<年>m<月>，範圍為 [該月 1 日, 下月 1 日)
+- purchase_histories_default 接收沒有對應月份分區的資料；之後建立該月分區時會把資料搬過去
+- 只用 cursor，migration、etl.py 與 API 的背景維護共用
+"""
+import re
+from datetime import date
+from typing import Iterable, List, Optional, Set, Tuple
+
+PARENT = "purchase_histories"
+DEFAULT_PARTITION = f"{PARENT}_default"
+# 預先建立未來幾個月的分區
+MONTHS_AHEAD = 3
+# pg_try_advisory_xact_lock 的 key，cron 與 API 的背景維護同時只有一個執行
+MAINTENANCE_LOCK_KEY = 7_061_021
+
+_NAME = re.compile(rf"^{PARENT}_y(\d{{4}})m(\d{{2}})$")
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def months_between(first: date, last: date) -> List[date]:
+    """
+    first 到 last (含) 的每個月的 1 日
+    """
+    months = []
+    month = month_start(first)
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_y{month.year}m{month.month:02d}"
+
+def partition_month(name: str) -> Optional[date]:
+    match = _NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+def is_partitioned(cursor) -> bool:
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (PARENT,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+def existing_months(cursor) -> Set[date]:
+    """
+    目前掛在 purchase_histories 下的月份分區
+    """
+    cursor.execute("""
+    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass
+    """, (PARENT,))
+    return {month for month in (partition_month(name) for name, in cursor.fetchall()) if month}
+
+def create_partition(cursor, month: date) -> None:
+    """
+    建立單月分區；預設分區裡已有這個月的資料時，先建成獨立的表、搬入資料再 ATTACH
+    (預設分區有符合範圍的資料時不能直接 CREATE ... PARTITION OF)
+    """
+    name = partition_name(month)
+    # 邊界以 '2021-01-01' 這樣的字串常數表示 (PG 11 以前的 partition bound 只接受常數)
+    params = {"lower": month.isoformat(), "upper": add_months(month, 1).isoformat()}
+    bounds = "FOR VALUES FROM (%(lower)s) TO (%(upper)s)"
+    cursor.execute(f"""
+    SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION}
+                   WHERE transaction_date >= %(lower)s AND transaction_date < %(upper)s)
+    """, params)
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT} {bounds}", params)
+        return
+    cursor.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS)")
+    cursor.execute(f"""
+    WITH moved AS (
+        DELETE FROM {DEFAULT_PARTITION}
+        WHERE transaction_date >= %(lower)s AND transaction_date < %(upper)s
+        RETURNING *
+    )
+    INSERT INTO {name} SELECT * FROM moved
+    """, params)
+    cursor.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} {bounds}", params)
+
+def ensure_partitions(cursor, months: Iterable[date]) -> List[date]:
+    """
+    建立尚未存在的月份分區，回傳這次建立的月份
+    """
+    existing = existing_months(cursor)
+    created = []
+    for month in sorted({month_start(m) for m in months} - existing):
+        create_partition(cursor, month)
+        created.append(month)
+    return created
+
+def detach_before(cursor, cutoff: date) -> List[str]:
+    """
+    把 cutoff 之前的月份分區自 purchase_histories 卸離，保留為獨立的表 (可另行封存或刪除)
+    每日消費彙總不受影響，top_spenders / transactions/summary 的完整日子仍算得到
+    """
+    detached = []
+    for month in sorted(existing_months(cursor)):
+        if month >= cutoff:
+            break
+        name = partition_name(month)
+        cursor.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+        detached.append(name)
+    return detached
+
+def try_lock_maintenance(cursor) -> bool:
+    """
+    取得維護用的 advisory lock (transaction 結束時釋放)，其他 process 正在維護時回傳 False
+    """
+    cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (MAINTENANCE_LOCK_KEY,))
+    return cursor.fetchone()[0]
+
+def maintain(cursor, months_ahead: int = MONTHS_AHEAD, retention_months: int = 0,
+             today: Optional[date] = None) -> Tuple[List[date], List[str]]:
+    """
+    建立本月到 months_ahead 個月後的分區；retention_months > 0 時卸離更早的分區
+    回傳 (建立的月份, 卸離的分區)；purchase_histories 尚未分區時不做任何事
+    """
+    if not is_partitioned(cursor):
+        return [], []
+    current = month_start(today or date.today())
+    created = ensure_partitions(cursor, months_between(current, add_months(current, months_ahead)))
+    detached = detach_before(cursor, add_months(current, -retention_months)) if retention_months > 0 else []
+    return created, detached
@@ -0,0 +1,45 @@
+# tests/conftest.py
+"""
+單元測試不需要 PostgreSQL：
+- app 以 src/kdan_backend 為根目錄 import (與 uvicorn / etl.py 相同)
+- 連線設定給預設值，engine 建立時不會連線；需要查詢的測試改用 SQLite in-memory
+"""
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "kdan_backend")
+sys.path.insert(0, APP_DIR)
+
+# .env 不會覆蓋已存在的環境變數；空值 (例如 POSTGRES_PORT=) 也換成預設值
+for name, value in {
+    "POSTGRES_USER": "postgres",
+    "POSTGRES_PASSWORD": "postgres",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_DB": "kdan",
+}.items():
+    if not os.environ.get(name):
+        os.environ[name] = value
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+@pytest.fixture
+def sqlite_db(monkeypatch):
+    """
+    以 ORM 的定義建表的 SQLite session (分區、trigger 等 PostgreSQL 專屬的部分不會建立)
+    """
+    from app.database import Base
+    from app.models import PurchaseHistory
+
+    # SQLite 的複合主鍵不能 autoincrement，測試資料一律自行給 id
+    monkeypatch.setattr(PurchaseHistory.__table__.c.id, "autoincrement", False)
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine, autoflush=False)()
+    try:
+        yield db
+    finally:
+        db.close()
+        engine.dispose()
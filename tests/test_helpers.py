@@ -0,0 +1,115 @@
+# tests/test_helpers.py
+import asyncio
+import threading
+from datetime import date, datetime, time
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.util import greenlet_spawn
+from app.database import run_on_primary
+from app.utils.catalog_listener import parse_notifications
+from app.utils.pagination import NUMBER, decode_cursor, encode_cursor
+from app.utils.query_profiler import fingerprint, is_read_only
+from app.utils.rollup_helper import inclusive_end, split_range
+from etl import purchase_keys
+
+def _bounds(conditions):
+    """
+    split_range 的條件 (ts >= a AND ts < / <= b) -> (a, 運算子, b)
+    """
+    result = []
+    for condition in conditions:
+        lower, upper = condition.clauses
+        result.append((lower.right.value, upper.operator.__name__, upper.right.value))
+    return result
+
+def test_split_range_whole_days_and_partial_ends():
+    full, raw = split_range(datetime(2021, 1, 1, 10), datetime(2021, 1, 5, 8))
+    assert full == (date(2021, 1, 2), date(2021, 1, 4))
+    assert _bounds(raw) == [
+        (datetime(2021, 1, 1, 10), "lt", datetime(2021, 1, 2)),
+        (datetime(2021, 1, 5), "le", datetime(2021, 1, 5, 8)),
+    ]
+
+def test_split_range_end_of_day_is_whole_day():
+    full, raw = split_range(datetime(2021, 1, 1), datetime(2021, 1, 3, 23, 59, 59))
+    assert full == (date(2021, 1, 1), date(2021, 1, 3))
+    assert raw == []
+    assert inclusive_end(datetime(2021, 1, 3, 23, 59, 59)) == datetime.combine(date(2021, 1, 3), time.max)
+    assert inclusive_end(datetime(2021, 1, 3, 23, 59, 58)) == datetime(2021, 1, 3, 23, 59, 58)
+
+@pytest.mark.parametrize("start,end", [
+    (datetime(2021, 1, 1, 10), datetime(2021, 1, 1, 20)),
+    (datetime(2021, 1, 1, 10), datetime(2021, 1, 2, 9)),
+    (datetime(2021, 1, 3), datetime(2021, 1, 2)),
+])
+def test_split_range_without_whole_day(start, end):
+    full, raw = split_range(start, end)
+    assert full is None
+    assert _bounds(raw) == [(start, "le", end)]
+
+def test_parse_notifications():
+    changes = parse_notifications(["masks:3", "masks.price:4", "pharmacies.name:3", "users", "pharmacies"])
+    assert changes.touched == {"masks", "masks.price", "pharmacies.name", "users", "pharmacies"}
+    # TRUNCATE (沒有 id) 讓整張表都視為寫入；不在 ROW_KEYS 的表不記錄 id
+    assert changes.keys == {"masks": {3, 4}, "pharmacies": None}
+    assert not parse_notifications([])
+
+def test_fingerprint_groups_statements_by_shape():
+    assert fingerprint("SELECT * FROM masks WHERE name = 'it''s' AND price > 10.5") == \
+        "SELECT * FROM masks WHERE name = ? AND price > ?"
+    assert fingerprint("SELECT id FROM users\n  WHERE id IN (%(id_1)s, %(id_2)s, %(id_3)s)") == \
+        fingerprint("SELECT id FROM users WHERE id IN ($1)") == "SELECT id FROM users WHERE id IN (...)"
+
+@pytest.mark.parametrize("statement,expected", [
+    ("SELECT * FROM masks", True),
+    ("  with t as (select 1) select * from t", True),
+    ("SELECT * FROM masks WHERE name = 'DELETE me'", True),
+    ("SELECT * FROM masks FOR UPDATE", False),
+    ("WITH d AS (DELETE FROM balance_ledger RETURNING *) SELECT * FROM d", False),
+    ("UPDATE masks SET price = 1", False),
+])
+def test_is_read_only(statement, expected):
+    assert is_read_only(statement) is expected
+
+def test_decode_cursor_round_trip():
+    assert decode_cursor(None, [int]) is None
+    assert decode_cursor(encode_cursor(["Mask", 3]), [str, int]) == ["Mask", 3]
+    assert decode_cursor(encode_cursor([12.5, 7]), [NUMBER, int]) == [12.5, 7]
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    encode_cursor([1])[:-1] + "$",
+    "bm90IGpzb24",  # "not json"
+    encode_cursor({"id": 1}),
+    encode_cursor([1]),
+    encode_cursor(["1", 2]),
+    encode_cursor([True, 2]),
+    encode_cursor([2 ** 63, 2]),
+    encode_cursor([1.5, 2]),
+])
+def test_decode_cursor_rejects_tampered_cursor(cursor):
+    with pytest.raises(HTTPException) as info:
+        decode_cursor(cursor, [int, int])
+    assert info.value.status_code == 400
+
+def test_purchase_keys_number_items_of_one_checkout():
+    histories = [{"transactionDate": "2021-01-01 10:00:00"}, {"transactionDate": "2021-01-01 10:00:00"},
+                 {"transactionDate": "2021-01-02 09:00:00"}, {"transactionDate": "2021-01-01 10:00:00"}]
+    assert purchase_keys("Alice", histories) == [
+        "Alice|2021-01-01 10:00:00", "Alice|2021-01-01 10:00:00|1",
+        "Alice|2021-01-02 09:00:00", "Alice|2021-01-01 10:00:00|2",
+    ]
+
+def test_run_on_primary_uses_session_outside_event_loop():
+    db = SimpleNamespace(info={})
+    assert run_on_primary(db, lambda primary: (primary, threading.get_ident())) == (db, threading.get_ident())
+
+def test_run_on_primary_rebuilds_off_the_event_loop_thread():
+    # DB_ASYNC=true 的路由在 run_sync 的 greenlet 內呼叫
+    async def route():
+        loop_thread = threading.get_ident()
+        return loop_thread, await greenlet_spawn(run_on_primary, SimpleNamespace(info={}),
+                                                 lambda primary: threading.get_ident())
+    loop_thread, build_thread = asyncio.run(route())
+    assert build_thread != loop_thread
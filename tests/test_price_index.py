@@ -0,0 +1,34 @@
+# tests/test_price_index.py
+import random
+import pytest
+from app.models import Mask, Pharmacy
+from app.utils.price_index import PriceRangeIndex, build_price_index, count_filter_query
+
+@pytest.fixture
+def catalog(sqlite_db):
+    rng = random.Random(11)
+    # 藥局 1 沒有口罩，其餘 0 ~ 6 個，價格含區間的邊界值
+    sqlite_db.add_all(Pharmacy(id=pid, name=f"Pharmacy {pid}") for pid in range(1, 31))
+    mask_id = 0
+    for pid in range(2, 31):
+        for _ in range(rng.randint(0, 6)):
+            mask_id += 1
+            sqlite_db.add(Mask(id=mask_id, pharmacy_id=pid, name=f"Mask {mask_id}",
+                               price=rng.choice([5.0, 10.0, 12.5, 20.0, 30.0, 49.99, 50.0])))
+    sqlite_db.commit()
+    return sqlite_db
+
+@pytest.mark.parametrize("count_op,count_value,count_max", [
+    ("gt", 0, None), ("gt", 2, None), ("gte", 3, None), ("lt", 1, None), ("lt", 3, None),
+    ("lte", 2, None), ("eq", 0, None), ("eq", 2, None), ("between", 1, 3), ("between", 4, 4),
+])
+@pytest.mark.parametrize("price_min,price_max", [(0, 100), (10, 50), (12.5, 12.5), (20, 10)])
+def test_index_matches_sql(catalog, count_op, count_value, count_max, price_min, price_max):
+    index = build_price_index(catalog)
+    expected = catalog.execute(count_filter_query(count_op, count_value, price_min, price_max, count_max)).scalars().all()
+    assert index.filter(count_op, count_value, price_min, price_max, count_max) == expected
+
+def test_pharmacies_without_masks_count_as_zero():
+    index = PriceRangeIndex([3, 1, 2], [(2, 10.0), (2, None), (3, 99.0)])
+    assert index.filter("eq", 0, 0, 50) == [1, 3]
+    assert index.filter("gte", 1, 0, 50) == [2]
@@ -0,0 +1,113 @@
+# tests/test_purchase_analytics.py
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import delete, update
+from app.config import DAILY_SPEND_SHARDS
+from app.models import DailySpend, Mask, Pharmacy, PurchaseHistory, User, UserDailySpend
+from app.utils import purchase_analytics
+from app.utils.purchase_analytics import (
+    PurchaseSnapshot, revenue_by_mask, revenue_by_mask_query, revenue_by_pharmacy, revenue_by_pharmacy_query,
+    top_spenders, transaction_summary,
+)
+from app.utils.rollup_helper import top_spenders_query, transaction_summary_query
+
+pytest.importorskip("numpy")
+
+START = datetime(2021, 1, 1)
+
+@pytest.fixture
+def purchases(sqlite_db, monkeypatch):
+    """
+    隨機的購買紀錄與對應的 user_daily_spend / daily_spend；
+    金額為 0.5 的倍數 (加總沒有誤差)，含金額相同的使用者、NULL 的 quantity / mask_id 與 23:59:59 之後的交易
+    """
+    rng = random.Random(5)
+    db = sqlite_db
+    db.add_all(Pharmacy(id=pid, name=f"Pharmacy {pid}") for pid in range(1, 6))
+    db.add_all(Mask(id=mid, pharmacy_id=mid % 5 + 1, name=f"Mask {mid}", price=10) for mid in range(1, 11))
+    db.add_all(User(id=uid, name=f"User {uid}") for uid in range(1, 23))
+
+    per_user_day = defaultdict(lambda: [0, 0.0])
+    per_day_shard = defaultdict(lambda: [0, 0.0])
+    for pid in range(1, 301):
+        user_id = rng.randint(1, 20)
+        ts = START + timedelta(seconds=rng.randint(0, 10 * 86400 - 1))
+        if pid % 25 == 0:
+            ts = ts.replace(hour=23, minute=59, second=59, microsecond=500_000)
+        quantity = None if pid % 40 == 0 else rng.randint(1, 5)
+        amount = rng.randint(1, 200) / 2
+        db.add(PurchaseHistory(id=pid, user_id=user_id, pharmacy_id=rng.randint(1, 5),
+                               mask_id=None if pid % 30 == 0 else rng.randint(1, 10),
+                               quantity=quantity, transaction_amount=amount, transaction_date=ts))
+        for totals in (per_user_day[(user_id, ts.date())], per_day_shard[(ts.date(), user_id % DAILY_SPEND_SHARDS)]):
+            totals[0] += quantity or 0
+            totals[1] += amount
+    # 只在第一天消費、金額相同的兩個使用者，排序依 user_id
+    for uid in (22, 21):
+        ts = START + timedelta(hours=1)
+        db.add(PurchaseHistory(id=1000 + uid, user_id=uid, pharmacy_id=1, mask_id=1,
+                               quantity=1, transaction_amount=5000, transaction_date=ts))
+        for totals in (per_user_day[(uid, ts.date())], per_day_shard[(ts.date(), uid % DAILY_SPEND_SHARDS)]):
+            totals[0] += 1
+            totals[1] += 5000
+    db.add_all(UserDailySpend(user_id=uid, day=day, total_quantity=q, total_amount=a)
+               for (uid, day), (q, a) in per_user_day.items())
+    db.add_all(DailySpend(day=day, shard=shard, total_quantity=q, total_amount=a)
+               for (day, shard), (q, a) in per_day_shard.items())
+    db.flush()
+    # quantity 有 ORM 預設值，NULL 要另外寫入
+    db.execute(update(PurchaseHistory).where(PurchaseHistory.id % 40 == 0).values(quantity=None))
+    db.commit()
+
+    monkeypatch.setattr(purchase_analytics, "purchase_snapshot", PurchaseSnapshot())
+    return db
+
+RANGES = [
+    (START, START + timedelta(days=30)),
+    (START + timedelta(days=2), START + timedelta(days=5, hours=23, minutes=59, seconds=59)),
+    (START + timedelta(days=1, hours=6), START + timedelta(days=3, hours=12)),
+    (START + timedelta(days=4, hours=1), START + timedelta(days=4, hours=20)),
+    (START + timedelta(days=3), START + timedelta(days=2)),
+]
+
+@pytest.mark.parametrize("start,end", RANGES)
+def test_top_spenders_matches_sql(purchases, start, end):
+    expected = [tuple(row) for row in purchases.execute(top_spenders_query(start, end, 5))]
+    assert top_spenders(purchases, start, end, 5) == expected
+
+@pytest.mark.parametrize("start,end", RANGES)
+def test_transaction_summary_matches_sql(purchases, start, end):
+    quantity, amount = purchases.execute(transaction_summary_query(start, end)).one()
+    assert transaction_summary(purchases, start, end) == (quantity or 0, amount or 0.0)
+
+@pytest.mark.parametrize("start,end", RANGES)
+def test_revenue_matches_sql(purchases, start, end):
+    assert revenue_by_pharmacy(purchases, start, end, 3) == [
+        tuple(row) for row in purchases.execute(revenue_by_pharmacy_query(start, end, 3))]
+    assert revenue_by_mask(purchases, start, end, 4) == [
+        tuple(row) for row in purchases.execute(revenue_by_mask_query(start, end, 4))]
+
+def test_refresh_picks_up_new_purchases(purchases, monkeypatch):
+    monkeypatch.setattr(purchase_analytics, "ANALYTICS_REFRESH_INTERVAL", 0)
+    end = START + timedelta(days=30)
+    before = transaction_summary(purchases, START, end)
+    purchases.add(PurchaseHistory(id=2000, user_id=1, pharmacy_id=1, mask_id=1, quantity=2,
+                                  transaction_amount=7.5, transaction_date=START + timedelta(days=9)))
+    purchases.commit()
+    assert transaction_summary(purchases, START, end) == (before[0] + 2, before[1] + 7.5)
+    assert purchase_analytics.purchase_snapshot.stats()["segments"] == 2
+
+def test_top_spenders_skips_deleted_users(purchases, monkeypatch):
+    monkeypatch.setattr(purchase_analytics, "ANALYTICS_REFRESH_INTERVAL", 3600)
+    start, end = RANGES[0]
+    top_spenders(purchases, start, end, 5)
+    # 快照不會因刪除使用者而重建，刪除的使用者由後面的名次遞補
+    purchases.execute(delete(UserDailySpend).where(UserDailySpend.user_id.in_([21, 22])))
+    purchases.execute(delete(PurchaseHistory).where(PurchaseHistory.user_id.in_([21, 22])))
+    purchases.execute(delete(User).where(User.id.in_([21, 22])))
+    purchases.commit()
+    expected = [tuple(row) for row in purchases.execute(top_spenders_query(start, end, 5))]
+    assert len(expected) == 5
+    assert top_spenders(purchases, start, end, 5) == expected
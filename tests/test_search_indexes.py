@@ -0,0 +1,163 @@
+# tests/test_search_indexes.py
+import random
+import time
+from types import SimpleNamespace
+import pytest
+from app.utils import suggest_index as suggest_module
+from app.utils.catalog_index import TouchedTables
+from app.utils.ngram_index import NgramIndex, SearchDoc
+from app.utils.suggest_index import SuggestCatalog, Suggestion, SuggestIndex, normalize
+
+DOCS = [
+    SearchDoc("mask", 3, 1, "Mask Blue", 10.0),
+    SearchDoc("pharmacy", 2, 2, "Mask Pharmacy", None),
+    SearchDoc("mask", 1, 2, "Mask Green", 12.0),
+    SearchDoc("pharmacy", 1, 1, "Better Mask", None),
+    SearchDoc("mask", 2, 1, "Blue Mask", 8.0),
+    SearchDoc("pharmacy", 3, 3, "Carepharm", None),
+]
+
+def _brute_force(docs, q):
+    hits = []
+    for doc in docs:
+        pos = doc.name.lower().find(q.lower())
+        if pos >= 0:
+            hits.append(((pos - 100, 0 if doc.kind == "pharmacy" else 1, doc.id), doc))
+    return sorted(hits, key=lambda hit: hit[0])
+
+def test_ngram_ties_list_pharmacies_first_then_by_id():
+    hits, has_more = NgramIndex(DOCS).search("mask", 10)
+    assert not has_more
+    assert [(doc.kind, doc.id) for _, doc in hits] == [
+        # 位置 0
+        ("pharmacy", 2), ("mask", 1), ("mask", 3),
+        # 位置 5
+        ("mask", 2),
+        # 位置 7
+        ("pharmacy", 1),
+    ]
+    assert [key[0] for key, _ in hits] == [-100, -100, -100, -95, -93]
+
+@pytest.mark.parametrize("q", ["mask", "blue mask", "m", "ma", "e", "pharm", "xyz", ""])
+def test_ngram_matches_brute_force(q):
+    hits, _ = NgramIndex(DOCS).search(q, 100)
+    assert hits == _brute_force(DOCS, q)
+
+def test_ngram_cursor_pages_through_every_hit_once():
+    rng = random.Random(7)
+    words = ["mask", "blue", "care", "pack", "smile"]
+    docs = [SearchDoc(rng.choice(["pharmacy", "mask"]), i, i, " ".join(rng.sample(words, 3)), None)
+            for i in range(200)]
+    index = NgramIndex(docs)
+    expected = _brute_force(docs, "ma")
+
+    pages, after = [], None
+    while True:
+        hits, has_more = index.search("ma", 7, after)
+        pages.extend(hits)
+        if not has_more:
+            break
+        after = list(hits[-1][0])
+    assert pages == expected
+
+def test_suggest_prefers_name_start_then_pharmacy_count():
+    index = SuggestIndex([
+        Suggestion("mask", "Green Mask", 5, 1),
+        Suggestion("mask", "MaskT (green) (10 per pack)", 2, 2),
+        Suggestion("pharmacy", "Mask Depot", 1, 3),
+        Suggestion("mask", "Mask Max", 2, 4),
+    ])
+    assert [s.name for s in index.suggest("mask", 10)] == [
+        "Mask Max", "MaskT (green) (10 per pack)", "Mask Depot", "Green Mask",
+    ]
+    assert [s.name for s in index.suggest("GREEN", 10)] == ["Green Mask", "MaskT (green) (10 per pack)"]
+    assert index.suggest("mask", 1) == [Suggestion("mask", "Mask Max", 2, 4)]
+    assert index.suggest("nothing", 10) == []
+
+def test_normalize_strips_punctuation():
+    assert normalize("MaskT (green)  (10 per pack)") == "maskt green 10 per pack"
+
+def test_suggest_precomputed_prefixes_match_scan(monkeypatch):
+    # SCAN_LIMIT 調小，讓大部分前綴都走預先計算的 top-k
+    monkeypatch.setattr(suggest_module, "SCAN_LIMIT", 4)
+    rng = random.Random(3)
+    words = ["mask", "masks", "max", "blue", "black", "care", "cart", "pack"]
+    suggestions = [Suggestion(rng.choice(["pharmacy", "mask"]), f"{' '.join(rng.sample(words, 2))} {i}",
+                              rng.randint(1, 5), i) for i in range(300)]
+    index = SuggestIndex(suggestions)
+    assert index.stats()["precomputed"] > 0
+    for q in ["m", "ma", "mas", "mask", "b", "bl", "c", "car", "pack", "max 1"]:
+        expected = sorted(
+            (s for s in index.suggestions
+             if normalize(s.name).startswith(q) or f" {q}" in f" {normalize(s.name)}"[1:]),
+            key=lambda s: (not normalize(s.name).startswith(q), index.suggestions.index(s)),
+        )
+        assert index.suggest(q, suggest_module.TOP_K) == expected[:suggest_module.TOP_K], q
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_suggest_catalog_keeps_index_when_refresh_fails():
+    db = SimpleNamespace(info={})
+    data = {1: [("pharmacy", "Alpha", 1), ("mask", "MaskT", 10)],
+            2: [("pharmacy", "Beta", 2), ("mask", "MaskT", 11)]}
+    catalog = SuggestCatalog(ttl=0, delay=0)
+    load = lambda _db, full, pending: ({pid: list(v) for pid, v in data.items()} if full
+                                       else {pid: data.get(pid, []) for pid in pending})
+    catalog._load = load
+    assert catalog.get(db).suggest("mask", 5) == [Suggestion("mask", "MaskT", 2, 10)]
+
+    del data[2]
+    catalog._pending.add(2)
+
+    def fail(*args):
+        raise RuntimeError("database unavailable")
+    catalog._load = fail
+    with pytest.raises(RuntimeError):
+        catalog._refresh(db)
+    # 失敗時保留原本的索引與待處理的藥局
+    assert catalog._index.suggest("mask", 5) == [Suggestion("mask", "MaskT", 2, 10)]
+    assert catalog._pending == {2}
+
+    # 已有索引時不等待：先回傳原本的索引，由背景 thread 重建後換上
+    catalog._load = load
+    assert catalog.get(db).suggest("mask", 5) == [Suggestion("mask", "MaskT", 2, 10)]
+    _wait_until(catalog._is_fresh)
+    assert catalog.get(db).suggest("mask", 5) == [Suggestion("mask", "MaskT", 1, 10)]
+
+def test_suggest_catalog_merges_a_burst_of_writes():
+    db = SimpleNamespace(info={})
+    loads = []
+    catalog = SuggestCatalog(ttl=0, delay=0.2)
+
+    def load(_db, full, pending):
+        loads.append((full, set(pending)))
+        return {pid: [("pharmacy", f"Pharmacy {pid}", pid)] for pid in (pending or [1])}
+    catalog._load = load
+    catalog.get(db)
+
+    for pid in (2, 3, 4):
+        changes = TouchedTables()
+        changes.add("pharmacies.name", [pid])
+        catalog.on_write(changes)
+    _wait_until(catalog._is_fresh)
+    assert loads == [(True, set()), (False, {2, 3, 4})]
+    assert [s.name for s in catalog.get(db).suggest("pharmacy", 10)] == [f"Pharmacy {pid}" for pid in (1, 2, 3, 4)]
+
+def test_suggest_catalog_keeps_invalidate_during_refresh():
+    db = SimpleNamespace(info={})
+    catalog = SuggestCatalog(ttl=0, delay=60)
+    catalog._load = lambda _db, full, pending: {1: [("pharmacy", "Alpha", 1)]}
+    catalog.get(db)
+
+    def load(_db, full, pending):
+        # 例如 TRUNCATE 的 NOTIFY 在載入期間到達
+        catalog.invalidate()
+        return {pid: [] for pid in pending}
+    catalog._load = load
+    catalog._pending.add(1)
+    catalog._refresh(db)
+    assert catalog._full_reload